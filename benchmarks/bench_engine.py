@@ -0,0 +1,244 @@
+"""
+Microbenchmarks of the game engine hot paths.
+
+Each scenario is a seeded headless game (server/headless.py) played for
+--warmup-ticks with the bots of the config, so that the trains have wagons
+and the passengers are spread. The hot paths are then timed on it for
+--rounds rounds, and a full game of --game-seconds is played, for each number
+of trains. Results are written as JSON, to compare two branches:
+
+    python -m benchmarks.bench_engine config.json --output main.json
+    git checkout my-branch
+    python -m benchmarks.bench_engine config.json --output branch.json --compare main.json
+
+With --compare, the benchmarks whose fastest round is slower than in the
+reference by more than --threshold are listed, and the exit code is 1 if there are any. Compare
+results of the same machine only.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from common.config import Config
+from common.messages import StateMessage, parse_client_message
+from server.headless import run_headless_game
+
+TRAIN_COUNTS = [2, 4, 8, 16, 32]
+CLIENT_MESSAGES = [
+    {"action": "direction", "direction": [0, 1]},
+    {"action": "drop_wagon"},
+    {"action": "respawn"},
+    {"type": "pong", "t": 12.5},
+]
+
+
+def build_scenario(config, nb_trains, seed, warmup_ticks):
+    """Game played for warmup_ticks by bots, the same for a given seed"""
+    config = config.model_copy()
+    config.game_duration_seconds = warmup_ticks / 60
+    games = []
+    run_headless_game(config, [], seed, nb_players=nb_trains, on_tick=lambda tick, game: games or games.append(game))
+    return games[0]
+
+
+# Each benchmark runs an operation calls times on a scenario and returns the time it took
+
+def bench_train_move(game, calls):
+    trains = [train for train in game.trains.values() if train.alive] or list(game.trains.values())
+    elapsed = 0.0
+    for i in range(calls):
+        train = trains[i % len(trains)]
+        start = time.perf_counter()
+        train.move(game.trains, game.game_width, game.game_height, game.cell_size)
+        elapsed += time.perf_counter() - start
+        if not train.alive:
+            train.set_alive(True)
+    return elapsed
+
+
+def bench_check_collisions(game, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        game.check_collisions()
+    return time.perf_counter() - start
+
+
+def bench_get_dirty_state(game, calls):
+    elapsed = 0.0
+    for _ in range(calls):
+        game.update(game.current_tick + 1)
+        start = time.perf_counter()
+        game.get_dirty_state()
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def bench_get_state(game, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        game.get_state()
+    return time.perf_counter() - start
+
+
+def bench_state_to_json(game, calls):
+    state = game.get_state()
+    start = time.perf_counter()
+    for _ in range(calls):
+        StateMessage(data=state).to_json()
+    return time.perf_counter() - start
+
+
+def bench_parse_client_message(game, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        parse_client_message(CLIENT_MESSAGES[i % len(CLIENT_MESSAGES)])
+    return time.perf_counter() - start
+
+
+def bench_safe_spawn_position(game, calls):
+    passenger = game.passengers[0]
+    start = time.perf_counter()
+    for _ in range(calls):
+        passenger.get_safe_spawn_position()
+    return time.perf_counter() - start
+
+
+MICROBENCHMARKS = [
+    ("Train.move", bench_train_move, 2000),
+    ("Game.check_collisions", bench_check_collisions, 200),
+    ("Game.get_dirty_state", bench_get_dirty_state, 200),
+    ("Game.get_state", bench_get_state, 200),
+    ("StateMessage.to_json", bench_state_to_json, 200),
+    ("Passenger.get_safe_spawn_position", bench_safe_spawn_position, 500),
+]
+
+
+def summarize(name, nb_trains, calls, timings):
+    per_call = [t / calls * 1e6 for t in timings]
+    return {
+        "name": name,
+        "trains": nb_trains,
+        "calls": calls,
+        "rounds": len(timings),
+        "median_us": statistics.median(per_call),
+        "min_us": min(per_call),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(config, train_counts, seed, warmup_ticks, rounds, game_seconds, games):
+    results = []
+    timings = [bench_parse_client_message(None, 5000) for _ in range(rounds)]
+    results.append(summarize("parse_client_message", None, 5000, timings))
+    for nb_trains in train_counts:
+        for name, bench, calls in MICROBENCHMARKS:
+            # A new scenario each round, so that every round times the same states
+            timings = [bench(build_scenario(config, nb_trains, seed, warmup_ticks), calls) for _ in range(rounds)]
+            results.append(summarize(name, nb_trains, calls, timings))
+            print(f"{name:<36}{nb_trains:>4} trains {results[-1]['median_us']:>12.2f} us", file=sys.stderr)
+
+        game_config = config.model_copy()
+        game_config.game_duration_seconds = game_seconds
+        timings = []
+        ticks = 0
+        for game_seed in range(seed, seed + games):
+            result = run_headless_game(game_config, [], game_seed, nb_players=nb_trains)
+            timings.append(result.elapsed)
+            ticks = result.ticks
+        entry = summarize("headless_game", nb_trains, 1, timings)
+        entry["ticks"] = ticks
+        entry["median_us_per_tick"] = entry["median_us"] / ticks if ticks else None
+        results.append(entry)
+        print(f"{'headless_game':<36}{nb_trains:>4} trains {entry['median_us'] / 1e6:>12.2f} s", file=sys.stderr)
+    return results
+
+
+def compare(results, reference, threshold):
+    """Return the benchmarks slower than in reference by more than threshold (1.1 for 10%)"""
+    # The fastest round is the least disturbed by the rest of the machine
+    reference_times = {(r["name"], r["trains"]): r["min_us"] for r in reference["results"]}
+    regressions = []
+    for result in results:
+        before = reference_times.get((result["name"], result["trains"]))
+        if before:
+            ratio = result["min_us"] / before
+            print(f"{result['name']:<36}{str(result['trains']):>5} {before:>12.2f} -> {result['min_us']:>12.2f} us  x{ratio:.2f}")
+            if ratio > threshold:
+                regressions.append((result["name"], result["trains"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config_file", nargs="?", default="config.json")
+    parser.add_argument("--trains", type=int, nargs="+", default=TRAIN_COUNTS)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warmup-ticks", type=int, default=1800)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--game-seconds", type=int, default=300)
+    parser.add_argument("--games", type=int, default=1, help="full games played per number of trains")
+    parser.add_argument("--output", help="JSON file of the results (stdout by default)")
+    parser.add_argument("--compare", metavar="REFERENCE", help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=1.10)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    config = Config.load(args.config_file).server
+    config.replay_dir = None
+
+    results = run(config, args.trains, args.seed, args.warmup_ticks, args.rounds, args.game_seconds, args.games)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seed": args.seed,
+            "warmup_ticks": args.warmup_ticks,
+            "rounds": args.rounds,
+            "game_seconds": args.game_seconds,
+            "agents": [agent.agent_file_name for agent in config.agents],
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        for key in ("seed", "warmup_ticks", "game_seconds", "agents"):
+            if reference["meta"].get(key) != report["meta"][key]:
+                print(f"Warning: the reference was run with {key}={reference['meta'].get(key)}, not {report['meta'][key]}")
+        regressions = compare(results, reference, args.threshold)
+        for name, trains, ratio in regressions:
+            print(f"Regression: {name} with {trains} trains is x{ratio:.2f} slower")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the cost of server logging per game tick.
+
+Plays the same headless games (server/headless.py) with the server loggers at
+DEBUG and at INFO, written directly by the game thread or through the queue of
+server/log_pipeline.py, and reports the mean time per tick of each setup. The
+records are written to os.devnull, so that the console speed does not count.
+The bots are the agents of the config.
+
+Run with:
+    python -m benchmarks.bench_logging [config.json] [--games N] [--players N] [--seconds S]
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from common.config import Config
+from server.headless import run_headless_game
+from server.log_pipeline import QueuedLogging
+
+
+def configure(level, queued):
+    """Set the server loggers to level, writing to os.devnull"""
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    root.addHandler(handler)
+    for name in ["server", "server.room", "server.game", "server.train", "server.passenger",
+                 "server.delivery_zone", "server.ai_client", "server.ai_agent", "server.headless"]:
+        logging.getLogger(name).setLevel(level)
+    return QueuedLogging() if queued else None
+
+
+def measure(config, games, players, level, queued):
+    pipeline = configure(level, queued)
+    ticks = 0
+    start = time.perf_counter()
+    for seed in range(games):
+        ticks += run_headless_game(config, [], seed, nb_players=players).ticks
+    elapsed = time.perf_counter() - start
+    if pipeline is not None:
+        # The records still queued are written after the measure, off the game thread
+        pipeline.stop()
+    return elapsed / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config_file", nargs="?", default="config.json")
+    parser.add_argument("--games", type=int, default=5)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seconds", type=int, default=60, help="game duration")
+    args = parser.parse_args()
+
+    config = Config.load(args.config_file).server
+    config.game_duration_seconds = args.seconds
+    config.replay_dir = None
+
+    setups = [
+        ("INFO, direct", logging.INFO, False),
+        ("INFO, queued", logging.INFO, True),
+        ("DEBUG, direct", logging.DEBUG, False),
+        ("DEBUG, queued", logging.DEBUG, True),
+    ]
+    # Warm up the imports and the agents
+    measure(config, 1, args.players, logging.CRITICAL, False)
+
+    print(f"{args.games} games of {args.seconds}s with {args.players} trains")
+    print(f"{'setup':<16}{'us per tick':>12}")
+    for name, level, queued in setups:
+        per_tick = measure(config, args.games, args.players, level, queued)
+        print(f"{name:<16}{per_tick * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Microbenchmark for the message codec in common/messages.py.
+
+Compares the Pydantic models against the fast-path codec on the messages
+exchanged on every tick, and reports messages per second for each.
+
+Run with:
+    python -m benchmarks.bench_messages [--iterations N]
+"""
+
+import argparse
+import json
+import time
+
+from common.messages import (
+    DeathMessage,
+    DirectionActionMessage,
+    DropWagonSuccessMessage,
+    PingMessage,
+    PING_BYTES,
+    decode_datagram,
+    decode_direction,
+    encode_death,
+    encode_direction_action,
+    encode_drop_wagon_success,
+    message_kind,
+    parse_client_message,
+)
+
+
+DIRECTION_DATAGRAM = DirectionActionMessage(direction=(0, 1)).to_json().encode()
+
+
+def pydantic_ping():
+    return PingMessage().to_json().encode()
+
+
+def codec_ping():
+    return PING_BYTES
+
+
+def pydantic_death():
+    return DeathMessage(remaining=4.25, reason="collision_with_train").to_json().encode()
+
+
+def codec_death():
+    return encode_death(4.25, "collision_with_train")
+
+
+def pydantic_drop_wagon_ack():
+    return DropWagonSuccessMessage(cooldown=10.0).to_json().encode()
+
+
+def codec_drop_wagon_ack():
+    return encode_drop_wagon_success(10.0)
+
+
+def pydantic_direction_out():
+    return DirectionActionMessage(direction=(0, 1)).to_json().encode()
+
+
+def codec_direction_out():
+    return encode_direction_action((0, 1))
+
+
+def pydantic_direction_in():
+    # Previous inbound path: split, json.loads, then validate with the model
+    for line in DIRECTION_DATAGRAM.decode().split("\n"):
+        if line:
+            return parse_client_message(json.loads(line)).direction
+
+
+def codec_direction_in():
+    for message in decode_datagram(DIRECTION_DATAGRAM):
+        if message_kind(message) == "direction":
+            return decode_direction(message)
+
+
+CASES = [
+    ("ping (out)", pydantic_ping, codec_ping),
+    ("death (out)", pydantic_death, codec_death),
+    ("drop_wagon_success (out)", pydantic_drop_wagon_ack, codec_drop_wagon_ack),
+    ("direction (client out)", pydantic_direction_out, codec_direction_out),
+    ("direction (server in)", pydantic_direction_in, codec_direction_in),
+]
+
+
+def messages_per_second(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f"{'message':<28} {'pydantic msg/s':>16} {'codec msg/s':>16} {'speedup':>8}")
+    print("-" * 71)
+    for name, pydantic_func, codec_func in CASES:
+        # Both paths must produce the same result
+        assert pydantic_func() == codec_func(), name
+        slow = messages_per_second(pydantic_func, args.iterations)
+        fast = messages_per_second(codec_func, args.iterations)
+        print(f"{name:<28} {slow:>16,.0f} {fast:>16,.0f} {fast / slow:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+Headless load generator for the game server.
+
+Simulates a swarm of manual, agent and observer clients from a single process,
+speaking the same protocol as client/network.py, and reports what the clients
+observe from the server:
+
+- tick lateness: how far the game clock of each room falls behind the wall
+  clock. States carry the remaining game time about once per second, computed
+  from the room's tick counter, so comparing its progress with the time
+  elapsed between two receptions shows how late the game loop is running.
+- state interval: time between two state messages received by a client. The
+  server sends at most one state per 1/REFERENCE_TICK_RATE s, and only when
+  something changed. This is not a delivery latency: states carry no send
+  time, so how late they arrive shows in the tick lateness instead.
+- server ping delay: one-way delay of the pings the server sends, from their
+  server timestamp to their reception. Server and clients must share the
+  monotonic clock, so it is only measured when the server is on loopback.
+- RTT: round-trip time of timestamped pings sent by the clients.
+- loss: pings that never got their pong.
+- stalled: clients that stopped receiving states during their game, which
+  then stop sending like a real client that lost the server.
+- bandwidth: bytes and messages received and sent.
+
+Start a server on loopback first (python -m server), then run for example:
+    python -m benchmarks.load_test --clients 200 --mix agent=3,manual=1 --duration 30
+
+Increase --clients until the tick lateness grows to find the number
+of rooms one server process can handle. Clients use nicknames load<N> and
+scipers from 900000 upwards, which end up in the server's stats database.
+"""
+
+import argparse
+import random
+import selectors
+import socket
+import time
+from collections import Counter
+
+from common.constants import REFERENCE_TICK_RATE
+from common.messages import (
+    AgentIdsMessage,
+    DROP_WAGON_ACTION_BYTES,
+    RESPAWN_ACTION_BYTES,
+    decode_datagram,
+    encode_direction_action,
+    encode_ping,
+    encode_pong,
+)
+
+DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+STATE_INTERVAL = 1.0 / REFERENCE_TICK_RATE
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+class SimulatedClient:
+    """A headless client with its own UDP socket"""
+
+    def __init__(self, index, game_mode, server_addr, rng):
+        self.index = index
+        self.game_mode = game_mode
+        self.server_addr = server_addr
+        self.random = rng
+        self.nickname = f"load{index}"
+        self.sciper = str(900000 + index)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("0.0.0.0", 0))
+        self.socket.setblocking(False)
+
+        self.last_state_time = None
+        self.clock_origin = None  # (reception time, remaining game time) of the first sample
+        self.min_clock_offset = 0.0  # Smallest lag of the game clock seen so far
+        self.next_action_time = 0.0
+        self.respawn_time = None
+        self.disconnected = False
+
+    def send(self, payload, stats):
+        try:
+            stats.bytes_out += self.socket.sendto(payload, self.server_addr)
+            stats.messages_out += 1
+        except (BlockingIOError, ConnectionResetError):
+            stats.send_errors += 1
+
+    def join(self, stats):
+        message = AgentIdsMessage(
+            nickname=self.nickname, agent_sciper=self.sciper, game_mode=self.game_mode
+        )
+        self.send(message.to_json().encode(), stats)
+
+    def handle(self, message, now, stats):
+        """React to a message from the server like the real client would"""
+        message_type = message.get("type")
+        stats.messages_in[message_type] += 1
+
+        if message_type == "state":
+            if self.last_state_time is not None:
+                stats.state_intervals.append(now - self.last_state_time)
+            self.last_state_time = now
+            remaining_time = message["data"].get("remaining_time")
+            if remaining_time is not None:
+                self.record_game_clock(now, remaining_time, stats)
+            # Agents decide on every state update, and only send when they turn
+            if self.game_mode == "agent" and self.random.random() < 0.05:
+                self.send(encode_direction_action(self.random.choice(DIRECTIONS)), stats)
+            elif self.game_mode == "agent" and self.random.random() < 0.01:
+                self.send(DROP_WAGON_ACTION_BYTES, stats)
+        elif message_type == "ping":
+            sent_time = message.get("t")
+            if stats.same_host and isinstance(sent_time, (int, float)):
+                stats.server_ping_delays.append(time.monotonic() - sent_time)
+            self.send(encode_pong(sent_time), stats)
+        elif message_type == "pong":
+            sent_time = message.get("t")
+            if sent_time is not None and sent_time in stats.pending_pings:
+                stats.pending_pings.discard(sent_time)
+                stats.rtts.append(time.monotonic() - sent_time)
+        elif message_type == "death":
+            self.respawn_time = now + message.get("remaining", 0)
+        elif message_type == "name_check" and not message.get("available", True):
+            stats.rejected += 1
+            self.disconnected = True
+        elif message_type in ("disconnect", "game_over"):
+            self.disconnected = True
+
+    def record_game_clock(self, now, remaining_time, stats):
+        """
+        Compare the progress of the game clock with the wall clock. The lag is
+        measured against the best alignment seen so far, since the first sample
+        may itself have been delayed.
+        """
+        if self.clock_origin is None:
+            self.clock_origin = (now, remaining_time)
+            return
+        origin_time, origin_remaining = self.clock_origin
+        expected = (now - origin_time) * stats.game_speed
+        actual = origin_remaining - remaining_time
+        offset = (expected - actual) / stats.game_speed
+        self.min_clock_offset = min(self.min_clock_offset, offset)
+        stats.tick_lateness.append(offset - self.min_clock_offset)
+
+    def tick(self, now, stats):
+        """Send the traffic that does not depend on received messages"""
+        if self.last_state_time is not None and now - self.last_state_time > stats.state_timeout:
+            # States come at least once per second during a game, with the remaining time
+            stats.stalled += 1
+            self.disconnected = True
+            return
+        if self.game_mode == "manual" and now >= self.next_action_time:
+            # Humans press a key every half second to two seconds
+            self.send(encode_direction_action(self.random.choice(DIRECTIONS)), stats)
+            self.next_action_time = now + self.random.uniform(0.5, 2.0)
+        if self.respawn_time is not None and now >= self.respawn_time:
+            self.send(RESPAWN_ACTION_BYTES, stats)
+            self.respawn_time = None
+
+
+class LoadStats:
+    """Measurements aggregated over all simulated clients"""
+
+    def __init__(self, game_speed, same_host, state_timeout):
+        self.game_speed = game_speed  # Game seconds per real second: tick_rate / REFERENCE_TICK_RATE
+        self.same_host = same_host  # The server shares the monotonic clock of the clients
+        self.state_timeout = state_timeout  # Seconds without a state after which a client gives up
+        self.tick_lateness = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_out = 0
+        self.messages_in = Counter()
+        self.send_errors = 0
+        self.rejected = 0
+        self.stalled = 0
+        self.state_intervals = []
+        self.rtts = []
+        self.server_ping_delays = []
+        self.pings_sent = 0
+        self.pending_pings = set()
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def parse_mix(text):
+    """Parse 'agent=3,manual=1' into a list of game modes to cycle through"""
+    modes = []
+    for part in text.split(","):
+        mode, _, weight = part.partition("=")
+        if mode not in ("agent", "manual", "observer"):
+            raise argparse.ArgumentTypeError(f"unknown game mode: {mode}")
+        modes += [mode] * int(weight or 1)
+    return modes
+
+
+def receive(selector, timeout, stats):
+    """Yield (client, message, reception time) for the datagrams that arrive within timeout"""
+    for key, _ in selector.select(timeout=timeout):
+        client = key.data
+        try:
+            data = client.socket.recv(65536)
+        except (BlockingIOError, ConnectionResetError):
+            continue
+        now = time.time()
+        stats.bytes_in += len(data)
+        for message in decode_datagram(data):
+            yield client, message, now
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    server_addr = (args.host, args.port)
+    stats = LoadStats(args.tick_rate / REFERENCE_TICK_RATE, args.host in LOOPBACK_HOSTS, args.state_timeout)
+    selector = selectors.DefaultSelector()
+
+    clients = []
+    for i in range(args.clients):
+        client = SimulatedClient(i, args.mix[i % len(args.mix)], server_addr, rng)
+        selector.register(client.socket, selectors.EVENT_READ, client)
+        clients.append(client)
+
+    # Stagger the joins so the server is not flooded with handshakes, and
+    # answer the clients that already joined meanwhile, or the server times them out
+    for client in clients:
+        client.join(stats)
+        join_deadline = time.time() + args.join_interval
+        while True:
+            for receiver, message, now in receive(selector, max(0.0, join_deadline - time.time()), stats):
+                receiver.handle(message, now, stats)
+            if time.time() >= join_deadline:
+                break
+
+    start = time.time()
+    next_ping = start
+    next_report = start + 1.0
+    last_report = (start, 0, 0)
+    while time.time() - start < args.duration:
+        for client, message, now in receive(selector, STATE_INTERVAL / 2, stats):
+            client.handle(message, now, stats)
+
+        now = time.time()
+        for client in clients:
+            if not client.disconnected:
+                client.tick(now, stats)
+
+        if now >= next_ping:
+            # Ping every client once per interval, with one shared timestamp per client
+            for client in clients:
+                if not client.disconnected:
+                    timestamp = time.monotonic()
+                    stats.pending_pings.add(timestamp)
+                    stats.pings_sent += 1
+                    client.send(encode_ping(timestamp), stats)
+            next_ping = now + args.ping_interval
+
+        if now >= next_report:
+            elapsed = now - last_report[0]
+            print(
+                f"[{now - start:5.1f}s] "
+                f"in {(stats.bytes_in - last_report[1]) * 8 / elapsed / 1e6:7.2f} Mbit/s  "
+                f"out {(stats.bytes_out - last_report[2]) * 8 / elapsed / 1e6:6.3f} Mbit/s  "
+                f"states {stats.messages_in['state']:8d}  "
+                f"connected {sum(not c.disconnected for c in clients)}"
+            )
+            last_report = (now, stats.bytes_in, stats.bytes_out)
+            next_report = now + 1.0
+
+    # Give the last pongs a chance to arrive before counting them as lost
+    deadline = time.time() + 1.0
+    while time.time() < deadline:
+        for client, message, now in receive(selector, 0.05, stats):
+            if message.get("type") == "pong":
+                client.handle(message, now, stats)
+
+    elapsed = time.time() - start
+    for client in clients:
+        selector.unregister(client.socket)
+        client.socket.close()
+
+    report(args, stats, elapsed)
+
+
+def report(args, stats, elapsed):
+    intervals_ms = [interval * 1000 for interval in stats.state_intervals]
+    rtts_ms = [rtt * 1000 for rtt in stats.rtts]
+    delays_ms = [delay * 1000 for delay in stats.server_ping_delays]
+    lateness_ms = [lateness * 1000 for lateness in stats.tick_lateness]
+    lost = len(stats.pending_pings)
+
+    print()
+    print(f"clients            {args.clients} ({', '.join(sorted(set(args.mix)))})")
+    print(f"duration           {elapsed:.1f}s")
+    print(f"rejected           {stats.rejected}")
+    print(f"stalled            {stats.stalled} (no state for {args.state_timeout:.1f}s)")
+    print(
+        f"tick lateness ms   p50 {percentile(lateness_ms, 0.5):.1f}  "
+        f"p99 {percentile(lateness_ms, 0.99):.1f}  max {max(lateness_ms, default=float('nan')):.1f}  "
+        f"({len(lateness_ms)} samples, includes up to one state interval of sampling error)"
+    )
+    print(
+        f"state interval ms  p50 {percentile(intervals_ms, 0.5):.2f}  "
+        f"p99 {percentile(intervals_ms, 0.99):.2f}  max {max(intervals_ms, default=float('nan')):.2f}  "
+        f"(minimum {STATE_INTERVAL * 1000:.2f})"
+    )
+    print(
+        f"RTT ms             p50 {percentile(rtts_ms, 0.5):.2f}  "
+        f"p99 {percentile(rtts_ms, 0.99):.2f}  max {max(rtts_ms, default=float('nan')):.2f}"
+    )
+    if delays_ms:
+        print(
+            f"server ping delay  p50 {percentile(delays_ms, 0.5):.2f}  "
+            f"p99 {percentile(delays_ms, 0.99):.2f}  max {max(delays_ms):.2f}  (one way)"
+        )
+    if stats.pings_sent:
+        print(f"ping loss          {lost}/{stats.pings_sent} ({lost / stats.pings_sent:.2%})")
+    print(
+        f"bandwidth          in {stats.bytes_in * 8 / elapsed / 1e6:.2f} Mbit/s, "
+        f"out {stats.bytes_out * 8 / elapsed / 1e6:.3f} Mbit/s"
+    )
+    print(f"messages in        {dict(stats.messages_in.most_common())}")
+    print(f"messages out       {stats.messages_out}, send errors {stats.send_errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("agent"),
+        help="game modes and weights, e.g. agent=3,manual=1,observer=1",
+    )
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load after joining")
+    parser.add_argument("--ping-interval", type=float, default=1.0)
+    parser.add_argument("--join-interval", type=float, default=0.005, help="seconds between two joins")
+    parser.add_argument(
+        "--state-timeout",
+        type=float,
+        default=2.0,
+        help="seconds without a state after which a client in a game gives up, like server_timeout_seconds",
+    )
+    parser.add_argument(
+        "--tick-rate", type=int, default=REFERENCE_TICK_RATE, help="tick_rate of the server config"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
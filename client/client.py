@@ -7,7 +7,7 @@ import threading
 import sys
 import importlib
 import random
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 from client.network import NetworkManager
 from client.renderer import Renderer
@@ -19,6 +19,9 @@ from common.client_config import ClientConfig, GameMode
 from common.base_agent import BaseAgent
 from common.constants import REFERENCE_TICK_RATE
 
+if TYPE_CHECKING:
+    from client.replay_viewer import ReplayViewer
+
 
 # Configure logging
 logging.basicConfig(
@@ -93,6 +96,9 @@ class Client:
 
         self.nb_players: int = 0
 
+        # Set when the client plays back a replay instead of a live game
+        self.replay_viewer: ReplayViewer | None = None
+
         # Window creation flags and parameters
         self.window_needs_update: bool = False
         self.window_update_params: dict[str, int] = {
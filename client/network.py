@@ -14,11 +14,11 @@ from typing import TYPE_CHECKING, Any
 
 from common.version import EXPECTED_CLIENT_VERSION
 from common.messages import (
-    PongMessage,
     AgentIdsMessage,
-    DirectionActionMessage,
-    RespawnActionMessage,
-    DropWagonActionMessage,
+    DROP_WAGON_ACTION_BYTES,
+    RESPAWN_ACTION_BYTES,
+    encode_direction_action,
+    encode_pong,
 )
 
 if TYPE_CHECKING:
@@ -45,7 +45,7 @@ class NetworkManager:
         self.socket: socket.socket | None = None
         self.running: bool = True
         self.receive_thread: threading.Thread | None = None
-        self.last_ping_time: float = 0
+        self.last_ping_time: float = 0  # Time of the last message received from the server
 
     def connect(self) -> bool:
         """Establish connection with server"""
@@ -146,14 +146,14 @@ class NetworkManager:
                 # Use a shorter timeout to ensure we don't miss pings, especially when train is dead
                 self.socket.settimeout(0.1)
 
-                # Check if we've received a ping recently
+                # Check if we've received anything from the server recently
                 current_time = time.time()
                 if (
                     current_time - self.last_ping_time
                     > self.client.config.server_timeout_seconds
                 ):
                     logger.warning(
-                        f"Server hasn't sent a ping for {self.client.config.server_timeout_seconds} seconds, disconnecting"
+                        f"Server hasn't sent anything for {self.client.config.server_timeout_seconds} seconds, disconnecting"
                     )
                     # Disconnect the client
                     self.disconnect(stop_client=True)
@@ -165,6 +165,10 @@ class NetworkManager:
                 if not data:
                     continue
 
+                # Any message from the server proves it is alive, the server
+                # only pings us when we have been silent
+                self.last_ping_time = time.time()
+
                 # Process all messages in the packet
                 messages = data.decode().split("\n")
                 for message in messages:
@@ -187,9 +191,8 @@ class NetworkManager:
                             self.client.in_waiting_room = False
 
                         elif message_type == "ping":
-                            # Respond to ping with pong
-                            self.send_pong()
-                            self.last_ping_time = time.time()
+                            # Respond to ping with pong, echoing its timestamp
+                            self.send_pong(message_data.get("t"))
 
                         elif message_type == "pong":
                             # Mark that we received a response to our ping
@@ -367,34 +370,33 @@ class NetworkManager:
 
     def send_direction_change(self, direction: tuple[int, int]) -> bool:
         """Send direction change to server"""
-        message = DirectionActionMessage(direction=direction)
-        return self.send_pydantic_message(message)
+        return self.send_bytes(encode_direction_action(tuple(direction)))
 
     def send_spawn_request(self) -> bool:
         """Send spawn request to server"""
-        message = RespawnActionMessage()
-        return self.send_pydantic_message(message)
+        return self.send_bytes(RESPAWN_ACTION_BYTES)
 
     def send_drop_wagon_request(self) -> bool:
         """Send request to drop passenger"""
-        message = DropWagonActionMessage()
-        return self.send_pydantic_message(message)
+        return self.send_bytes(DROP_WAGON_ACTION_BYTES)
 
-    def send_pong(self) -> bool:
-        """Send pong response to server"""
-        message = PongMessage()
-        return self.send_pydantic_message(message)
+    def send_pong(self, timestamp: float | None = None) -> bool:
+        """Send pong response to server, echoing the ping timestamp"""
+        return self.send_bytes(encode_pong(timestamp))
 
     def send_pydantic_message(self, message) -> bool:
         """Send a Pydantic message to server"""
+        return self.send_bytes(message.to_json().encode())
+
+    def send_bytes(self, payload: bytes) -> bool:
+        """Send an already encoded message to server"""
         if not self.socket:
             logger.error("Cannot send message: UDP socket not created")
             self.disconnect(True)
             return False
 
         try:
-            serialized = message.to_json()
-            bytes_sent = self.socket.sendto(serialized.encode(), self.server_addr)
+            bytes_sent = self.socket.sendto(payload, self.server_addr)
             return bytes_sent > 0
         except ConnectionResetError:
             return False
@@ -9,6 +9,7 @@ import logging
 import time
 from typing import TYPE_CHECKING
 
+from common.constants import REFERENCE_TICK_RATE
 from common.move import Move
 
 if TYPE_CHECKING:
@@ -115,6 +116,9 @@ class Renderer:
         if self.client.is_dead and not self.client.in_waiting_room:
             self.draw_death_screen()
 
+        if self.client.replay_viewer is not None:
+            self.draw_replay_controls()
+
         # Update display
         pygame.display.flip()
 
@@ -388,6 +392,28 @@ class Renderer:
             )
             self.client.screen.blit(text, text_rect)
 
+    def draw_replay_controls(self) -> None:
+        """Draw the progress bar and the playback status of a replay"""
+        viewer = self.client.replay_viewer
+        rect = viewer.bar_rect()
+
+        pygame.draw.rect(self.client.screen, (220, 220, 220), rect)
+        progress = viewer.tick / max(1, viewer.last_tick)
+        pygame.draw.rect(
+            self.client.screen,
+            (70, 130, 180),
+            pygame.Rect(rect.left, rect.top, int(rect.width * progress), rect.height),
+        )
+
+        seconds = viewer.tick / REFERENCE_TICK_RATE
+        total = viewer.last_tick / REFERENCE_TICK_RATE
+        status = "paused" if viewer.paused else f"x{viewer.speed:g}"
+        font = pygame.font.Font(None, 20)
+        text = font.render(f"{seconds:5.1f}s / {total:.0f}s  {status}", True, (0, 0, 0))
+        self.client.screen.blit(
+            text, (rect.right + 10, rect.centery - text.get_height() // 2)
+        )
+
     def draw_leaderboard(self) -> None:
         """Draw the leaderboard with train scores"""
         # Define leaderboard area
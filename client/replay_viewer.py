@@ -0,0 +1,198 @@
+"""
+Viewer for the keyframe replays of the game "I Like Trains"
+
+Plays back a keyframe replay (see common/replay_file.py, created with
+python -m server.replay <log> --keyframes <out>) through the client's Renderer:
+
+    python -m client.replay_viewer <replay file> [config.json]
+
+Controls:
+    SPACE           pause / resume
+    UP / DOWN       double / halve the playback speed
+    LEFT / RIGHT    jump 5 seconds backward / forward (one tick when paused)
+    HOME / END      go to the start / end of the game
+    click the bar   seek
+    ESC             quit
+"""
+
+from __future__ import annotations
+
+import logging
+import sys
+import time
+
+import pygame
+
+from client.client import Client
+from common.agent_config import AgentConfig
+from common.client_config import ClientConfig, GameMode, ManualConfig
+from common.config import Config
+from common.constants import REFERENCE_TICK_RATE
+from common.replay_file import KeyframeReplay
+from common.server_config import ServerConfig
+
+
+logger = logging.getLogger("client.replay_viewer")
+
+MIN_SPEED = 0.25
+MAX_SPEED = 64.0
+JUMP_TICKS = 5 * REFERENCE_TICK_RATE
+
+
+class ReplayViewer:
+    """Drives a Client from a keyframe replay instead of the network"""
+
+    def __init__(self, client: Client, replay: KeyframeReplay) -> None:
+        self.client: Client = client
+        self.replay: KeyframeReplay = replay
+        self.tick: int = 0
+        self.position: float = 0.0  # Fractional tick, advanced by the playback speed
+        self.speed: float = 1.0
+        self.paused: bool = False
+        self.dragging: bool = False
+
+        self.client.replay_viewer = self
+        self.client.in_waiting_room = False
+
+    @property
+    def last_tick(self) -> int:
+        return self.replay.last_tick
+
+    def seek(self, tick: int) -> None:
+        """Rebuild the state of a tick from its keyframe"""
+        tick = max(0, min(tick, self.last_tick))
+        states = self.replay.seek(tick)
+
+        # Only resize the window when the size actually changes
+        size = states[0].get("size")
+        if size == {"game_width": self.client.game_width, "game_height": self.client.game_height}:
+            del states[0]["size"]
+
+        self.client.trains = {}
+        self.client.passengers = []
+        self.client.delivery_zone = {}
+        self.client.best_scores = {}
+        for state in states:
+            self.client.handle_state_data(state)
+        self.tick = tick
+        self.position = float(tick)
+
+    def advance_to(self, tick: int) -> None:
+        """Apply the deltas up to a tick, or seek if it is behind or far ahead"""
+        tick = max(0, min(tick, self.last_tick))
+        if tick < self.tick or tick - self.tick > self.replay.keyframe_interval:
+            position = self.position
+            self.seek(tick)
+            self.position = max(position, float(tick))
+            return
+        for t in range(self.tick + 1, tick + 1):
+            for state in self.replay.delta(t):
+                self.client.handle_state_data(state)
+        self.tick = tick
+
+    def jump(self, ticks: int) -> None:
+        self.seek(self.tick + ticks)
+
+    def bar_rect(self) -> pygame.Rect:
+        """Area of the progress bar, in the padding under the game area"""
+        padding = self.client.game_screen_padding
+        return pygame.Rect(
+            padding,
+            self.client.game_height + padding + padding // 4,
+            max(1, self.client.game_width - 160),
+            padding // 2,
+        )
+
+    def seek_to_mouse(self, x: int) -> None:
+        rect = self.bar_rect()
+        fraction = max(0.0, min(1.0, (x - rect.left) / rect.width))
+        self.seek(round(fraction * self.last_tick))
+
+    def handle_events(self) -> None:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.client.running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    self.client.running = False
+                elif event.key == pygame.K_SPACE:
+                    if self.tick >= self.last_tick:
+                        self.seek(0)
+                    self.paused = not self.paused
+                elif event.key == pygame.K_UP:
+                    self.speed = min(MAX_SPEED, self.speed * 2)
+                elif event.key == pygame.K_DOWN:
+                    self.speed = max(MIN_SPEED, self.speed / 2)
+                elif event.key == pygame.K_RIGHT:
+                    self.advance_to(self.tick + (1 if self.paused else JUMP_TICKS))
+                    self.position = float(self.tick)
+                elif event.key == pygame.K_LEFT:
+                    self.jump(-1 if self.paused else -JUMP_TICKS)
+                elif event.key == pygame.K_HOME:
+                    self.seek(0)
+                elif event.key == pygame.K_END:
+                    self.seek(self.last_tick)
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if self.bar_rect().inflate(0, self.client.game_screen_padding).collidepoint(event.pos):
+                    self.dragging = True
+                    self.seek_to_mouse(event.pos[0])
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                self.dragging = False
+            elif event.type == pygame.MOUSEMOTION and self.dragging:
+                self.seek_to_mouse(event.pos[0])
+
+    def run(self) -> None:
+        """Main loop: advance the playback and draw at the client's frame rate"""
+        self.seek(0)
+        clock = pygame.time.Clock()
+        last_time = time.time()
+        while self.client.running:
+            self.handle_events()
+            self.client.handle_window_updates()
+
+            now = time.time()
+            if not self.paused and not self.dragging:
+                self.position += (now - last_time) * REFERENCE_TICK_RATE * self.speed
+                self.advance_to(int(self.position))
+                if self.tick >= self.last_tick:
+                    self.paused = True
+            last_time = now
+
+            self.client.renderer.draw_game()
+            clock.tick(REFERENCE_TICK_RATE)
+
+        self.replay.close()
+        pygame.quit()
+
+
+def default_config() -> Config:
+    """Config used when none is given: the viewer never connects to a server"""
+    return Config(
+        client=ClientConfig(
+            game_mode=GameMode.OBSERVER,
+            agent=AgentConfig(nickname="replay", agent_file_name="replay"),
+            manual=ManualConfig(nickname="replay"),
+        ),
+        server=ServerConfig(),
+    )
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print("Usage: python -m client.replay_viewer <replay file> [config.json]", file=sys.stderr)
+        sys.exit(1)
+
+    replay = KeyframeReplay(sys.argv[1])
+    config = Config.load(sys.argv[2]) if len(sys.argv) > 2 else default_config()
+    config.client.game_mode = GameMode.OBSERVER
+
+    logger.info(
+        f"Replay of room {replay.meta.get('room_id')}: {replay.last_tick} ticks, "
+        f"keyframe every {replay.keyframe_interval} ticks"
+    )
+    client = Client(config)
+    ReplayViewer(client, replay).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import logging
 import threading
+import time
 import ctypes
 from typing import Any
 
@@ -116,20 +117,35 @@ class BaseAgent:
                 self.logger.error(error_msg)
                 return
             except Exception as e:
-                self.logger.error(f"Failed to terminate agent thread: {e}")
+                self.logger.error("Failed to terminate agent thread: %s", e)
                 return
         
         # If we arrive here, the thread has finished normally
-        if self._move_result is None:
+        self.apply_move(self._move_result)
+
+    def update_agent_synchronously(self) -> None:
+        """
+        Same as update_agent(), but calls get_move() in the current thread. Used
+        by headless games: a get_move() that exceeds the timeout cannot be
+        interrupted, its move is discarded once it returns.
+        """
+        start = time.perf_counter()
+        new_direction = self.get_move()
+        if time.perf_counter() - start > self.timeout:
+            self.logger.error("Agent %s too slow. Execution exceeded timeout limit of %ss", self.nickname, round(self.timeout, 3))
+            return
+        self.apply_move(new_direction)
+
+    def apply_move(self, new_direction: move.Move | None) -> None:
+        """Send the move returned by get_move() to the server. Not supposed to be modified."""
+        if new_direction is None:
             # get_move() has finished but did not return a valid result
             return
-        
-        new_direction = self._move_result
             
         # Check if it's a valid Move enum
         if not isinstance(new_direction, move.Move):
             move_names = [f'<Move.{name}>' for name in move.Move.__members__]
-            self.logger.error(f"get_move() did not return a valid move. Got: {new_direction}. Expected one of: [{', '.join(move_names)}]")
+            self.logger.error("get_move() did not return a valid move. Got: %s. Expected one of: [%s]", new_direction, ', '.join(move_names))
 
         if new_direction == move.Move.DROP:
             self.network.send_drop_wagon_request()
@@ -2,7 +2,8 @@
 Pydantic models for all network messages in the I Like Trains game.
 
 This module defines typed message models for serialization/deserialization
-of JSON messages between client and server.
+of JSON messages between client and server, plus a fast-path codec for the
+messages exchanged on every tick.
 
 Message Types:
     - Server -> Client: state, game_started_success, spawn_success, respawn_failed,
@@ -15,7 +16,9 @@ Message Types:
 
 from __future__ import annotations
 
+import json
 from enum import Enum
+from functools import lru_cache
 from typing import Any, Literal
 from pydantic import BaseModel
 
@@ -216,19 +219,21 @@ class InitialStateMessage(BaseModel):
 
 
 class PingMessage(BaseModel):
-    """Ping message for connection checking."""
+    """Ping message for connection checking. The optional timestamp is echoed back in the pong."""
     type: Literal[ServerMessageType.PING] = ServerMessageType.PING
+    t: float | None = None
 
     def to_json(self) -> str:
-        return self.model_dump_json() + "\n"
+        return self.model_dump_json(exclude_none=True) + "\n"
 
 
 class PongMessage(BaseModel):
-    """Pong response message."""
+    """Pong response message, carrying the timestamp of the ping it answers."""
     type: Literal[ServerMessageType.PONG] = ServerMessageType.PONG
+    t: float | None = None
 
     def to_json(self) -> str:
-        return self.model_dump_json() + "\n"
+        return self.model_dump_json(exclude_none=True) + "\n"
 
 
 class DisconnectMessage(BaseModel):
@@ -384,6 +389,44 @@ class CheckSciperActionMessage(BaseModel):
 # Message parsing utilities
 # =============================================================================
 
+_SERVER_MESSAGE_MODELS: dict[str, type[BaseModel]] = {
+    ServerMessageType.STATE.value: StateMessage,
+    ServerMessageType.GAME_STARTED_SUCCESS.value: GameStartedSuccessMessage,
+    ServerMessageType.SPAWN_SUCCESS.value: SpawnSuccessMessage,
+    ServerMessageType.RESPAWN_FAILED.value: RespawnFailedMessage,
+    ServerMessageType.DEATH.value: DeathMessage,
+    ServerMessageType.GAME_OVER.value: GameOverMessage,
+    ServerMessageType.WAITING_ROOM.value: WaitingRoomMessage,
+    ServerMessageType.INITIAL_STATE.value: InitialStateMessage,
+    ServerMessageType.PING.value: PingMessage,
+    ServerMessageType.PONG.value: PongMessage,
+    ServerMessageType.DISCONNECT.value: DisconnectMessage,
+    ServerMessageType.NAME_CHECK.value: NameCheckMessage,
+    ServerMessageType.SCIPER_CHECK.value: SciperCheckMessage,
+    ServerMessageType.JOIN_SUCCESS.value: JoinSuccessMessage,
+    ServerMessageType.DROP_WAGON_SUCCESS.value: DropWagonSuccessMessage,
+    ServerMessageType.DROP_WAGON_FAILED.value: DropWagonFailedMessage,
+    ServerMessageType.LEADERBOARD.value: LeaderboardMessage,
+    ServerMessageType.GAME_STATUS.value: GameStatusMessage,
+    ServerMessageType.BEST_SCORE.value: BestScoreMessage,
+    ServerMessageType.ERROR.value: ErrorMessage,
+}
+
+_CLIENT_MESSAGE_MODELS: dict[str, type[BaseModel]] = {
+    ClientMessageType.AGENT_IDS.value: AgentIdsMessage,
+    ClientMessageType.PING.value: PingMessage,
+    ClientMessageType.PONG.value: PongMessage,
+}
+
+_CLIENT_ACTION_MODELS: dict[str, type[BaseModel]] = {
+    ClientActionType.DIRECTION.value: DirectionActionMessage,
+    ClientActionType.RESPAWN.value: RespawnActionMessage,
+    ClientActionType.DROP_WAGON.value: DropWagonActionMessage,
+    ClientActionType.CHECK_NAME.value: CheckNameActionMessage,
+    ClientActionType.CHECK_SCIPER.value: CheckSciperActionMessage,
+}
+
+
 def parse_server_message(data: dict[str, Any]) -> BaseModel:
     """
     Parse a dictionary into the appropriate server message model.
@@ -398,49 +441,10 @@ def parse_server_message(data: dict[str, Any]) -> BaseModel:
         ValueError: If the message type is unknown.
     """
     msg_type = data.get("type")
-    
-    if msg_type == ServerMessageType.STATE:
-        return StateMessage(**data)
-    elif msg_type == ServerMessageType.GAME_STARTED_SUCCESS:
-        return GameStartedSuccessMessage(**data)
-    elif msg_type == ServerMessageType.SPAWN_SUCCESS:
-        return SpawnSuccessMessage(**data)
-    elif msg_type == ServerMessageType.RESPAWN_FAILED:
-        return RespawnFailedMessage(**data)
-    elif msg_type == ServerMessageType.DEATH:
-        return DeathMessage(**data)
-    elif msg_type == ServerMessageType.GAME_OVER:
-        return GameOverMessage(**data)
-    elif msg_type == ServerMessageType.WAITING_ROOM:
-        return WaitingRoomMessage(**data)
-    elif msg_type == ServerMessageType.INITIAL_STATE:
-        return InitialStateMessage(**data)
-    elif msg_type == ServerMessageType.PING:
-        return PingMessage(**data)
-    elif msg_type == ServerMessageType.PONG:
-        return PongMessage(**data)
-    elif msg_type == ServerMessageType.DISCONNECT:
-        return DisconnectMessage(**data)
-    elif msg_type == ServerMessageType.NAME_CHECK:
-        return NameCheckMessage(**data)
-    elif msg_type == ServerMessageType.SCIPER_CHECK:
-        return SciperCheckMessage(**data)
-    elif msg_type == ServerMessageType.JOIN_SUCCESS:
-        return JoinSuccessMessage(**data)
-    elif msg_type == ServerMessageType.DROP_WAGON_SUCCESS:
-        return DropWagonSuccessMessage(**data)
-    elif msg_type == ServerMessageType.DROP_WAGON_FAILED:
-        return DropWagonFailedMessage(**data)
-    elif msg_type == ServerMessageType.LEADERBOARD:
-        return LeaderboardMessage(**data)
-    elif msg_type == ServerMessageType.GAME_STATUS:
-        return GameStatusMessage(**data)
-    elif msg_type == ServerMessageType.BEST_SCORE:
-        return BestScoreMessage(**data)
-    elif msg_type == ServerMessageType.ERROR:
-        return ErrorMessage(**data)
-    else:
+    model = _SERVER_MESSAGE_MODELS.get(msg_type)
+    if model is None:
         raise ValueError(f"Unknown server message type: {msg_type}")
+    return model(**data)
 
 
 def parse_client_message(data: dict[str, Any]) -> BaseModel:
@@ -457,27 +461,125 @@ def parse_client_message(data: dict[str, Any]) -> BaseModel:
         ValueError: If the message type/action is unknown.
     """
     # Check for type-based messages first
-    msg_type = data.get("type")
-    if msg_type:
-        if msg_type == ClientMessageType.AGENT_IDS:
-            return AgentIdsMessage(**data)
-        elif msg_type == ClientMessageType.PING:
-            return PingMessage(**data)
-        elif msg_type == ClientMessageType.PONG:
-            return PongMessage(**data)
-    
-    # Check for action-based messages
-    action = data.get("action")
-    if action:
-        if action == ClientActionType.DIRECTION or action == "direction":
-            return DirectionActionMessage(**data)
-        elif action == ClientActionType.RESPAWN or action == "respawn":
-            return RespawnActionMessage(**data)
-        elif action == ClientActionType.DROP_WAGON or action == "drop_wagon":
-            return DropWagonActionMessage(**data)
-        elif action == ClientActionType.CHECK_NAME or action == "check_name":
-            return CheckNameActionMessage(**data)
-        elif action == ClientActionType.CHECK_SCIPER or action == "check_sciper":
-            return CheckSciperActionMessage(**data)
-    
-    raise ValueError(f"Unknown client message: {data}")
+    model = _CLIENT_MESSAGE_MODELS.get(data.get("type"))
+    if model is None:
+        # Check for action-based messages
+        model = _CLIENT_ACTION_MODELS.get(data.get("action"))
+    if model is None:
+        raise ValueError(f"Unknown client message: {data}")
+    return model(**data)
+
+
+# =============================================================================
+# Fast-path codec
+# =============================================================================
+#
+# The Pydantic models above are the schema of record and are still used for
+# the handshake (agent_ids, check_name, check_sciper) and for rare messages.
+# The helpers below cover the hot path: they skip model construction and
+# validation, and produce the same JSON as the corresponding model's to_json().
+
+_COMPACT_SEPARATORS = (",", ":")
+
+# Maps every accepted direction to its canonical tuple
+_DIRECTIONS: dict[tuple[int, int], tuple[int, int]] = {
+    direction: direction for direction in ((0, -1), (1, 0), (0, 1), (-1, 0))
+}
+
+# Constant messages, encoded once at import time
+PING_BYTES: bytes = PingMessage().to_json().encode()
+PONG_BYTES: bytes = PongMessage().to_json().encode()
+GAME_STARTED_SUCCESS_BYTES: bytes = GameStartedSuccessMessage().to_json().encode()
+RESPAWN_ACTION_BYTES: bytes = RespawnActionMessage().to_json().encode()
+DROP_WAGON_ACTION_BYTES: bytes = DropWagonActionMessage().to_json().encode()
+
+
+def encode_message(payload: dict[str, Any]) -> bytes:
+    """Encode a plain message dictionary as a newline-terminated JSON datagram."""
+    return (
+        json.dumps(payload, separators=_COMPACT_SEPARATORS, ensure_ascii=False) + "\n"
+    ).encode()
+
+
+def encode_ping(timestamp: float) -> bytes:
+    """Encode a timestamped ping, equivalent to PingMessage(t=timestamp).to_json()."""
+    return encode_message({"type": ServerMessageType.PING.value, "t": timestamp})
+
+
+def encode_pong(timestamp: float | None) -> bytes:
+    """Encode the pong answering a ping, echoing its timestamp if it had one."""
+    if timestamp is None:
+        return PONG_BYTES
+    return encode_message({"type": ServerMessageType.PONG.value, "t": timestamp})
+
+
+def encode_death(remaining: float, reason: str | None = None) -> bytes:
+    """Encode a death message, equivalent to DeathMessage(...).to_json()."""
+    return encode_message(
+        {"type": ServerMessageType.DEATH.value, "remaining": remaining, "reason": reason}
+    )
+
+
+@lru_cache(maxsize=16)
+def encode_drop_wagon_success(cooldown: float) -> bytes:
+    """Encode a drop_wagon_success message. The cooldown is a constant, so this is cached."""
+    return encode_message(
+        {"type": ServerMessageType.DROP_WAGON_SUCCESS.value, "cooldown": cooldown}
+    )
+
+
+def encode_drop_wagon_failed(message: str) -> bytes:
+    """Encode a drop_wagon_failed message."""
+    return encode_message(
+        {"type": ServerMessageType.DROP_WAGON_FAILED.value, "message": message}
+    )
+
+
+@lru_cache(maxsize=8)
+def encode_direction_action(direction: tuple[int, int]) -> bytes:
+    """Encode a direction action. There are only four directions, so this is cached."""
+    return encode_message(
+        {"action": ClientActionType.DIRECTION.value, "direction": list(direction)}
+    )
+
+
+def decode_datagram(data: bytes) -> list[dict[str, Any]]:
+    """
+    Decode a datagram into the list of JSON messages it contains.
+
+    Messages are newline-delimited; empty lines are skipped, and so are lines
+    that are not a JSON object, without dropping the other messages.
+    """
+    messages = []
+    for line in data.split(b"\n"):
+        if not line:
+            continue
+        try:
+            message = json.loads(line.decode())
+        except ValueError:  # UnicodeDecodeError or json.JSONDecodeError
+            continue
+        if isinstance(message, dict):
+            messages.append(message)
+    return messages
+
+
+def message_kind(data: dict[str, Any]) -> str | None:
+    """Return the dispatch key of a decoded message: its type, or else its action."""
+    return data.get("type") or data.get("action")
+
+
+def decode_direction(data: dict[str, Any]) -> tuple[int, int] | None:
+    """
+    Extract the direction of a direction action without building a model.
+
+    Returns:
+        The direction as a tuple, or None if it is missing or not one of the
+        four unit moves.
+    """
+    direction = data.get("direction")
+    if not isinstance(direction, (list, tuple)) or len(direction) != 2:
+        return None
+    try:
+        return _DIRECTIONS.get((direction[0], direction[1]))
+    except TypeError:  # Unhashable components
+        return None
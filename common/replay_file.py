@@ -0,0 +1,164 @@
+"""
+Seekable keyframe replay files
+
+A keyframe replay stores the states a client would have received during a
+game, so that it can be viewed without re-simulating it:
+
+    header      MAGIC, u32 length, JSON metadata
+    records     zlib-compressed JSON, in tick order:
+                - a keyframe (full Game.get_state()) every keyframe_interval ticks,
+                  starting at tick 0
+                - the delta of every tick from 1 to last_tick, a list of state
+                  messages to apply in order (empty when nothing changed)
+    index       (u64 offset, u32 length) of every keyframe, then of every delta
+    footer      u64 index offset, u32 last_tick, u32 keyframe_interval,
+                u32 number of keyframes, MAGIC
+
+The footer has a fixed size and the index has fixed-size entries, so a reader
+that maps the file finds the keyframe and the delta of any tick in O(1). The
+state at tick t is the keyframe of tick t // keyframe_interval * keyframe_interval
+followed by the deltas up to t.
+"""
+
+import json
+import mmap
+import struct
+import zlib
+from array import array
+
+MAGIC = b"ILTKEYF1"
+
+_HEADER = struct.Struct("<8sI")
+_INDEX_ENTRY = struct.Struct("<QI")
+_FOOTER = struct.Struct("<QIII8s")
+
+_SEPARATORS = (",", ":")
+
+
+def _encode(obj):
+    return zlib.compress(json.dumps(obj, separators=_SEPARATORS).encode())
+
+
+class KeyframeReplayWriter:
+    """
+    Writes a keyframe replay. The keyframe of tick 0 comes first, then for each
+    tick its delta followed by its keyframe if it falls on keyframe_interval.
+    """
+
+    def __init__(self, path, meta, keyframe_interval):
+        if keyframe_interval <= 0:
+            raise ValueError("keyframe_interval must be positive")
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.last_tick = 0
+        self.keyframes = array("Q")  # Flattened (offset, length) pairs
+        self.deltas = array("Q")
+
+        self.file = open(path, "wb")
+        header = json.dumps(dict(meta, keyframe_interval=keyframe_interval)).encode()
+        self.file.write(_HEADER.pack(MAGIC, len(header)))
+        self.file.write(header)
+
+    def _write_record(self, index, obj):
+        offset = self.file.tell()
+        payload = _encode(obj) if obj else b""
+        self.file.write(payload)
+        index.extend((offset, len(payload)))
+
+    def add_keyframe(self, tick, state):
+        """Add the full state of a tick that is a multiple of keyframe_interval"""
+        expected = len(self.keyframes) // 2 * self.keyframe_interval
+        if tick != expected:
+            raise ValueError(f"Expected the keyframe of tick {expected}, got tick {tick}")
+        self._write_record(self.keyframes, state)
+
+    def add_delta(self, tick, states):
+        """Add the state messages of a tick, which must follow the previous one"""
+        if tick != self.last_tick + 1:
+            raise ValueError(f"Expected the delta of tick {self.last_tick + 1}, got tick {tick}")
+        self._write_record(self.deltas, states)
+        self.last_tick = tick
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        for index in (self.keyframes, self.deltas):
+            for i in range(0, len(index), 2):
+                self.file.write(_INDEX_ENTRY.pack(index[i], index[i + 1]))
+        self.file.write(
+            _FOOTER.pack(
+                index_offset, self.last_tick, self.keyframe_interval, len(self.keyframes) // 2, MAGIC
+            )
+        )
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class KeyframeReplay:
+    """Memory-mapped reader of a keyframe replay"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length = _HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a keyframe replay")
+        self.meta = json.loads(self.map[_HEADER.size:_HEADER.size + header_length])
+
+        footer_offset = len(self.map) - _FOOTER.size
+        if footer_offset < _HEADER.size + header_length:
+            raise ValueError(f"{path} is truncated")
+        index_offset, self.last_tick, self.keyframe_interval, self.nb_keyframes, magic = (
+            _FOOTER.unpack_from(self.map, footer_offset)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is truncated")
+        self.keyframe_index_offset = index_offset
+        self.delta_index_offset = index_offset + self.nb_keyframes * _INDEX_ENTRY.size
+
+    def _read_record(self, index_offset, position):
+        offset, length = _INDEX_ENTRY.unpack_from(self.map, index_offset + position * _INDEX_ENTRY.size)
+        if not length:
+            return None
+        return json.loads(zlib.decompress(self.map[offset:offset + length]))
+
+    def keyframe_tick(self, tick):
+        """Return the tick of the last keyframe at or before a tick"""
+        tick = max(0, min(tick, self.last_tick))
+        return min(tick // self.keyframe_interval, self.nb_keyframes - 1) * self.keyframe_interval
+
+    def keyframe(self, tick):
+        """Return the full state of the last keyframe at or before a tick"""
+        keyframe_tick = self.keyframe_tick(tick)
+        return self._read_record(self.keyframe_index_offset, keyframe_tick // self.keyframe_interval)
+
+    def delta(self, tick):
+        """Return the state messages of a tick, from 1 to last_tick"""
+        if not 1 <= tick <= self.last_tick:
+            raise IndexError(f"Tick {tick} is not in the replay")
+        return self._read_record(self.delta_index_offset, tick - 1) or []
+
+    def seek(self, tick):
+        """Return the state messages that rebuild the state of a tick from scratch"""
+        keyframe_tick = self.keyframe_tick(tick)
+        states = [self.keyframe(tick)]
+        for t in range(keyframe_tick + 1, min(tick, self.last_tick) + 1):
+            states.extend(self.delta(t))
+        return states
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -4,10 +4,46 @@ from typing import Optional, List
 from common.agent_config import AgentConfig
 
 
+class EarlyStoppingArgs(BaseModel):
+    # Confidence level of the interval of the mean points of an agent with a
+    # given number of players.
+    confidence: float = 0.95
+    # Runs always played by an agent with a given number of players.
+    min_runs: int = 10
+    # Boundaries between the rank buckets, as fractions of the points of a
+    # win. The defaults are halfway between the points of the 1st, 2nd, 3rd
+    # and 4th places (1, 1/2, 1/4 and 0).
+    bucket_boundaries: List[float] = [0.125, 0.375, 0.75]
+
+
 class GradingModeArgs(BaseModel):
     nb_players_per_session: List[int] = [1, 2, 3, 4]
     nb_runs_per_session: int = 50
     agents_dir: str = "common/agents/agents_to_evaluate"
+    # Wall-clock limit of a grading game. A game still running after it is
+    # stopped and recorded as a timeout, earning no points.
+    game_timeout_seconds: float = 600.0
+    # Directory of the grading result cache. Runs whose agent, bots, seed,
+    # number of players, config and game engine did not change are reused
+    # from it instead of being simulated again. Requires a seed, so that the
+    # runs get the same seeds from one session to the next. If None, every
+    # run is simulated.
+    cache_dir: Optional[str] = None
+    # If set, the runs are not played by a local pool: they are served on this
+    # TCP port to workers started on any host with
+    # python -m server.distributed <host> <port> (see server/distributed.py).
+    coordinator_port: Optional[int] = None
+    # Address the coordinator listens on. Set it to 0.0.0.0 or to the address
+    # of a network interface to accept workers from other hosts.
+    coordinator_host: str = "127.0.0.1"
+    # Shared secret that workers must send to the coordinator (--token). If
+    # None, a random one is generated for each session and logged.
+    coordinator_token: Optional[str] = None
+    # If set, no more runs of an agent with a given number of players are
+    # played once the rank bucket of its mean points is settled (see
+    # server/early_stopping.py). Its points are then extrapolated from the
+    # runs played. If None, all nb_runs_per_session runs are played.
+    early_stopping: Optional[EarlyStoppingArgs] = None
 
 
 class ServerConfig(BaseModel):
@@ -33,8 +69,17 @@ class ServerConfig(BaseModel):
     # how much time the user must wait before they can respawn a new train.
     respawn_cooldown_seconds: float = 5.0
 
-    # How long to wait before considering a client as disconnected.
+    # How long to wait without receiving anything from a client before
+    # considering it as disconnected. Any message counts, not only pongs.
+    # Clients that stay silent for half of this time are pinged.
+    # The timeout grows with the measured round-trip time of each client,
+    # up to client_timeout_max_seconds.
     client_timeout_seconds: float = 2.0
+    client_timeout_max_seconds: float = 10.0
+
+    # Active clients are still pinged at this interval to keep their
+    # round-trip time measurement up to date.
+    rtt_probe_interval_seconds: float = 5.0
 
     # Controls the actual game speed (in frames per second).
     # This value determines how fast the game runs in real-time.
@@ -49,6 +94,45 @@ class ServerConfig(BaseModel):
     # If grading_mode is enabled, tick_rate is set to 10000 to run as fast as possible.
     grading_mode: bool = False
 
+    # Directory where a replay of each game is recorded: the seed, the config and
+    # the inputs of every tick (see server/replay.py). None disables recording.
+    # Replay a game with: python -m server.replay <file>
+    replay_dir: Optional[str] = None
+
+    # A hash of the game state is recorded every this many ticks, so that
+    # replays can check that they do not diverge. 0 disables the hashes.
+    replay_hash_interval_ticks: int = 60
+
+    # If set, server metrics (rooms, clients, ticks, tick lateness, traffic by
+    # message type, agent latency, stats queue) are served in the Prometheus
+    # text format at http://<metrics_host>:<metrics_port>/metrics (see
+    # server/metrics.py). Not used in grading mode.
+    metrics_port: Optional[int] = None
+    metrics_host: str = "127.0.0.1"
+
+    # If set, the phases of each tick and the agent calls are traced, and the
+    # trace is written to this directory in the Chrome trace format at the end
+    # of each game, or when the server receives SIGUSR1 (see server/tracing.py).
+    # Open it in https://ui.perfetto.dev. None disables tracing.
+    trace_dir: Optional[str] = None
+
+    # If set, the game thread of each room is sampled every
+    # profile_interval_seconds, and the sampled stacks of each room are written
+    # to this directory at shutdown as folded stacks for flamegraphs (see
+    # server/sampling_profiler.py). None disables the profiler.
+    profile_dir: Optional[str] = None
+    profile_interval_seconds: float = 0.01
+
+    # If True, log records are put in a queue and written by a listener
+    # thread, so that the game threads never wait for the console (see
+    # server/log_pipeline.py).
+    queued_logging: bool = False
+
+    # A warning or error logged again by the same module with the same message
+    # within this many seconds is dropped, and counted in the next one. 0
+    # logs every repetition.
+    log_rate_limit_seconds: float = 0.0
+
     # Grading mode specific arguments
     # The configuration from JSON: 
     # "grading_mode_args": {
@@ -1,8 +1,11 @@
+import atexit
 import sqlite3
 import os
 import datetime
 import logging
+import queue
 import threading
+import time
 import pytz
 
 STATS_DIR = "stats"
@@ -21,6 +24,8 @@ def get_db_connection():
         logger.debug(f"Creating new DB connection for thread {threading.current_thread().name}")
         conn = sqlite3.connect(DB_PATH, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        # With WAL, committing only syncs at checkpoints and readers do not block the writer
+        conn.execute("PRAGMA synchronous=NORMAL")
         local_storage.connection = conn
     return local_storage.connection
 
@@ -39,6 +44,7 @@ def _initialize_database():
 
         conn = get_db_connection()
         cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
 
         # --- Check table structure --- 
         cursor.execute("PRAGMA table_info(clients)")
@@ -174,6 +180,9 @@ def _initialize_database():
         )
         """)
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_connections_log_timestamp ON connections_log (timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_connections_log_sciper ON connections_log (sciper, timestamp)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_last_connection ON clients (last_connection_time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_wins ON clients (wins)")
 
         # Keep connections_daily & connections_hourly
         cursor.execute("""
@@ -184,10 +193,31 @@ def _initialize_database():
         """)
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS connections_hourly (
-                datetime TEXT PRIMARY KEY, -- YYYY-MM-DD HH:00:00
+                datetime TEXT PRIMARY KEY, -- YYYY-MM-DD HH:00
                 count INTEGER DEFAULT 0
             )
         """)
+        # Older versions keyed the hourly counts by hour of the day only (HH:00), rebuild them from the log
+        legacy_hours = cursor.execute("SELECT COUNT(*) FROM connections_hourly WHERE length(datetime) = 5").fetchone()[0]
+        if legacy_hours:
+            logger.info("Rebuilding connections_hourly per date and hour from connections_log")
+            cursor.execute("DELETE FROM connections_hourly")
+            cursor.execute("""
+                INSERT INTO connections_hourly (datetime, count)
+                SELECT substr(timestamp, 1, 13) || ':00', COUNT(*) FROM connections_log
+                WHERE type = 'connect' GROUP BY 1
+            """)
+        # Playtime per player and per day, counted on the day of the disconnection
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS playtime_daily (
+                date TEXT NOT NULL,
+                sciper TEXT NOT NULL,
+                seconds INTEGER DEFAULT 0,
+                sessions INTEGER DEFAULT 0,
+                PRIMARY KEY (date, sciper)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_playtime_daily_sciper ON playtime_daily (sciper, date)")
 
         # Remove old/unused tables if they exist
         # cursor.execute("DROP TABLE IF EXISTS client_bot_matches") # Already done above
@@ -207,6 +237,34 @@ def _initialize_database():
         """)
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_bvh_timestamp ON bot_vs_human_last_scores (timestamp)")
 
+        # Match history: one row per game and one per train of the game
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY,
+            room_id TEXT,
+            seed INTEGER,
+            ended_at DATETIME,
+            duration_seconds REAL, -- Game time played
+            ticks INTEGER,
+            nb_players INTEGER
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_matches_ended_at ON matches (ended_at)")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_participants (
+            match_id INTEGER NOT NULL REFERENCES matches (id),
+            nickname TEXT NOT NULL,
+            sciper TEXT, -- NULL for bots
+            rank INTEGER, -- 1 for the best score, ties share a rank
+            best_score INTEGER,
+            deaths INTEGER,
+            deliveries INTEGER,
+            PRIMARY KEY (match_id, nickname)
+        ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_match_participants_sciper ON match_participants (sciper, match_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_match_participants_nickname ON match_participants (nickname, match_id)")
+
         conn.commit()
         logger.info(f"Single database initialized/verified at {DB_PATH}")
     except sqlite3.Error as e:
@@ -226,74 +284,169 @@ def _initialize_database():
 _initialize_database()
 
 
+# --- Background writer ---
+# Stats are written by a single background thread, so that the server's
+# receive thread and Room.end_game never wait for the disk: the record_*
+# functions only put an event in a bounded queue. The writer applies the
+# events that arrive within BATCH_INTERVAL_SECONDS of each other in one
+# transaction. Call flush() to wait for the pending events to be written,
+# and shutdown() before exiting (also registered with atexit).
+
+BATCH_INTERVAL_SECONDS = 0.2
+MAX_PENDING_EVENTS = 10000
+
+
+class _StatsWriter:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.dropped = 0
+
+    def start(self):
+        # Started on first use, so that processes that never record stats (e.g. grading workers) have no thread
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="stats-writer", daemon=True)
+                self.thread.start()
+
+    def submit(self, apply, *args):
+        """Queue a call to apply(cursor, *args) without waiting for it"""
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((apply, args))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Stats queue is full, {self.dropped} events dropped so far")
+
+    def flush(self, timeout=None):
+        """Wait until the events queued so far are committed. Returns False on timeout."""
+        if self.thread is None or not self.thread.is_alive():
+            return True
+        done = threading.Event()
+        self.queue.put((None, done))
+        return done.wait(timeout)
+
+    def shutdown(self, timeout=5.0):
+        """Commit the pending events and stop the writer"""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put((None, None))
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning("Stats writer did not finish writing within timeout")
+
+    def run(self):
+        conn = get_db_connection()
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + BATCH_INTERVAL_SECONDS
+            # Collect the events until the deadline, or until a flush or stop request
+            while batch[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # A flush or stop request ends the batch, the events after it go in the next one
+            stopping = batch[-1] == (None, None)
+            self.write(conn, batch)
+
+    def write(self, conn, batch):
+        events = [(apply, args) for apply, args in batch if apply is not None]
+        try:
+            with conn:  # One transaction, committed at the end
+                cursor = conn.cursor()
+                for apply, args in events:
+                    try:
+                        apply(cursor, *args)
+                    except (sqlite3.Error, ValueError) as e:
+                        logger.error(f"Error recording stats with {apply.__name__}{args}: {e}")
+            logger.debug(f"Committed {len(events)} stats events")
+        except sqlite3.Error as e:
+            logger.error(f"Error committing {len(events)} stats events to {DB_PATH}: {e}")
+        for apply, done in batch:
+            if apply is None and done is not None:
+                done.set()
+
+
+_writer = _StatsWriter()
+
+
+def flush(timeout=None):
+    """Wait until the stats recorded so far are written to the database"""
+    return _writer.flush(timeout)
+
+
+def shutdown():
+    """Write the pending stats and stop the background writer"""
+    _writer.shutdown()
+
+
+def pending_events():
+    """Number of stats events waiting to be written"""
+    return _writer.queue.qsize()
+
+
+atexit.register(shutdown)
+
+
 # --- Functions to record stats ---
+# They only queue the event, with the time of the call. The _write_* functions
+# run in the background writer.
 def record_connection(sciper: str, nickname: str):
     """Records a client connection, updates client info, and connection counts."""
     now = datetime.datetime.now(LOCAL_TZ)
-    today = now.strftime("%Y-%m-%d")
-    current_hour_str = now.strftime("%H:00")
     logger.info(f"Recording connection for {nickname} ({sciper}) at {now}")
+    _writer.submit(_write_connection, sciper, nickname, now)
+
+
+def _write_connection(cursor, sciper, nickname, now):
+    today = now.strftime("%Y-%m-%d")
+    current_hour_str = now.strftime("%Y-%m-%d %H:00")
 
     # Update Client DB
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        logger.debug(f"Executing INSERT OR UPDATE for client {sciper}...")
-        cursor.execute(
-            """
-            INSERT INTO clients (sciper, nickname, last_connection_time, total_connections)
-            VALUES (?, ?, ?, 1)
-            ON CONFLICT(sciper) DO UPDATE SET
-                nickname = excluded.nickname,
-                last_connection_time = excluded.last_connection_time,
-                total_connections = total_connections + 1
-        """,
-            (sciper, nickname, now),
-        )
-        conn.commit()
-        logger.debug(f"Client DB changes committed for {sciper}.")
-    except sqlite3.Error as e:
-        logger.error(
-            f"SQLite Error updating client DB during connection for {sciper}: {e}"
-        )
+    logger.debug(f"Executing INSERT OR UPDATE for client {sciper}...")
+    cursor.execute(
+        """
+        INSERT INTO clients (sciper, nickname, last_connection_time, total_connections)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT(sciper) DO UPDATE SET
+            nickname = excluded.nickname,
+            last_connection_time = excluded.last_connection_time,
+            total_connections = total_connections + 1
+    """,
+        (sciper, nickname, now),
+    )
 
     # Update Server DB (Daily/Hourly Connections)
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Daily count
-        cursor.execute(
-            """
-            INSERT INTO connections_daily (date, count) VALUES (?, 1)
-            ON CONFLICT(date) DO UPDATE SET count = count + 1
-        """,
-            (today,),
-        )
-        # Hourly count
-        cursor.execute(
-            """
-            INSERT INTO connections_hourly (datetime, count) VALUES (?, 1)
-            ON CONFLICT(datetime) DO UPDATE SET count = count + 1
-        """,
-            (current_hour_str,),
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error updating server connection counts in {DB_PATH}: {e}")
+    cursor.execute(
+        """
+        INSERT INTO connections_daily (date, count) VALUES (?, 1)
+        ON CONFLICT(date) DO UPDATE SET count = count + 1
+    """,
+        (today,),
+    )
+    cursor.execute(
+        """
+        INSERT INTO connections_hourly (datetime, count) VALUES (?, 1)
+        ON CONFLICT(datetime) DO UPDATE SET count = count + 1
+    """,
+        (current_hour_str,),
+    )
 
     # Record connection in connections_log
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO connections_log (sciper, type, timestamp) VALUES (?, 'connect', ?)
-        """,
-            (sciper, now),
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error recording connection in connections_log: {e}")
+    cursor.execute(
+        """
+        INSERT INTO connections_log (sciper, type, timestamp) VALUES (?, 'connect', ?)
+    """,
+        (sciper, now),
+    )
 
 
 def record_disconnection(
@@ -303,158 +456,148 @@ def record_disconnection(
     """Records a client disconnection, updates playtime and disconnect count."""
     now = datetime.datetime.now(LOCAL_TZ)
     logger.info(f"Recording disconnection for {sciper} at {now}. Premature: {premature}")
+    # The premature flag is ignored for column updates, total_connections is used instead
+    _writer.submit(_write_disconnection, sciper, now)
 
-    # Calculate duration based on last connection time
-    duration_seconds = 0
-    last_conn_time_str = None
-    conn = None # Initialize conn to None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT last_connection_time FROM clients WHERE sciper = ?", (sciper,))
-        result = cursor.fetchone()
-        if result and result["last_connection_time"]:
-            last_conn_time_str = result["last_connection_time"]
-            logger.debug(f"[Disconnect Debug] Fetched last_connection_time string: '{last_conn_time_str}' for {sciper}")
-            last_conn_time = datetime.datetime.fromisoformat(last_conn_time_str).replace(tzinfo=pytz.utc).astimezone(LOCAL_TZ)
-            duration_seconds = (now - last_conn_time).total_seconds()
-            # Ensure duration is not negative (e.g., clock skew or bad data)
-            duration_seconds = max(0, duration_seconds)
-            logger.debug(f"[Disconnect Debug] Sciper: {sciper}, LastConnTime: {last_conn_time}, Now: {now}, Calculated Duration: {duration_seconds}s")
-        else:
-            logger.warning(f"Could not find last_connection_time for {sciper} to calculate duration.")
-
-        # Update Client DB
-        update_query = (
-            "UPDATE clients SET total_playtime_seconds = total_playtime_seconds + ?,"
-            " last_disconnection_time = ?"
-        )
-        # Use rounded duration_seconds for the update
-        # Use 'now' directly for last_disconnection_time
-        current_time_for_db = now 
-        params = [round(duration_seconds), current_time_for_db]
-        logger.debug(f"[Disconnect Debug] Base params for update: playtime_add={params[0]}, last_disconnect_time={params[1]}")
-
-        # We no longer update total_disconnections, as we're using total_connections instead
-        # The premature flag is now ignored for column updates
-
-        update_query += " WHERE sciper = ?"
-        params.append(sciper)
-        logger.debug(f"[Disconnect Debug] Final query: {update_query}")
-        logger.debug(f"[Disconnect Debug] Final params: {tuple(params)}")
-
-        cursor.execute(update_query, tuple(params))
-        rowcount = cursor.rowcount # Get affected row count
-        logger.debug(f"[Disconnect Debug] UPDATE affected {rowcount} row(s) for sciper {sciper}.")
 
-        conn.commit() # Commit the update
-        logger.info(f"[Disconnect Commit] Committed playtime/disconnection update for {sciper} at {current_time_for_db}. Rowcount was: {rowcount}.") # Log after commit
-
-    except sqlite3.Error as e:
-        logger.error(
-            f"Error recording client disconnection for {sciper} in {DB_PATH}: {e}"
-        )
-        if conn:
-            try:
-                conn.rollback() # Rollback on error
-                logger.info(f"Rolled back disconnection transaction for {sciper}")
-            except Exception as rb_err:
-                logger.error(f"Error during rollback attempt for {sciper}: {rb_err}")
-    except ValueError as ve:
-         logger.error(
-            f"Error parsing last_connection_time ('{last_conn_time_str}') for {sciper}: {ve}"
-        )
+def _write_disconnection(cursor, sciper, now):
+    # Record disconnection in connections_log, even if the playtime cannot be computed
+    cursor.execute(
+        """
+        INSERT INTO connections_log (sciper, type, timestamp) VALUES (?, 'disconnect', ?)
+    """,
+        (sciper, now),
+    )
 
-    # Record disconnection in connections_log
-    try:
-        conn = get_db_connection() # Ensure connection
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO connections_log (sciper, type, timestamp) VALUES (?, 'disconnect', ?)
-        """,
-            (sciper, now),
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error recording disconnection in connections_log: {e}")
+    # Calculate duration based on last connection time. The connection was
+    # queued before, so it is already written.
+    duration_seconds = 0
+    cursor.execute("SELECT last_connection_time FROM clients WHERE sciper = ?", (sciper,))
+    result = cursor.fetchone()
+    if result and result["last_connection_time"]:
+        last_conn_time_str = result["last_connection_time"]
+        logger.debug(f"[Disconnect Debug] Fetched last_connection_time string: '{last_conn_time_str}' for {sciper}")
+        try:
+            last_conn_time = datetime.datetime.fromisoformat(last_conn_time_str)
+            if last_conn_time.tzinfo is None:
+                last_conn_time = last_conn_time.replace(tzinfo=pytz.utc)
+            last_conn_time = last_conn_time.astimezone(LOCAL_TZ)
+        except ValueError as ve:
+            raise ValueError(f"cannot parse last_connection_time ('{last_conn_time_str}'): {ve}") from ve
+        duration_seconds = (now - last_conn_time).total_seconds()
+        # Ensure duration is not negative (e.g., clock skew or bad data)
+        duration_seconds = max(0, duration_seconds)
+        logger.debug(f"[Disconnect Debug] Sciper: {sciper}, LastConnTime: {last_conn_time}, Now: {now}, Calculated Duration: {duration_seconds}s")
+    else:
+        logger.warning(f"Could not find last_connection_time for {sciper} to calculate duration.")
+
+    # Update Client DB, with the rounded duration and 'now' as last_disconnection_time
+    cursor.execute(
+        "UPDATE clients SET total_playtime_seconds = total_playtime_seconds + ?,"
+        " last_disconnection_time = ? WHERE sciper = ?",
+        (round(duration_seconds), now, sciper),
+    )
+    logger.debug(f"[Disconnect Debug] UPDATE affected {cursor.rowcount} row(s) for sciper {sciper}.")
+    cursor.execute(
+        """
+        INSERT INTO playtime_daily (date, sciper, seconds, sessions) VALUES (?, ?, ?, 1)
+        ON CONFLICT(date, sciper) DO UPDATE SET
+            seconds = seconds + excluded.seconds,
+            sessions = sessions + 1
+    """,
+        (now.strftime("%Y-%m-%d"), sciper, round(duration_seconds)),
+    )
 
 
 def record_game_result(
     sciper: str, win: bool, opponent_name: str, opponent_is_bot: bool
 ):
     """Records the result of a game for a specific client."""
-    try:
-        logger.debug(
-            f"Recording game result for {sciper} - win: {win}, opponent: {opponent_name}, is_bot: {opponent_is_bot}"
-        )
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        column_to_update = "wins" if win else "losses"
-        cursor.execute(
-            f"""
-            UPDATE clients
-            SET {column_to_update} = {column_to_update} + 1
-            WHERE sciper = ?
-        """,
-            (sciper,),
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(
-            f"Error updating client game result (vs human) for {sciper} in {DB_PATH}: {e}"
-        )
+    logger.debug(
+        f"Recording game result for {sciper} - win: {win}, opponent: {opponent_name}, is_bot: {opponent_is_bot}"
+    )
+    _writer.submit(_write_game_result, sciper, win)
+
+
+def _write_game_result(cursor, sciper, win):
+    column_to_update = "wins" if win else "losses"
+    cursor.execute(
+        f"""
+        UPDATE clients
+        SET {column_to_update} = {column_to_update} + 1
+        WHERE sciper = ?
+    """,
+        (sciper,),
+    )
 
 
 # Renamed from record_last_match_score
 def record_bot_vs_human_score(human_sciper: str, bot_nickname: str, human_score: int, bot_score: int):
     """Records the scores of the last match between a specific human and bot."""
-    p1_id, p2_id = human_sciper, bot_nickname
-    p1_score, p2_score = human_score, bot_score
-
     now = datetime.datetime.now(LOCAL_TZ)
-    now_iso = now.isoformat()
     logger.debug(
-        f"Recording bot vs human score: {p1_id} ({p1_score}) vs {p2_id} ({p2_score})"
+        f"Recording bot vs human score: {human_sciper} ({human_score}) vs {bot_nickname} ({bot_score})"
+    )
+    _writer.submit(_write_bot_vs_human_score, human_sciper, bot_nickname, human_score, bot_score, now.isoformat())
+
+
+def _write_bot_vs_human_score(cursor, human_sciper, bot_nickname, human_score, bot_score, now_iso):
+    cursor.execute(
+        """
+        INSERT INTO bot_vs_human_last_scores (human_sciper, bot_nickname, human_score, bot_score, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(human_sciper, bot_nickname) DO UPDATE SET
+            human_score = excluded.human_score,
+            bot_score = excluded.bot_score,
+            timestamp = excluded.timestamp
+    """,
+        (human_sciper, bot_nickname, human_score, bot_score, now_iso),
     )
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO bot_vs_human_last_scores (human_sciper, bot_nickname, human_score, bot_score, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(human_sciper, bot_nickname) DO UPDATE SET
-                human_score = excluded.human_score,
-                bot_score = excluded.bot_score,
-                timestamp = excluded.timestamp
-        """,
-            (p1_id, p2_id, p1_score, p2_score, now_iso),
-        )
-        conn.commit()
-    except sqlite3.Error as e:
-        logger.error(
-            f"Error recording bot vs human score between {p1_id} and {p2_id} in {DB_PATH}: {e}"
-        )
+
+def record_match(room_id: str, seed, nb_players: int, ticks: int, duration_seconds: float, participants):
+    """
+    Records a finished game and the results of its trains.
+
+    participants: (nickname, sciper or None for bots, best score, deaths, deliveries) of each train.
+    """
+    now = datetime.datetime.now(LOCAL_TZ)
+    participants = list(participants)
+    logger.debug(f"Recording match of room {room_id} with {len(participants)} trains")
+    _writer.submit(_write_match, room_id, seed, nb_players, ticks, duration_seconds, participants, now)
+
+
+def _write_match(cursor, room_id, seed, nb_players, ticks, duration_seconds, participants, now):
+    cursor.execute(
+        "INSERT INTO matches (room_id, seed, ended_at, duration_seconds, ticks, nb_players) VALUES (?, ?, ?, ?, ?, ?)",
+        (room_id, seed, now, duration_seconds, ticks, nb_players),
+    )
+    match_id = cursor.lastrowid
+    scores = sorted((p[2] for p in participants), reverse=True)
+    cursor.executemany(
+        "INSERT INTO match_participants (match_id, nickname, sciper, rank, best_score, deaths, deliveries)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (match_id, nickname, sciper, scores.index(best_score) + 1, best_score, deaths, deliveries)
+            for nickname, sciper, best_score, deaths, deliveries in participants
+        ],
+    )
 
 
 # --- Function to retrieve and format stats for logging ---
-def get_stats_as_string() -> str:
-    """Retrieves all stats from the databases and formats them into a string."""
+def get_stats_as_string(max_clients: int = 50) -> str:
+    """Formats the most recently connected clients, the last scores and the connection counts into a string."""
+    from common import stats_queries  # Imports this module
+
     logger.debug("Retrieving stats...")
+    flush(timeout=5.0)
     output = ["--- Client Statistics ---"]
     try:
-        conn = get_db_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # Get client stats
-        cursor.execute("SELECT * FROM clients ORDER BY sciper")
-        clients = cursor.fetchall()
+        clients = stats_queries.top_players(max_clients, order_by="last_connection")
         if not clients:
             output.append("No client data available.")
         else:
+            output.append(f"{len(clients)} most recently connected of {stats_queries.player_count()} clients:")
             output.append(
                 "SCIPER | Nickname         | Wins | Losses | Conn. | Playtime (H:M:S) | Last Connection     | Last Disconnection"
             )
@@ -482,13 +625,7 @@ def get_stats_as_string() -> str:
     # Add Bot vs Human Scores Section
     output.append("\n--- Last Bot vs Human Scores (Last 20) ---")
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT human_sciper, bot_nickname, human_score, bot_score, timestamp "
-            "FROM bot_vs_human_last_scores ORDER BY timestamp DESC LIMIT 20"
-        )
-        scores = cursor.fetchall()
+        scores = stats_queries.last_bot_vs_human_scores(20)
         if not scores:
             output.append("No bot vs human scores available.")
         else:
@@ -512,39 +649,32 @@ def get_stats_as_string() -> str:
         logger.error(f"Error retrieving bot vs human scores: {e}")
         output.append(f"Error retrieving bot vs human scores: {e}")
 
-    # Keep Daily/Hourly Connection Stats
     output.append("\n--- Connection Statistics ---")
     try:
-        conn = get_db_connection() # Ensure we have connection
-        cursor = conn.cursor()
-
-        # Get daily connections (last 30 days for brevity)
         output.append("\nConnections per Day (Last 30 Days):")
-        cursor.execute(
-            "SELECT date, count FROM connections_daily ORDER BY date DESC LIMIT 30"
-        )
-        daily = cursor.fetchall()
+        daily = stats_queries.connections_per_day(30)
         if daily:
-            for row in reversed(daily):
-                output.append(f"  {row['date']}: {row['count']}")
+            for date, count in daily:
+                output.append(f"  {date}: {count}")
         else:
             output.append("  No daily connection data.")
 
-        # Get hourly connections (last 24 hours for brevity)
         output.append("\nConnections per Hour (Last 24 Hours):")
-        cursor.execute(
-            "SELECT datetime as hour, SUM(count) as total_count "
-            "FROM connections_hourly "
-            "GROUP BY hour ORDER BY hour ASC" # Group/Order by the hour
-        )
-        hourly = cursor.fetchall()
+        hourly = stats_queries.connections_per_hour(24)
         if hourly:
-            for row in hourly:
-                 # hour is already in the format 'HH:00'
-                output.append(f"  {row['hour']}: {row['total_count']}") # Display hour only
+            for hour, count in hourly:
+                output.append(f"  {hour}: {count}")
         else:
             output.append("  No hourly connection data for the last 24 hours.")
 
+        output.append("\nPlaytime per Day (Last 30 Days):")
+        playtime = stats_queries.playtime_per_day(30)
+        if playtime:
+            for date, seconds, sessions in playtime:
+                output.append(f"  {date}: {datetime.timedelta(seconds=seconds)} in {sessions} sessions")
+        else:
+            output.append("  No playtime data.")
+
     except sqlite3.Error as e:
         logger.error(f"Error retrieving server stats: {e}")
         output.append(f"Error retrieving server stats: {e}")
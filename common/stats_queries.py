@@ -0,0 +1,177 @@
+"""
+Read queries on the stats database, for dashboards and admin commands
+
+Every query reads an index or one of the rollup tables maintained by
+stats_manager (connections_daily, connections_hourly, playtime_daily, the
+totals of the clients table and the matches tables), so its cost does not
+grow with the number of connections logged. Results are cached for CACHE_TTL_SECONDS: repeated
+refreshes of a dashboard do not reach the database, and recorded stats may
+appear with that delay, plus the batching delay of the stats writer.
+"""
+
+import datetime
+import functools
+import logging
+import threading
+import time
+
+from common import stats_manager
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL_SECONDS = 5.0
+CACHE_MAX_ENTRIES = 256
+
+_cache = {}  # {(query name, args): (expiry time, result)}
+_cache_lock = threading.Lock()
+
+PLAYER_ORDERS = {
+    "wins": "wins DESC",
+    "playtime": "total_playtime_seconds DESC",
+    "connections": "total_connections DESC",
+    "last_connection": "last_connection_time DESC",
+}
+
+
+def _cached(query):
+    """Cache the result of a query function by arguments for CACHE_TTL_SECONDS"""
+
+    @functools.wraps(query)
+    def wrapper(*args, **kwargs):
+        key = (query.__name__, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        result = query(*args, **kwargs)
+        with _cache_lock:
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                for expired in [k for k, (expiry, _) in _cache.items() if expiry <= now]:
+                    del _cache[expired]
+                if len(_cache) >= CACHE_MAX_ENTRIES:
+                    _cache.clear()
+            _cache[key] = (now + CACHE_TTL_SECONDS, result)
+        return result
+
+    return wrapper
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _fetch(sql, params=()):
+    cursor = stats_manager.get_db_connection().execute(sql, params)
+    return [dict(row) for row in cursor.fetchall()]
+
+
+@_cached
+def player_count():
+    return _fetch("SELECT COUNT(*) AS count FROM clients")[0]["count"]
+
+
+@_cached
+def top_players(limit=20, order_by="last_connection"):
+    """Clients with the most wins, playtime, connections or the most recent connection"""
+    if order_by not in PLAYER_ORDERS:
+        raise ValueError(f"Unknown order {order_by}, expected one of {list(PLAYER_ORDERS)}")
+    return _fetch(f"SELECT * FROM clients ORDER BY {PLAYER_ORDERS[order_by]} LIMIT ?", (limit,))
+
+
+@_cached
+def player(sciper):
+    """Row of a client in the clients table, or None"""
+    rows = _fetch("SELECT * FROM clients WHERE sciper = ?", (sciper,))
+    return rows[0] if rows else None
+
+
+@_cached
+def player_connections(sciper, limit=50):
+    """Last connections and disconnections of a client, most recent first"""
+    return _fetch(
+        "SELECT timestamp, type FROM connections_log WHERE sciper = ? ORDER BY timestamp DESC LIMIT ?",
+        (sciper, limit),
+    )
+
+
+@_cached
+def connections_per_day(days=30):
+    """[(date, connections)] for the last days, oldest first"""
+    since = (datetime.datetime.now(stats_manager.LOCAL_TZ) - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    rows = _fetch("SELECT date, count FROM connections_daily WHERE date >= ? ORDER BY date", (since,))
+    return [(row["date"], row["count"]) for row in rows]
+
+
+@_cached
+def connections_per_hour(hours=24):
+    """[("YYYY-MM-DD HH:00", connections)] for the last hours, oldest first"""
+    since = (datetime.datetime.now(stats_manager.LOCAL_TZ) - datetime.timedelta(hours=hours - 1)).strftime("%Y-%m-%d %H:00")
+    rows = _fetch("SELECT datetime, count FROM connections_hourly WHERE datetime >= ? ORDER BY datetime", (since,))
+    return [(row["datetime"], row["count"]) for row in rows]
+
+
+@_cached
+def playtime_per_day(days=30, sciper=None):
+    """[(date, seconds played, sessions)] for the last days, of all players or of one, oldest first"""
+    since = (datetime.datetime.now(stats_manager.LOCAL_TZ) - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    if sciper is None:
+        rows = _fetch(
+            "SELECT date, SUM(seconds) AS seconds, SUM(sessions) AS sessions FROM playtime_daily"
+            " WHERE date >= ? GROUP BY date ORDER BY date",
+            (since,),
+        )
+    else:
+        rows = _fetch(
+            "SELECT date, seconds, sessions FROM playtime_daily WHERE sciper = ? AND date >= ? ORDER BY date",
+            (sciper, since),
+        )
+    return [(row["date"], row["seconds"], row["sessions"]) for row in rows]
+
+
+@_cached
+def last_bot_vs_human_scores(limit=20):
+    """Last scores of each human against each bot, most recent first"""
+    return _fetch(
+        "SELECT human_sciper, bot_nickname, human_score, bot_score, timestamp "
+        "FROM bot_vs_human_last_scores ORDER BY timestamp DESC LIMIT ?",
+        (limit,),
+    )
+
+
+@_cached
+def leaderboard(limit=20, since=None):
+    """Human players by wins, with their number of games and mean rank, since an optional "YYYY-MM-DD" date"""
+    return _fetch(
+        "SELECT p.sciper, COUNT(*) AS games, SUM(p.rank = 1) AS wins, AVG(p.rank) AS mean_rank,"
+        " MAX(p.best_score) AS best_score, SUM(p.deliveries) AS deliveries, SUM(p.deaths) AS deaths"
+        " FROM match_participants p JOIN matches m ON m.id = p.match_id"
+        " WHERE p.sciper IS NOT NULL AND m.ended_at >= ?"
+        " GROUP BY p.sciper ORDER BY wins DESC, mean_rank LIMIT ?",
+        (since or "", limit),
+    )
+
+
+@_cached
+def player_matches(sciper, limit=20):
+    """Last games of a player with their results, most recent first"""
+    return _fetch(
+        "SELECT m.id, m.room_id, m.seed, m.ended_at, m.nb_players, p.rank, p.best_score, p.deaths, p.deliveries"
+        " FROM match_participants p JOIN matches m ON m.id = p.match_id"
+        " WHERE p.sciper = ? ORDER BY p.match_id DESC LIMIT ?",
+        (sciper, limit),
+    )
+
+
+def match_results(after_match_id=0, limit=10000):
+    """
+    Participants of the games after a match id, in game order, to update
+    ratings such as Elo incrementally. Not cached, since callers page through it.
+    """
+    return _fetch(
+        "SELECT p.match_id, p.nickname, p.sciper, p.rank, p.best_score FROM match_participants p"
+        " WHERE p.match_id IN (SELECT id FROM matches WHERE id > ? ORDER BY id LIMIT ?)"
+        " ORDER BY p.match_id, p.rank",
+        (after_match_id, limit),
+    )
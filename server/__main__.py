@@ -1,13 +1,21 @@
-import sys
+import argparse
 from common.config import Config
 from server.server import Server
 
+parser = argparse.ArgumentParser(description="Start the I Like Trains server")
+parser.add_argument("config_file", nargs="?", default="config.json")
+parser.add_argument(
+    "--resume",
+    nargs="?",
+    const="latest",
+    metavar="RUNS_DIR",
+    help="grading mode: resume an interrupted session (by default the most recent one in stats/)",
+)
+args = parser.parse_args()
+
 # Load the config file
-config_file = "config.json"
-if len(sys.argv) > 1:
-    config_file = sys.argv[1]
-config = Config.load(config_file)
+config = Config.load(args.config_file)
 
 # Start and run the server
-server = Server(config)
+server = Server(config, grading_resume=args.resume)
 server.run()
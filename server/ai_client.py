@@ -4,8 +4,10 @@ This module provides an AI client that can control trains on the server side
 """
 
 import logging
-from server.passenger import Passenger
 import importlib
+import time
+
+from server import metrics, tracing
 
 logger = logging.getLogger("server.ai_client")
 
@@ -21,40 +23,25 @@ class AINetworkInterface:
 
     def send_direction_change(self, direction):
         """Change the direction of the train using the server's function"""
-        if self.room.game.contains_train(
-            self.nickname
-        ):
-            self.room.game.trains[self.nickname].change_direction(direction)
+        if self.room.game.change_direction(self.nickname, direction):
             return True
         else:
             logger.error(
-                f"Failed to change direction for train {self.nickname}. Train is in game: {self.nickname in self.room.game.trains}"
+                "Failed to change direction for train %s. Train is in game: %s", self.nickname, self.nickname in self.room.game.trains
             )
         return False
 
     def send_drop_wagon_request(self):
         """Drop a wagon from the train using the server's function"""
-        if self.nickname in self.room.game.trains and self.room.game.contains_train(
-            self.nickname
-        ):
-            last_wagon_position = self.room.game.trains[self.nickname].drop_wagon()
-            if last_wagon_position:
-                # Create a new passenger at the position of the dropped wagon
-                new_passenger = Passenger(self.room.game)
-                new_passenger.position = last_wagon_position
-                new_passenger.value = 1
-                self.room.game.passengers.append(new_passenger)
-                self.room.game._dirty["passengers"] = True
-                return True
-        return False
+        return self.room.game.drop_wagon(self.nickname) is not None
 
     def send_spawn_request(self):
         """Request to spawn the train using the server's function"""
-        logger.debug(f"AI client {self.nickname} sending spawn request")
+        logger.debug("AI client %s sending spawn request", self.nickname)
         if self.nickname not in self.room.game.trains:
             cooldown = self.room.game.get_train_respawn_cooldown(self.nickname)
             if cooldown <= 0:
-                return self.room.game.add_train(self.nickname)
+                return self.room.game.spawn_train(self.nickname)
         return False
 
 
@@ -64,7 +51,7 @@ class AIClient:
     using the Agent class from the client
     """
 
-    def __init__(self, room, nickname, ai_agent_file_name=None, waiting_for_respawn=False, is_dead=False, agent_dir=None):
+    def __init__(self, room, nickname, ai_agent_file_name=None, waiting_for_respawn=False, is_dead=False, agent_dir=None, synchronous=False):
         """Initialize the AI client
         
         Args:
@@ -74,11 +61,13 @@ class AIClient:
             waiting_for_respawn: Whether the AI is waiting for respawn
             is_dead: Whether the AI is dead
             agent_dir: The directory of the agent implementation
+            synchronous: Call the agent's get_move() in the calling thread, for headless games
         """
-        logger.debug(f"Initializing AI client {nickname}, waiting_for_respawn: {waiting_for_respawn}, is_dead: {is_dead}")
+        logger.debug("Initializing AI client %s, waiting_for_respawn: %s, is_dead: %s", nickname, waiting_for_respawn, is_dead)
         self.room = room
         self.game = room.game
         self.nickname = nickname  # The AI agent name
+        self.synchronous = synchronous
 
         self.is_dead = is_dead
         self.waiting_for_respawn = waiting_for_respawn
@@ -92,7 +81,7 @@ class AIClient:
 
         # Initialize agent if path_to_agent is provided
         try:
-            logger.info(f"Trying to import AI agent for {nickname}")
+            logger.info("Trying to import AI agent for %s", nickname)
             # Check if module_path is defined
             if ai_agent_file_name.endswith(".py"):
                 # Remove .py extension
@@ -100,20 +89,21 @@ class AIClient:
 
             module = importlib.import_module(agent_dir + "." + ai_agent_file_name)
             self.agent = module.Agent(nickname, self.network, logger="server.ai_agent", timeout=1 / self.room.config.tick_rate)
-            logger.info(f"AI agent {nickname} initialized using {ai_agent_file_name}")
+            logger.info("AI agent %s initialized using %s", nickname, ai_agent_file_name)
 
         except ImportError as e:
-            logger.error(f"Failed to import AI agent for {nickname}: {e}")
+            logger.error("Failed to import AI agent for %s: %s", nickname, e)
             raise e
         except Exception as e:
-            logger.error(f"Failed to import AI agent for {nickname}: {e}")
+            logger.error("Failed to import AI agent for %s: %s", nickname, e)
             raise e
 
         self.agent.delivery_zone = self.game.delivery_zone.to_dict()
 
         self.running = True
-        logger.debug(f"AI client {nickname} started")
+        logger.debug("AI client %s started", nickname)
 
+    @tracing.traced("AIClient.update_state")
     def update_state(self, state_data):
         """Update the state from the game"""
         # Extract the actual state data from the nested structure
@@ -181,12 +171,18 @@ class AIClient:
 
         # Update agent state only if train is alive and game contains train
         if not self.is_dead and self.game.contains_train(self.nickname):
+            start = time.perf_counter()
             try:
-                self.agent.update_agent()
+                with tracing.span("get_move", agent=self.nickname):
+                    if self.synchronous:
+                        self.agent.update_agent_synchronously()
+                    else:
+                        self.agent.update_agent()
             except Exception as e:
-                logger.error(f"Error during agent update for {self.nickname}: {e}")
+                logger.error("Error during agent update for %s: %s", self.nickname, e)
+            metrics.AGENT_MOVE_SECONDS.observe(time.perf_counter() - start)
 
     def stop(self):
         """Stop the AI client"""
-        logger.debug(f"Stopping AI client {self.nickname}")
+        logger.debug("Stopping AI client %s", self.nickname)
         self.running = False
@@ -0,0 +1,439 @@
+"""
+Distributed grading: a coordinator serves grading runs to workers over TCP
+
+When grading_mode_args.coordinator_port is set, python -m server <config>
+does not start a local pool: it serves the runs of the session on that port
+and workers on any host pull them, one at a time:
+
+    python -m server.distributed <coordinator host> <port> --token <token> [--processes N]
+
+The coordinator listens on grading_mode_args.coordinator_host, loopback by
+default, and only serves workers that send the token of
+grading_mode_args.coordinator_token (or the one it generated and logged).
+Workers need a checkout of the same version of the game: the coordinator
+refuses workers whose engine hash differs, and workers refuse to run when
+their bot agents differ from the coordinator's. The agents to evaluate are
+sent with the tasks, identified by the hash of their source, so workers do
+not need them.
+
+Protocol: one JSON object per line, every message of a worker gets one reply.
+
+    worker                                 coordinator
+    {"type": "hello", "engine", "token"}   {"type": "setup", ...} or {"type": "error", "message"}
+    {"type": "get"}                        {"type": "task", ...}, {"type": "wait", "seconds"}
+                                           or {"type": "done"}
+    {"type": "result", "id", "result"}     same as get
+    {"type": "failed", "id", "reason"}     same as get
+
+get, result and failed are refused before a successful hello, and a result
+is only accepted from the worker the task is leased to. A task is leased to
+one worker for game_timeout + WATCHDOG_GRACE_SECONDS. If the worker
+disconnects, the lease expires or the worker could not play the run (e.g. it
+could not write the agent), the task is queued again, up to MAX_ATTEMPTS
+times, after which it is recorded as failed. The results of expired leases
+are ignored.
+"""
+
+import argparse
+import hashlib
+import hmac
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+from common.server_config import ServerConfig
+from server.grading import (
+    WATCHDOG_GRACE_SECONDS,
+    TaskQueue,
+    evaluate_agent_task,
+    incomplete_result,
+    init_worker,
+)
+from server.result_cache import ROOT_DIR, engine_hash, file_hash
+
+logger = logging.getLogger("server.distributed")
+
+# Times a task is leased before it is recorded as failed
+MAX_ATTEMPTS = 3
+
+# How long an idle worker waits before asking again, while the last tasks are running elsewhere
+WAIT_SECONDS = 1.0
+
+# How long a worker keeps trying to reach a coordinator that is not started yet
+CONNECT_TIMEOUT_SECONDS = 60.0
+
+# Package of the agents received by a worker, in its work directory
+REMOTE_PACKAGE = "remote_agents"
+
+
+def task_id(task):
+    agent_file, nb_players, run_index, _ = task
+    return f"{agent_file}/{nb_players}/{run_index}"
+
+
+def bot_hashes(config):
+    """Hashes of the bot agents of a config, which workers must have too"""
+    return {
+        agent.agent_file_name: file_hash(os.path.join(ROOT_DIR, "common", "agents", agent.agent_file_name))
+        for agent in config.agents
+    }
+
+
+class _WorkerConnection:
+    def __init__(self, worker):
+        self.worker = worker  # "host:port" of the worker
+        self.accepted = False  # The worker sent a valid hello
+        self.sent_sources = set()  # (file, hash) of the agents this worker already received
+
+
+class _WorkerHandler(socketserver.StreamRequestHandler):
+    """Connection of one worker to the coordinator"""
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        connection = _WorkerConnection(f"{self.client_address[0]}:{self.client_address[1]}")
+        try:
+            for line in self.rfile:
+                try:
+                    reply = coordinator.handle_message(connection, json.loads(line))
+                except (KeyError, TypeError, AttributeError, ValueError) as e:
+                    logger.warning(f"Malformed message from worker {connection.worker}: {e!r}")
+                    reply = {"type": "error", "message": "malformed message"}
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+                if reply["type"] == "error":
+                    break
+        except OSError as e:
+            logger.warning(f"Connection with worker {connection.worker} failed: {e}")
+        finally:
+            coordinator.release(connection.worker)
+
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class GradingCoordinator:
+    """
+    Serves grading tasks to remote workers, longest first, and yields their
+    results like GradingScheduler.
+    """
+
+    def __init__(self, tasks, config, agents_dir, nb_runs_per_session, game_timeout, cost_model, host, port, token=None):
+        self.host = host
+        self.port = port
+        self.token = token if token is not None else secrets.token_urlsafe(16)
+        self.generated_token = token is None  # Only a generated token is logged
+        self.lease_seconds = game_timeout + WATCHDOG_GRACE_SECONDS
+        self.cost_model = cost_model
+        self.engine = engine_hash()
+        self.setup = {
+            "type": "setup",
+            "config": config.model_dump(mode="json"),
+            "nb_runs_per_session": nb_runs_per_session,
+            "game_timeout": game_timeout,
+            "bots": bot_hashes(config),
+        }
+
+        self.sources = {}  # {agent file: (hash, source)}
+        for agent_file in sorted({task[0] for task in tasks}):
+            with open(os.path.join(agents_dir, agent_file), encoding="utf-8") as f:
+                source = f.read()
+            self.sources[agent_file] = (hashlib.sha256(source.encode()).hexdigest(), source)
+
+        self.tasks = {task_id(task): task for task in tasks}
+        self.pending = TaskQueue(tasks, cost_model)
+        self.leases = {}  # {task id: (worker, deadline)}
+        self.attempts = {}  # {task id: number of times it was leased}
+        self.finished = set()
+        self.cancelled = 0
+        self.workers = set()
+        self.done = queue.Queue()
+        self.lock = threading.Lock()
+        self.last_dispatch_time = None  # When the last task was sent, the tail of the session starts there
+
+        self.server = _CoordinatorServer((host, port), _WorkerHandler)
+        self.server.coordinator = self
+
+    @property
+    def worker_count(self):
+        return max(1, len(self.workers))
+
+    def handle_message(self, connection, message):
+        """Return the reply to a message of a worker"""
+        worker = connection.worker
+        kind = message.get("type")
+        if kind == "hello":
+            token = message.get("token")
+            if not isinstance(token, str) or not hmac.compare_digest(token.encode(), self.token.encode()):
+                logger.warning(f"Refused worker {worker}: wrong token")
+                return {"type": "error", "message": "wrong token"}
+            if message.get("engine") != self.engine:
+                logger.warning(f"Refused worker {worker}: its game engine differs from the coordinator's")
+                return {"type": "error", "message": "game engine differs from the coordinator's, update the worker"}
+            connection.accepted = True
+            with self.lock:
+                self.workers.add(worker)
+            logger.info(f"Worker {worker} connected")
+            return self.setup
+        if kind not in ("get", "result", "failed"):
+            return {"type": "error", "message": f"unknown message type {kind!r}"}
+        if not connection.accepted:
+            logger.warning(f"Refused a {kind} message from worker {worker}, which did not say hello")
+            return {"type": "error", "message": "say hello first"}
+        if kind == "result":
+            if not isinstance(message["result"], dict):
+                raise TypeError(f"result of run {message['id']} is not an object")
+            self.record_result(worker, message["id"], message["result"])
+        elif kind == "failed":
+            if self.record_failure(worker, message["id"], str(message["reason"])):
+                # Send the agent again with its next task, in case the failure lost the copy of the worker
+                agent_file = self.tasks[message["id"]][0]
+                connection.sent_sources.discard((agent_file, self.sources[agent_file][0]))
+        return self.next_task(worker, connection.sent_sources)
+
+    def next_task(self, worker, sent_sources):
+        with self.lock:
+            if len(self.finished) == len(self.tasks):
+                return {"type": "done"}
+            task = self.pending.pop()
+            if task is None:
+                return {"type": "wait", "seconds": WAIT_SECONDS}
+
+            key = task_id(task)
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            self.leases[key] = (worker, time.monotonic() + self.lease_seconds)
+            self.last_dispatch_time = time.perf_counter()
+
+        agent_file, nb_players, run_index, seed = task
+        agent_hash, source = self.sources[agent_file]
+        message = {
+            "type": "task",
+            "id": key,
+            "agent_file": agent_file,
+            "agent_hash": agent_hash,
+            "nb_players": nb_players,
+            "run_index": run_index,
+            "seed": seed,
+        }
+        if (agent_file, agent_hash) not in sent_sources:
+            message["source"] = source
+            sent_sources.add((agent_file, agent_hash))
+        return message
+
+    def record_result(self, worker, key, result):
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or lease[0] != worker:
+                # A late result after the lease expired, or a run that was never given to this worker
+                logger.warning(f"Ignored a result of run {key} from worker {worker}, which does not hold it")
+                return
+            # The identity of the run comes from the task, not from the worker
+            agent_file, nb_players, run_index, _ = self.tasks[key]
+            result.update(agent_name=os.path.splitext(agent_file)[0], nb_players=nb_players, run_index=run_index)
+            # Raises on a malformed result before the run is marked as finished, its lease then ends with the connection
+            self.cost_model.record(result)
+            self.finished.add(key)
+            del self.leases[key]
+        self.done.put(result)
+
+    def record_failure(self, worker, key, reason):
+        """Queue again a task that a worker could not play. Return whether the worker held it."""
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or lease[0] != worker:
+                logger.warning(f"Ignored a failure of run {key} from worker {worker}, which does not hold it")
+                return False
+            del self.leases[key]
+            self.retry(key, "error", f"worker {worker} failed: {reason}")
+        return True
+
+    def retry(self, key, status, reason):
+        """Queue a task whose lease failed again, or record it as failed. Called with the lock held."""
+        task = self.tasks[key]
+        if self.attempts[key] >= MAX_ATTEMPTS:
+            logger.error(f"Run {key} failed {self.attempts[key]} times ({reason}), recording it as {status}")
+            self.finished.add(key)
+            self.done.put(incomplete_result(task, 0.0, status=status))
+        else:
+            logger.warning(f"Run {key} will be retried: {reason}")
+            self.pending.push(task)
+
+    def cancel_cell(self, agent_name, nb_players):
+        """Stop serving the runs of an agent with a number of players. Return how many were pending."""
+        with self.lock:
+            dropped = self.pending.drop_cell(agent_name, nb_players)
+            self.finished.update(task_id(task) for task in dropped)
+            self.cancelled += len(dropped)
+        return len(dropped)
+
+    def release(self, worker):
+        """Queue again the tasks of a worker that disconnected"""
+        with self.lock:
+            for key, (lease_worker, _) in list(self.leases.items()):
+                if lease_worker == worker:
+                    del self.leases[key]
+                    self.retry(key, "error", f"worker {worker} disconnected")
+
+    def check_leases(self):
+        now = time.monotonic()
+        with self.lock:
+            for key, (worker, deadline) in list(self.leases.items()):
+                if now > deadline:
+                    del self.leases[key]
+                    self.retry(key, "timeout", f"worker {worker} did not answer within {self.lease_seconds:.0f}s")
+
+    def results(self):
+        """Serve all the tasks and yield their results as they complete"""
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        logger.info(
+            f"Serving {len(self.tasks)} grading runs on {self.host}:{self.port}, "
+            f"start workers with: python -m server.distributed <this host> {self.port} "
+            f"--token {self.token if self.generated_token else '<coordinator_token>'}"
+        )
+        try:
+            completed = 0
+            while completed + self.cancelled < len(self.tasks):
+                try:
+                    result = self.done.get(timeout=1.0)
+                except queue.Empty:
+                    self.check_leases()
+                    continue
+                completed += 1
+                yield result
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class GradingWorker:
+    """Pulls grading tasks from a coordinator and plays them one at a time"""
+
+    def __init__(self, host, port, work_dir, token):
+        self.host = host
+        self.port = port
+        self.work_dir = work_dir
+        self.token = token
+        os.makedirs(os.path.join(work_dir, REMOTE_PACKAGE), exist_ok=True)
+        if work_dir not in sys.path:
+            sys.path.insert(0, work_dir)
+
+    def connect(self):
+        deadline = time.monotonic() + CONNECT_TIMEOUT_SECONDS
+        while True:
+            try:
+                return socket.create_connection((self.host, self.port))
+            except OSError as e:
+                if time.monotonic() > deadline:
+                    raise
+                logger.info(f"Waiting for the coordinator at {self.host}:{self.port}: {e}")
+                time.sleep(1.0)
+
+    def agents_module(self, message):
+        """Write the agent of a task to the work directory if needed, and return its module"""
+        package = f"h{message['agent_hash'][:16]}"
+        path = os.path.join(self.work_dir, REMOTE_PACKAGE, package, message["agent_file"])
+        if "source" in message and not os.path.exists(path):
+            if hashlib.sha256(message["source"].encode()).hexdigest() != message["agent_hash"]:
+                raise ValueError(f"The source of {message['agent_file']} does not match its hash")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # The processes of a worker share the work directory, each writes its own temporary file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(message["source"])
+            os.replace(tmp_path, path)
+            importlib.invalidate_caches()  # The import system may have listed the directory before
+        return f"{REMOTE_PACKAGE}.{package}"
+
+    def run(self):
+        with self.connect() as connection, connection.makefile("rwb") as stream:
+
+            def request(message):
+                stream.write(json.dumps(message).encode() + b"\n")
+                stream.flush()
+                line = stream.readline()
+                if not line:
+                    return {"type": "done"}  # The coordinator closed the session
+                return json.loads(line)
+
+            setup = request({"type": "hello", "engine": engine_hash(), "token": self.token})
+            if setup["type"] == "error":
+                logger.error(f"The coordinator refused this worker: {setup['message']}")
+                return 0
+            server_config = ServerConfig(**setup["config"])
+            if bot_hashes(server_config) != setup["bots"]:
+                logger.error("The bot agents of this worker differ from the coordinator's, update the worker")
+                return 0
+            init_worker(server_config, REMOTE_PACKAGE, setup["nb_runs_per_session"], [], setup["game_timeout"])
+
+            runs = 0
+            message = request({"type": "get"})
+            while message["type"] != "done":
+                if message["type"] == "wait":
+                    time.sleep(message["seconds"])
+                    message = request({"type": "get"})
+                    continue
+                task = (message["agent_file"], message["nb_players"], message["run_index"], message["seed"])
+                try:
+                    result = evaluate_agent_task(task, agents_module=self.agents_module(message))
+                except Exception as e:
+                    # Not a result of the agent: the coordinator queues the run again
+                    logger.error(f"Run {message['id']} failed: {e!r}")
+                    message = request({"type": "failed", "id": message["id"], "reason": repr(e)})
+                    continue
+                runs += 1
+                message = request({"type": "result", "id": message["id"], "result": result})
+            logger.info(f"Grading session complete, {runs} runs played by this worker")
+            return runs
+
+
+def run_worker(host, port, work_dir, token):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    return GradingWorker(host, port, work_dir, token).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run grading tasks served by a coordinator")
+    parser.add_argument("host")
+    parser.add_argument("port", type=int)
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("GRADING_COORDINATOR_TOKEN"),
+        help="token of the coordinator (default: $GRADING_COORDINATOR_TOKEN)",
+    )
+    parser.add_argument("--processes", type=int, default=1, help="number of runs played in parallel")
+    parser.add_argument(
+        "--work-dir",
+        default=os.path.join(tempfile.gettempdir(), "i_like_trains_worker"),
+        help="where the received agents are stored",
+    )
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("the token of the coordinator is required (--token or $GRADING_COORDINATOR_TOKEN)")
+
+    if args.processes == 1:
+        run_worker(args.host, args.port, args.work_dir, args.token)
+        return
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.host, args.port, args.work_dir, args.token))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Sequential early stopping of grading sessions
+
+The points of a run are nb_players times 1, 1/2, 1/4 or 0 depending on the
+place of the agent. For each (agent, number of players) cell, the mean
+fraction of the points of a win is estimated as results arrive, with a Wilson
+score interval. It is conservative for any distribution on [0, 1], since the
+variance of such a distribution is at most p (1 - p), and it never collapses
+to a point when all the runs of a cell end in the same place.
+
+The fractions are divided into rank buckets by bucket_boundaries. Once the
+interval of a cell lies within one bucket, after at least min_runs runs, the
+cell is settled and no more of its runs are scheduled. Runs are still played
+in run order, so every agent gets the same first seeds.
+"""
+
+import bisect
+import logging
+import math
+from statistics import NormalDist
+
+logger = logging.getLogger("server.early_stopping")
+
+
+class EarlyStopping:
+    """Tracks the mean points of each (agent, number of players) cell and decides when it is settled"""
+
+    def __init__(self, args):
+        self.min_runs = args.min_runs
+        self.bucket_boundaries = sorted(args.bucket_boundaries)
+        self.z = NormalDist().inv_cdf(0.5 + args.confidence / 2)
+        self.cells = {}  # {(agent name, nb_players): [runs, sum of the points fractions]}
+        self.settled = set()
+
+    def interval(self, agent_name, nb_players):
+        """Wilson score interval of the mean points fraction of a cell"""
+        runs, total = self.cells.get((agent_name, nb_players), (0, 0.0))
+        if not runs:
+            return 0.0, 1.0
+        mean = total / runs
+        z2 = self.z * self.z
+        center = (mean + z2 / (2 * runs)) / (1 + z2 / runs)
+        half_width = self.z / (1 + z2 / runs) * math.sqrt(mean * (1 - mean) / runs + z2 / (4 * runs * runs))
+        return max(0.0, center - half_width), min(1.0, center + half_width)
+
+    def bucket(self, fraction):
+        return bisect.bisect_right(self.bucket_boundaries, fraction)
+
+    def record(self, agent_name, nb_players, points):
+        """Add the points of a run. Return True if this run settled its cell."""
+        cell = (agent_name, nb_players)
+        stats = self.cells.setdefault(cell, [0, 0.0])
+        stats[0] += 1
+        stats[1] += points / nb_players
+        if cell in self.settled or stats[0] < self.min_runs:
+            return False
+
+        low, high = self.interval(agent_name, nb_players)
+        if self.bucket(low) != self.bucket(high):
+            return False
+        self.settled.add(cell)
+        logger.info(
+            f"{agent_name} with {nb_players} players settled after {stats[0]} runs: "
+            f"mean points fraction {stats[1] / stats[0]:.3f} in [{low:.3f}, {high:.3f}]"
+        )
+        return True
+
+    def is_settled(self, agent_name, nb_players):
+        return (agent_name, nb_players) in self.settled
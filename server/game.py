@@ -1,3 +1,4 @@
+import hashlib
 import random
 import threading
 import logging
@@ -8,6 +9,8 @@ from common.constants import REFERENCE_TICK_RATE
 from server.train import Train
 from server.passenger import Passenger
 from server.delivery_zone import DeliveryZone
+from server.high_score import HighScore
+from server import metrics, tracing
 
 
 # Use the logger configured in server.py
@@ -45,6 +48,19 @@ def generate_random_non_blue_color(random_gen=None):
             return (r, g, b)
 
 
+def choose_bot_agents(random_gen, agents, nb_bots_needed):
+    """
+    Pick the agents of the bots to add. If we need less bots or an equal number
+    to the available list, we pick the bots randomly (without repetition).
+    If we need more, we pick each one at least once.
+    """
+    chosen = agents[:]
+    random_gen.shuffle(chosen)
+    while len(chosen) < nb_bots_needed:
+        chosen.append(random_gen.choice(agents))
+    return chosen[:nb_bots_needed]
+
+
 class Game:
     # TODO(alok): remove nb_players and use config.clients_per_room
     def __init__(self, config: ServerConfig, send_cooldown_notification, nb_players, room_id, seed=None, random_gen=None):
@@ -72,6 +88,8 @@ class Game:
         self.passengers = []
         self.dead_trains = {}  # {nickname: death_time}
         self.train_death_ticks = {}  # {nickname: death_tick} - For tick-based cooldown
+        self.deaths = {}  # {nickname: number of deaths}
+        self.deliveries = {}  # {nickname: number of wagons delivered}
         self.current_tick = 0  # Current tick counter
         self.start_time_ticks = 0  # Start time in ticks
         self.start_time = None  # Track when the game starts
@@ -80,14 +98,15 @@ class Game:
         self.desired_passengers = 0
 
         self.lock = threading.Lock()
+        self.recorder = None  # ReplayRecorder logging the inputs, if replays are enabled
 
         self.game_started = False  # Track if game has started
         self.last_delivery_tick = {}  # {nickname: last_delivery_tick}
         self.running = True
 
-        # self.high_score_all_time = HighScore()
-        # self.high_score_all_time.load() 
-        # self.high_score_all_time.dump()
+        # Loaded once per process, updates are written in the background
+        self.high_score_all_time = HighScore()
+        self.high_score_all_time.load()
 
         # Dirty flags for the game
         self._dirty = {
@@ -98,8 +117,9 @@ class Game:
             "delivery_zone": True,
             "best_scores": True,
         }
-        logger.info(f"Game initialized with tick rate: {self.config.tick_rate}")
+        logger.info("Game initialized with tick rate: %s", self.config.tick_rate)
 
+    @tracing.traced("Game.get_dirty_state")
     def get_dirty_state(self):
         """Return game state with only modified data"""
         state = {}
@@ -256,7 +276,7 @@ class Game:
         # Default position at the center
         center_x = (self.game_width // 2) // self.cell_size * self.cell_size
         center_y = (self.game_height // 2) // self.cell_size * self.cell_size
-        logger.warning(f"Using default center position: ({center_x}, {center_y})")
+        logger.warning("Using default center position: (%s, %s)", center_x, center_y)
         return center_x, center_y
 
     def update_passengers_count(self):
@@ -285,7 +305,7 @@ class Game:
 
     def add_train(self, nickname):
         """Add a new train to the game"""
-        logger.debug(f"Adding train {nickname}")
+        logger.debug("Adding train %s", nickname)
         # Check the cooldown
         if nickname in self.dead_trains:
             del self.dead_trains[nickname]
@@ -324,8 +344,8 @@ class Game:
             expected_respawn_tick = self.current_tick + cooldown_ticks
             
             real_seconds = cooldown_ticks / self.config.tick_rate
-            logger.debug(f"Train {nickname} died at tick {self.current_tick}, reason: {death_reason}")
-            logger.debug(f"Expected respawn at tick {expected_respawn_tick} (after {cooldown_ticks} ticks, {real_seconds:.2f}s real time)")
+            logger.debug("Train %s died at tick %s, reason: %s", nickname, self.current_tick, death_reason)
+            logger.debug("Expected respawn at tick %s (after %s ticks, %.2fs real time)", expected_respawn_tick, cooldown_ticks, real_seconds)
 
             # Clean up the last delivery time for this train
             self.last_delivery_tick.pop(nickname, None)
@@ -345,7 +365,7 @@ class Game:
                 client.respawn_cooldown = self.config.respawn_cooldown_seconds
             return True
         else:
-            logger.error(f"Train {nickname} not found in game")
+            logger.error("Train %s not found in game", nickname)
             return False
 
     def handle_train_death(self, train_nicknames, death_reason):
@@ -353,12 +373,14 @@ class Game:
         for nickname in train_nicknames:
             train = self.trains.get(nickname)
             if train:
+                self.deaths[nickname] = self.deaths.get(nickname, 0) + 1
+                metrics.DEATHS.inc()
                 train.set_alive(False)
                 self.send_respawn_cooldown(nickname, death_reason)
                 self.update_passengers_count()
                 train.reset()
             else:
-                logger.warning(f"Train {nickname} not found in kill method")
+                logger.warning("Train %s not found in kill method", nickname)
 
     def get_train_respawn_cooldown(self, nickname):
         """Get remaining cooldown time for a train"""
@@ -377,6 +399,7 @@ class Game:
         """Check if a train is in the game"""
         return nickname in self.trains
 
+    @tracing.traced("Game.check_collisions")
     def check_collisions(self):
         # Créer une copie du dictionnaire pour éviter de le modifier pendant l'itération
         trains_copy = list(self.trains.items())
@@ -414,6 +437,8 @@ class Game:
                     wagon = train.pop_wagon()
                     if wagon:
                         train.update_score(train.score + 1)
+                        self.deliveries[train.nickname] = self.deliveries.get(train.nickname, 0) + 1
+                        metrics.DELIVERIES.inc()
                         # Update best score if needed
                         if train.score > self.best_scores.get(train.nickname, 0):
                             self.best_scores[train.nickname] = train.score
@@ -425,52 +450,160 @@ class Game:
         if nickname in self.last_delivery_tick:
             return self.current_tick - self.last_delivery_tick[nickname]
         else:
-            logger.warning(f"Train {nickname} not found in last_delivery_tick")
+            logger.warning("Train %s not found in last_delivery_tick", nickname)
             return 0
 
-    def update(self):
-        """Update game state"""
-        if not self.trains:  # Update only if there are trains
-            return
-
+    @tracing.traced("Game.update")
+    def update(self, tick=None):
+        """
+        Update game state for the given tick. Inputs applied between two
+        updates see current_tick equal to the tick of the last update.
+        """
         with self.lock:
-            # Update all trains and check for death conditions
-            # trains_to_remove = []
-            self.check_collisions()
-
-            # Check for train deaths based on tick counter
-            death_ticks_to_check = self.train_death_ticks.copy()
-            for nickname, death_tick in death_ticks_to_check.items():                
-                # Calculate cooldown ticks with proper adjustment for game speed
-                cooldown_ticks = int(self.config.respawn_cooldown_seconds * REFERENCE_TICK_RATE)
+            if tick is not None:
+                self.current_tick = tick
+            if self.trains:  # Update only if there are trains
+                self.update_trains()
+            if self.recorder is not None:
+                self.recorder.record_tick(self)
+
+    def update_trains(self):
+        """Move the trains, check collisions and respawn AI trains. Called with the lock held."""
+        # Update all trains and check for death conditions
+        # trains_to_remove = []
+        self.check_collisions()
+
+        # Check for train deaths based on tick counter
+        death_ticks_to_check = self.train_death_ticks.copy()
+        for nickname, death_tick in death_ticks_to_check.items():                
+            # Calculate cooldown ticks with proper adjustment for game speed
+            cooldown_ticks = int(self.config.respawn_cooldown_seconds * REFERENCE_TICK_RATE)
+            
+            if self.current_tick >= death_tick + cooldown_ticks:
+                real_time_elapsed = (self.current_tick - death_tick) / self.config.tick_rate
+                logger.info("Train %s cooldown expired at tick %s (after %s ticks, %.2fs real time)", nickname, self.current_tick, self.current_tick - death_tick, real_time_elapsed)
                 
-                if self.current_tick >= death_tick + cooldown_ticks:
-                    real_time_elapsed = (self.current_tick - death_tick) / self.config.tick_rate
-                    logger.info(f"Train {nickname} cooldown expired at tick {self.current_tick} (after {self.current_tick - death_tick} ticks, {real_time_elapsed:.2f}s real time)")
-                    
-                    # Remove from death ticks dictionary
-                    if nickname in self.train_death_ticks:
-                        del self.train_death_ticks[nickname]
-                    
-                    # If the train is an AI, handle respawn
-                    if nickname in self.ai_clients:
-                        ai_client = self.ai_clients[nickname]
-                        if ai_client.is_dead and ai_client.waiting_for_respawn:
-                            logger.info(f"Respawning AI client {nickname} after cooldown")
-                            if self.add_train(nickname):
-                                ai_client.waiting_for_respawn = False
-                                ai_client.is_dead = False
-                                logger.debug(f"AI client {nickname} respawned after cooldown")
-
-            # Handle automatic respawn for AI clients
-            for ai_name, ai_client in self.ai_clients.items():
-                # Add automatic respawn logic
-                if ai_client.is_dead and ai_client.waiting_for_respawn:
-
-                    cooldown = self.get_train_respawn_cooldown(ai_name)
-                    if cooldown <= 0:
-                        if self.add_train(ai_name):
+                # Remove from death ticks dictionary
+                if nickname in self.train_death_ticks:
+                    del self.train_death_ticks[nickname]
+                
+                # If the train is an AI, handle respawn
+                if nickname in self.ai_clients:
+                    ai_client = self.ai_clients[nickname]
+                    if ai_client.is_dead and ai_client.waiting_for_respawn:
+                        logger.info("Respawning AI client %s after cooldown", nickname)
+                        if self.add_train(nickname):
                             ai_client.waiting_for_respawn = False
                             ai_client.is_dead = False
-                            logger.info(f"AI client {ai_name} respawned")
-                            
\ No newline at end of file
+                            logger.debug("AI client %s respawned after cooldown", nickname)
+
+        # Handle automatic respawn for AI clients
+        for ai_name, ai_client in self.ai_clients.items():
+            # Add automatic respawn logic
+            if ai_client.is_dead and ai_client.waiting_for_respawn:
+
+                cooldown = self.get_train_respawn_cooldown(ai_name)
+                if cooldown <= 0:
+                    if self.add_train(ai_name):
+                        ai_client.waiting_for_respawn = False
+                        ai_client.is_dead = False
+                        logger.info("AI client %s respawned", ai_name)
+                        
+
+    # Inputs from players and AI clients. They are applied under the lock,
+    # between two updates, and logged by the replay recorder if there is one.
+
+    def record(self, kind, *args):
+        """Log an input at the current tick for replays"""
+        if self.recorder is not None:
+            self.recorder.record(self.current_tick, kind, *args)
+
+    def spawn_train(self, nickname):
+        """Spawn the train of a player, see add_train"""
+        with self.lock:
+            if not self.add_train(nickname):
+                return False
+            self.record("s", nickname)
+            return True
+
+    def register_ai_client(self, nickname, ai_client):
+        """Let the game respawn the train of an AI client automatically"""
+        with self.lock:
+            self.ai_clients[nickname] = ai_client
+            self.record("a", nickname, ai_client.is_dead)
+
+    def rename_train(self, old_nickname, new_nickname):
+        """Give the train of a player to another one, e.g. an AI replacing a disconnected player"""
+        with self.lock:
+            train = self.trains.pop(old_nickname)
+            train.nickname = new_nickname
+            self.trains[new_nickname] = train
+            if old_nickname in self.train_colors:
+                self.train_colors[new_nickname] = self.train_colors.pop(old_nickname)
+            self.record("r", old_nickname, new_nickname)
+
+    def change_direction(self, nickname, direction):
+        """Set the direction the train takes on its next move"""
+        direction = tuple(direction)
+        with self.lock:
+            train = self.trains.get(nickname)
+            if train is None:
+                return False
+            previous_direction = train.new_direction
+            train.change_direction(direction)
+            if train.new_direction != previous_direction:
+                self.record("d", nickname, direction)
+            return True
+
+    def drop_wagon(self, nickname):
+        """
+        Drop the last wagon of the train as a passenger worth 1 point.
+        Returns the position of the wagon, or None if it could not be dropped.
+        """
+        with self.lock:
+            train = self.trains.get(nickname)
+            if train is None:
+                return None
+            last_wagon_position = train.drop_wagon()
+            if last_wagon_position:
+                # Create a new passenger at the position of the dropped wagon
+                new_passenger = Passenger(self)
+                new_passenger.position = last_wagon_position
+                new_passenger.value = 1
+                self.passengers.append(new_passenger)
+                self._dirty["passengers"] = True
+                self.record("w", nickname)
+            return last_wagon_position
+
+    def state_hash(self):
+        """Short hash of the simulation state, to check that replays do not diverge"""
+        trains = [
+            (
+                name,
+                train.position,
+                train.direction,
+                train.new_direction,
+                train.wagons,
+                train.score,
+                train.alive,
+                train.speed,
+                train.move_timer,
+                train.speed_boost_active,
+                train.speed_boost_timer,
+                train.boost_cooldown_active,
+                train.start_boost_cooldown_tick,
+            )
+            for name, train in sorted(self.trains.items())
+        ]
+        state = (
+            self.current_tick,
+            self.game_width,
+            self.game_height,
+            trains,
+            [(p.position, p.value) for p in self.passengers],
+            self.delivery_zone.to_dict(),
+            sorted(self.best_scores.items()),
+            sorted(self.train_death_ticks.items()),
+            sorted(self.last_delivery_tick.items()),
+        )
+        return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
@@ -0,0 +1,333 @@
+"""
+Golden-state determinism harness for "I Like Trains"
+
+Plays seeded headless games with scripted agents and records, for every tick,
+a rolling hash of get_state() and the hash of the internal state
+(Game.state_hash) into golden files. Checking the files against the current
+code replays the same scenarios and stops at the first tick that differs,
+naming the fields of the state that changed, so that a rewrite of Game or
+Train can be verified bit-for-bit before it is merged:
+
+    python -m server.golden record            # on the reference commit
+    python -m server.golden check             # after the change, exits with 1 on divergence
+
+The scripted agents only read the published state and draw from their own
+random generator, so the game's random generator is used exactly as in a Room.
+A golden file is a gzip-compressed JSON lines file:
+
+    {"version": 1, "scenario": {...}, "config": {...}}
+    [tick, rolling hash, state hash, {changed field: value}, [removed fields]]
+
+where the fields are the leaves of get_state(), e.g. "trains/Script1/position/0".
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import time
+
+from common.move import Move
+from common.server_config import ServerConfig
+
+from server.game import Game
+from server.replay import ReplayAIClient
+
+logger = logging.getLogger("server.golden")
+
+GOLDEN_VERSION = 1
+DEFAULT_GOLDEN_DIR = "golden"
+
+# (seed, number of trains, ticks) of the recorded games
+DEFAULT_SCENARIOS = [
+    (1, 2, 3600),
+    (2, 4, 3600),
+    (3, 8, 3600),
+    (4, 16, 1800),
+]
+
+MOVES = [Move.UP, Move.RIGHT, Move.DOWN, Move.LEFT]
+
+_SEPARATORS = (",", ":")
+
+_MISSING = object()
+
+
+class Scenario:
+    def __init__(self, seed, nb_trains, ticks):
+        self.seed = seed
+        self.nb_trains = nb_trains
+        self.ticks = ticks
+
+    @property
+    def name(self):
+        return f"seed{self.seed}_{self.nb_trains}trains"
+
+    def to_dict(self):
+        return {"seed": self.seed, "nb_trains": self.nb_trains, "ticks": self.ticks}
+
+
+class ScriptedAgent:
+    """
+    Heads for the nearest passenger, or for the delivery zone once it has
+    enough wagons, never into a wall or backwards. Some agents also take a
+    random turn or drop a wagon now and then, to reach the less common paths
+    of the game (collisions, drops, respawns).
+    """
+
+    def __init__(self, nickname, seed, wander=0.0, drop=0.0, wagons_to_deliver=3):
+        self.nickname = nickname
+        self.random = random.Random(f"{seed}-{nickname}")
+        self.wander = wander
+        self.drop = drop
+        self.wagons_to_deliver = wagons_to_deliver
+
+    def play(self, game, state):
+        """Apply the inputs of this tick to the game, from the state published after its update"""
+        train = state["trains"].get(self.nickname)
+        if not train or not train.get("alive"):
+            return
+        if train["wagons"] and self.random.random() < self.drop:
+            game.drop_wagon(self.nickname)
+            return
+
+        x, y = train["position"]
+        direction = tuple(train["direction"])
+        cell_size = state["cell_size"]
+        width, height = state["size"]["game_width"], state["size"]["game_height"]
+        if len(train["wagons"]) >= self.wagons_to_deliver or not state["passengers"]:
+            zone = state["delivery_zone"]
+            target = (zone["position"][0] + zone["width"] // 2, zone["position"][1] + zone["height"] // 2)
+        else:
+            target = min(
+                (tuple(p["position"]) for p in state["passengers"]),
+                key=lambda p: abs(p[0] - x) + abs(p[1] - y),
+            )
+
+        options = []
+        for move in MOVES:
+            dx, dy = move.value
+            if (dx, dy) == (-direction[0], -direction[1]):
+                continue
+            nx, ny = x + dx * cell_size, y + dy * cell_size
+            if 0 <= nx < width and 0 <= ny < height:
+                options.append((abs(nx - target[0]) + abs(ny - target[1]), move))
+        if not options:
+            return
+        if self.random.random() < self.wander:
+            move = self.random.choice(options)[1]
+        else:
+            move = min(options, key=lambda option: option[0])[1]
+        game.change_direction(self.nickname, move.value)
+
+
+def scripted_agents(scenario):
+    """Greedy agents, every other one wandering and dropping wagons"""
+    agents = []
+    for i in range(scenario.nb_trains):
+        if i % 2 == 0:
+            agents.append(ScriptedAgent(f"Script{i + 1}", scenario.seed))
+        else:
+            agents.append(ScriptedAgent(f"Script{i + 1}", scenario.seed, wander=0.05, drop=0.002, wagons_to_deliver=5))
+    return agents
+
+
+def flatten(value, prefix="", out=None):
+    """Return the leaves of a state as {"key/index/...": value}"""
+    if out is None:
+        out = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(item, f"{prefix}{key}/", out)
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value):
+            flatten(item, f"{prefix}{index}/", out)
+    else:
+        out[prefix[:-1]] = value
+    return out
+
+
+def play_scenario(scenario, config, on_tick):
+    """
+    Play a scenario headlessly, calling on_tick(tick, rolling hash, state hash, state)
+    after the update of each tick, before the agents play.
+    """
+    rng = random.Random(scenario.seed)
+    game = Game(
+        config,
+        lambda nickname, cooldown, death_reason: None,
+        scenario.nb_trains,
+        scenario.name,
+        scenario.seed,
+        rng,
+    )
+    agents = scripted_agents(scenario)
+    for agent in agents:
+        game.spawn_train(agent.nickname)
+        # Respawned by the game after the cooldown, like the trains of bots
+        game.register_ai_client(agent.nickname, ReplayAIClient(False))
+
+    game.game_started = True
+    rolling = hashlib.blake2b(digest_size=8)
+    for tick in range(1, scenario.ticks + 1):
+        game.update(tick)
+        state = game.get_state()
+        rolling = hashlib.blake2b(rolling.digest(), digest_size=8)
+        rolling.update(json.dumps(state, sort_keys=True, separators=_SEPARATORS).encode())
+        if on_tick(tick, rolling.hexdigest(), game.state_hash(), state) is False:
+            break
+        for agent in agents:
+            agent.play(game, state)
+    return game
+
+
+def record(scenario, config, path):
+    """Play a scenario and write its golden file. Returns the final rolling hash."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    previous = {}
+    final_hash = None
+    # No timestamp in the gzip header, so that recording the same games again gives the same file
+    with io.TextIOWrapper(gzip.GzipFile(path, "wb", mtime=0), encoding="utf-8") as f:
+        f.write(json.dumps(
+            {"version": GOLDEN_VERSION, "scenario": scenario.to_dict(), "config": config.model_dump(mode="json")},
+            separators=_SEPARATORS,
+        ) + "\n")
+
+        def on_tick(tick, rolling_hash, state_hash, state):
+            nonlocal previous, final_hash
+            fields = flatten(state)
+            changed = {key: value for key, value in fields.items() if previous.get(key, _MISSING) != value}
+            removed = [key for key in previous if key not in fields]
+            f.write(json.dumps([tick, rolling_hash, state_hash, changed, removed], separators=_SEPARATORS) + "\n")
+            previous = fields
+            final_hash = rolling_hash
+
+        play_scenario(scenario, config, on_tick)
+    return final_hash
+
+
+class Divergence:
+    def __init__(self, tick, fields, state_hash_differs):
+        self.tick = tick  # First tick that differs
+        self.fields = fields  # [(field, golden value, current value)] of get_state() at that tick
+        self.state_hash_differs = state_hash_differs  # The internal state differs too
+
+    def describe(self, max_fields=20):
+        lines = [f"first divergence at tick {self.tick}"]
+        for field, expected, actual in self.fields[:max_fields]:
+            expected = "<missing>" if expected is _MISSING else json.dumps(expected)
+            actual = "<missing>" if actual is _MISSING else json.dumps(actual)
+            lines.append(f"  {field}: {expected} -> {actual}")
+        if len(self.fields) > max_fields:
+            lines.append(f"  ... and {len(self.fields) - max_fields} more fields")
+        if not self.fields:
+            lines.append("  get_state() is the same, the internal state (Game.state_hash) differs")
+        return "\n".join(lines)
+
+
+class CheckResult:
+    def __init__(self, name, ticks, final_hash, divergence, elapsed):
+        self.name = name
+        self.ticks = ticks  # Ticks checked
+        self.final_hash = final_hash
+        self.divergence = divergence  # Divergence, or None if every tick matches
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.divergence is None
+
+
+def check(path):
+    """Replay the scenario of a golden file with the current code and compare every tick"""
+    start = time.perf_counter()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != GOLDEN_VERSION:
+            raise ValueError(f"Unsupported golden file version: {header.get('version')}")
+        scenario = Scenario(**header["scenario"])
+        config = ServerConfig.model_validate(header["config"])
+        expected_fields = {}
+        ticks = 0
+        final_hash = None
+        divergence = None
+
+        def on_tick(tick, rolling_hash, state_hash, state):
+            nonlocal ticks, final_hash, divergence
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{path} ends before tick {tick}")
+            golden_tick, golden_rolling_hash, golden_state_hash, changed, removed = json.loads(line)
+            for key in removed:
+                del expected_fields[key]
+            expected_fields.update(changed)
+            if golden_rolling_hash != rolling_hash or golden_state_hash != state_hash:
+                fields = flatten(json.loads(json.dumps(state)))
+                differences = [
+                    (key, expected_fields.get(key, _MISSING), fields.get(key, _MISSING))
+                    for key in sorted(expected_fields.keys() | fields.keys())
+                    if expected_fields.get(key, _MISSING) != fields.get(key, _MISSING)
+                ]
+                divergence = Divergence(tick, differences, golden_state_hash != state_hash)
+                return False
+            ticks = tick
+            final_hash = rolling_hash
+
+        play_scenario(scenario, config, on_tick)
+    return CheckResult(scenario.name, ticks, final_hash, divergence, time.perf_counter() - start)
+
+
+def golden_path(golden_dir, scenario):
+    return os.path.join(golden_dir, f"{scenario.name}.golden.gz")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or check the golden states of seeded headless games")
+    parser.add_argument("command", choices=["record", "check"])
+    parser.add_argument("--dir", default=DEFAULT_GOLDEN_DIR, help="directory of the golden files")
+    parser.add_argument(
+        "--scenario",
+        nargs=3,
+        type=int,
+        action="append",
+        metavar=("SEED", "TRAINS", "TICKS"),
+        help="scenario to record, instead of the default ones (repeatable)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "record":
+        scenarios = [Scenario(*scenario) for scenario in (args.scenario or DEFAULT_SCENARIOS)]
+        # Defaults of the config, so that the local config.json does not change the games
+        config = ServerConfig()
+        for scenario in scenarios:
+            path = golden_path(args.dir, scenario)
+            final_hash = record(scenario, config, path)
+            print(f"{scenario.name}: {scenario.ticks} ticks recorded to {path} ({final_hash})")
+        return
+
+    paths = sorted(
+        os.path.join(args.dir, name) for name in os.listdir(args.dir) if name.endswith(".golden.gz")
+    ) if os.path.isdir(args.dir) else []
+    if not paths:
+        print(f"No golden files in {args.dir}, record them with: python -m server.golden record")
+        raise SystemExit(1)
+    failed = False
+    for path in paths:
+        result = check(path)
+        if result.ok:
+            print(f"OK {result.name}: {result.ticks} ticks match in {result.elapsed:.2f}s ({result.final_hash})")
+        else:
+            failed = True
+            print(f"DIVERGED {result.name}: {result.divergence.describe()}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
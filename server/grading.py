@@ -0,0 +1,450 @@
+"""
+Grading mode: evaluation of the agents in worker processes, and their results
+
+Each worker process is set up once by init_worker, which configures its
+logging and imports the agents it will run. Tasks are then only
+(agent file, number of players, run index, seed) tuples, each played by
+run_headless_game in the worker's own thread.
+
+GradingScheduler hands the tasks out longest first, estimating their cost
+from their number of players and the measured speed of their agent, so that
+the session does not end with a few slow games keeping most cores idle. A
+game that exceeds the wall-clock limit is stopped and recorded as a timeout.
+
+Completed runs are appended to a CSV file as they arrive, so that nothing has
+to be read back while grading. The Excel workbooks (one per agent with the
+detail of its runs, and a summary of the points of every agent) are generated
+once from this file at the end.
+
+The CSV file is synced to disk after every run, and the agents, numbers of
+players and seeds of the session are saved next to it, so that an interrupted
+session can be resumed with python -m server <config> --resume [runs dir].
+"""
+
+import csv
+import glob
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import uuid
+
+import pandas as pd
+
+from common.constants import REFERENCE_TICK_RATE
+from server.headless import grade_run, run_headless_game
+
+logger = logging.getLogger("server.grading")
+
+# Loggers silenced in the worker processes
+WORKER_QUIET_LOGGERS = [
+    "server.room", "server.game", "server.train", "server.passenger", "server.headless",
+    "server.delivery_zone", "server.ai_client", "server.ai_agent",
+]
+
+# State of a worker process, set by init_worker
+_worker = {}
+
+# Detail of a run, as stored in the Excel file of each agent
+RUNS_COLUMNS = [
+    "run", "nb players", "student", "student score",
+    "bot1", "score bot 1", "bot2", "score bot 2", "bot3", "score bot 3",
+]
+
+# Columns of the results file: the task, the points it earned, then the run detail
+RESULTS_COLUMNS = ["agent", "nb_players", "run_index", "seed", "points", "status"] + RUNS_COLUMNS
+
+# Time given to a worker to stop a game that exceeded its limit before it is considered stuck
+WATCHDOG_GRACE_SECONDS = 30.0
+
+RESULTS_FILE = "results.csv"
+SESSION_FILE = "session.json"
+
+
+def init_worker(server_config, agents_dir, nb_runs_per_session, agent_files, game_timeout):
+    """Pool initializer: configure the worker process once and import its agents"""
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logging.root.setLevel(logging.DEBUG)
+    logging.root.addHandler(console_handler)
+    logging.getLogger("server").setLevel(logging.INFO)
+    for name in WORKER_QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.CRITICAL)
+
+    # Evaluation-specific parameters
+    server_config.grading_mode = True
+    server_config.waiting_time_before_bots_seconds = 0
+    server_config.tick_rate = 1000
+    if not server_config.agents:
+        logger.warning("No agents found in config, this will cause errors in Room.fill_with_bots")
+
+    # Import the agents now so that the first run of each one does not pay for it.
+    # Import errors are reported by the runs that use the agent.
+    agents_module = f"common.agents.{agents_dir}"
+    modules = [f"{agents_module}.{os.path.splitext(file)[0]}" for file in agent_files]
+    modules += [f"common.agents.{os.path.splitext(agent.agent_file_name)[0]}" for agent in server_config.agents]
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning(f"Could not import {module}: {e}")
+
+    _worker.update(
+        config=server_config,
+        agents_module=agents_module,
+        nb_runs_per_session=nb_runs_per_session,
+        game_timeout=game_timeout,
+    )
+
+
+def evaluate_agent_task(task, agents_module=None):
+    """
+    Play one grading run in a worker process set up by init_worker. The agent
+    is imported from agents_module, by default the agents directory.
+    """
+    agent_file, nb_players, run_index, seed = task
+    start = time.perf_counter()
+    agent_name = os.path.splitext(agent_file)[0]
+
+    game = run_headless_game(
+        _worker["config"],
+        [(agent_name, agent_file, agents_module or _worker["agents_module"])],
+        seed,
+        nb_players=nb_players,
+        room_id=str(uuid.uuid4())[:8],
+        timeout=_worker["game_timeout"],
+    )
+    if game.status == "timeout":
+        logger.warning(
+            f"Run {run_index + 1}/{_worker['nb_runs_per_session']} for {agent_name} with {nb_players} players "
+            f"(seed: {seed}) exceeded {_worker['game_timeout']}s and was stopped"
+        )
+        return incomplete_result(task, time.perf_counter() - start, game.ticks)
+
+    points, run_data = grade_run(game.best_scores, agent_name, nb_players, run_index)
+    return {
+        "agent_name": agent_name,
+        "nb_players": nb_players,
+        "run_index": run_index,
+        "score": points or 0,
+        "run_data": run_data,
+        "elapsed": time.perf_counter() - start,
+        "ticks": game.ticks,
+        "status": "ok",
+    }
+
+
+def incomplete_result(task, elapsed, ticks=0, status="timeout"):
+    """Result of a run that timed out or failed: it earns no points"""
+    agent_file, nb_players, run_index, _ = task
+    return {
+        "agent_name": os.path.splitext(agent_file)[0],
+        "nb_players": nb_players,
+        "run_index": run_index,
+        "score": 0,
+        "run_data": None,
+        "elapsed": elapsed,
+        "ticks": ticks,
+        "status": status,
+    }
+
+
+class TaskCostModel:
+    """Estimates the duration of a run from its number of players and the measured speed of its agent"""
+
+    def __init__(self, game_duration_seconds):
+        self.game_ticks = game_duration_seconds * REFERENCE_TICK_RATE
+        self.speeds = {}  # {agent name: [player ticks, seconds]} of its completed runs
+        self.total = [0, 0.0]
+
+    def record(self, result):
+        if result["status"] != "ok" or not result["elapsed"]:
+            return
+        player_ticks = result["ticks"] * result["nb_players"]
+        for speed in (self.speeds.setdefault(result["agent_name"], [0, 0.0]), self.total):
+            speed[0] += player_ticks
+            speed[1] += result["elapsed"]
+
+    def ticks_per_second(self, agent_name):
+        """Player ticks simulated per second in the runs of an agent, or in all runs if it has none yet"""
+        player_ticks, seconds = self.speeds.get(agent_name) or self.total
+        return player_ticks / seconds if seconds else None
+
+    def estimate(self, agent_name, nb_players):
+        """Estimated seconds of a run. Before any measurement, only the number of players counts."""
+        ticks_per_second = self.ticks_per_second(agent_name)
+        if ticks_per_second is None:
+            return float(nb_players)
+        return nb_players * self.game_ticks / ticks_per_second
+
+
+class TaskQueue:
+    """Pending grading tasks, popped longest first according to a TaskCostModel"""
+
+    def __init__(self, tasks, cost_model):
+        self.cost_model = cost_model
+        # Pending tasks by (agent file, number of players), in run order
+        self.cells = {}
+        for task in tasks:
+            self.cells.setdefault((task[0], task[1]), []).append(task)
+        for cell_tasks in self.cells.values():
+            cell_tasks.reverse()  # Popped from the end
+
+    def __len__(self):
+        return sum(len(cell_tasks) for cell_tasks in self.cells.values())
+
+    def pop(self):
+        """Pop the pending task with the longest estimated duration, or return None"""
+        cell = max(
+            (cell for cell, cell_tasks in self.cells.items() if cell_tasks),
+            key=lambda cell: self.cost_model.estimate(os.path.splitext(cell[0])[0], cell[1]),
+            default=None,
+        )
+        return self.cells[cell].pop() if cell is not None else None
+
+    def push(self, task):
+        """Put back a task to run again, before the other tasks of its cell"""
+        self.cells.setdefault((task[0], task[1]), []).append(task)
+
+    def discard(self, task):
+        """Remove a task if it is pending"""
+        cell_tasks = self.cells.get((task[0], task[1]), [])
+        if task in cell_tasks:
+            cell_tasks.remove(task)
+
+    def drop_cell(self, agent_name, nb_players):
+        """Remove and return the pending tasks of an agent with a number of players"""
+        dropped = []
+        for (agent_file, cell_nb_players), cell_tasks in self.cells.items():
+            if cell_nb_players == nb_players and os.path.splitext(agent_file)[0] == agent_name:
+                dropped += cell_tasks
+                cell_tasks.clear()
+        return dropped
+
+
+class GradingScheduler:
+    """
+    Runs grading tasks in a pool of worker processes, longest first.
+
+    Each worker gets one task at a time, so that the next task is chosen with
+    the latest cost estimates. A task still running game_timeout +
+    WATCHDOG_GRACE_SECONDS after it was sent is recorded as a timeout: its
+    worker is stuck, and the pool is restarted once all workers are.
+    """
+
+    def __init__(self, tasks, worker_count, initargs, game_timeout, cost_model):
+        self.worker_count = worker_count
+        self.initargs = initargs
+        self.deadline = game_timeout + WATCHDOG_GRACE_SECONDS
+        self.cost_model = cost_model
+        self.done = queue.Queue()
+        self.pool = None
+        self.stuck_workers = 0
+        self.last_dispatch_time = None  # When the last task was sent, the tail of the session starts there
+        self.pending = TaskQueue(tasks, cost_model)
+        self.running = {}  # {task: time it was sent}
+
+    def start_pool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.pool = multiprocessing.Pool(
+            processes=self.worker_count, initializer=init_worker, initargs=self.initargs
+        )
+        self.stuck_workers = 0
+
+    def dispatch(self):
+        while len(self.running) < self.worker_count - self.stuck_workers:
+            task = self.pending.pop()
+            if task is None:
+                return
+            self.running[task] = time.monotonic()
+            self.last_dispatch_time = time.perf_counter()
+            self.pool.apply_async(
+                evaluate_agent_task,
+                (task,),
+                callback=lambda result, task=task: self.done.put((task, result)),
+                error_callback=lambda error, task=task: self.done.put((task, error)),
+            )
+
+    def cancel_cell(self, agent_name, nb_players):
+        """Stop scheduling the runs of an agent with a number of players. Return how many were pending."""
+        return len(self.pending.drop_cell(agent_name, nb_players))
+
+    def check_watchdog(self):
+        """Yield a timeout result for each task that its worker did not manage to stop"""
+        now = time.monotonic()
+        for task, sent_time in list(self.running.items()):
+            if now - sent_time > self.deadline:
+                logger.error(f"Run {task} is stuck after {now - sent_time:.0f}s, recording a timeout")
+                del self.running[task]
+                self.stuck_workers += 1
+                yield incomplete_result(task, now - sent_time)
+        if self.stuck_workers >= self.worker_count:
+            logger.error("All grading workers are stuck, restarting the pool")
+            self.start_pool()
+
+    def results(self):
+        """Run all the tasks and yield their results as they complete"""
+        self.start_pool()
+        try:
+            self.dispatch()
+            while self.running:
+                try:
+                    task, result = self.done.get(timeout=1.0)
+                except queue.Empty:
+                    yield from self.check_watchdog()
+                    self.dispatch()
+                    continue
+
+                if task not in self.running:
+                    # Late result of a task already recorded as a timeout: its worker is free again
+                    self.stuck_workers = max(0, self.stuck_workers - 1)
+                    self.dispatch()
+                    continue
+                if isinstance(result, BaseException):
+                    logger.error(f"Run {task} failed: {result!r}")
+                    result = incomplete_result(task, time.monotonic() - self.running[task], status="error")
+                del self.running[task]
+                self.cost_model.record(result)
+                yield result
+                self.dispatch()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+
+
+class GradingResultsWriter:
+    """Append-only CSV file with one row per completed grading run"""
+
+    def __init__(self, path):
+        self.path = path
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULTS_COLUMNS, extrasaction="ignore")
+        if new_file:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def append(self, result, seed):
+        """Append the result returned by evaluate_agent_task"""
+        row = dict(result["run_data"] or {})
+        row.update(
+            agent=result["agent_name"],
+            nb_players=result["nb_players"],
+            run_index=result["run_index"],
+            seed=seed,
+            points=result["score"],
+            status=result.get("status", "ok"),
+        )
+        self.writer.writerow(row)
+        # Runs take seconds, syncing each of them is cheap and makes the file a journal to resume from
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save_session(runs_dir, session):
+    """Save what a session needs to be resumed: its timestamp, agents, numbers of players and seeds"""
+    path = os.path.join(runs_dir, SESSION_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(session, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_session(runs_dir):
+    with open(os.path.join(runs_dir, SESSION_FILE), encoding="utf-8") as f:
+        session = json.load(f)
+    session["run_seeds"] = {int(run_index): seed for run_index, seed in session["run_seeds"].items()}
+    return session
+
+
+def latest_runs_dir(stats_dir):
+    """Return the most recent runs directory that can be resumed, or None"""
+    runs_dirs = sorted(glob.glob(os.path.join(stats_dir, "runs_*", SESSION_FILE)))
+    return os.path.dirname(runs_dirs[-1]) if runs_dirs else None
+
+
+def completed_tasks(path):
+    """
+    Return the (agent, nb_players, run_index) of the runs in a results file.
+    A line cut short by an interruption is removed, its run will be played again.
+    So are the runs that timed out or failed, since the interruption may be
+    what stopped them: their rows are dropped from the file.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            logger.warning(f"Removed an incomplete line at the end of {path}")
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    completed = [row for row in rows if row["status"] == "ok"]
+    if len(completed) < len(rows):
+        with open(f"{path}.tmp", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULTS_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(completed)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        logger.info(f"Removed {len(rows) - len(completed)} timed out or failed runs from {path}, they will be played again")
+    return {(row["agent"], int(row["nb_players"]), int(row["run_index"])) for row in completed}
+
+
+def load_results(path):
+    """Load the results file, ordered by agent, number of players and run"""
+    results = pd.read_csv(path)
+    return results.sort_values(["agent", "nb_players", "run_index"], kind="stable", ignore_index=True)
+
+
+def write_summary(results, grades_excel_path, agent_names, nb_players_per_session_list, nb_runs_per_session, extrapolate=False):
+    """
+    Write the points of each agent per number of players, with their total and
+    the ceiling. With extrapolate, the points are the mean of the runs played
+    times nb_runs_per_session, for sessions stopped early.
+    """
+    if extrapolate:
+        summary = results.pivot_table(index="agent", columns="nb_players", values="points", aggfunc="mean")
+        summary = summary * nb_runs_per_session
+    else:
+        summary = results.pivot_table(index="agent", columns="nb_players", values="points", aggfunc="sum")
+    summary = summary.reindex(index=agent_names, columns=nb_players_per_session_list, fill_value=0.0)
+    summary = summary.fillna(0.0).astype(float)
+    summary.columns = [str(nb_players) for nb_players in summary.columns]
+    summary.index.name = None
+
+    summary["Total"] = summary.sum(axis=1)
+    summary["Ceiling"] = sum(nb_players * nb_runs_per_session for nb_players in nb_players_per_session_list)
+
+    summary.to_excel(grades_excel_path)
+    logger.info(f"Saved grading results to {grades_excel_path}")
+    return summary
+
+
+def write_agent_runs(results, runs_dir, agent_names):
+    """Write the detail of the runs of each agent to its own Excel file"""
+    runs = results[results[RUNS_COLUMNS].notna().any(axis=1)]
+    runs_by_agent = dict(tuple(runs.groupby("agent", sort=False)))
+    paths = {}
+    for agent_name in agent_names:
+        agent_runs = runs_by_agent.get(agent_name, pd.DataFrame(columns=RESULTS_COLUMNS))
+        paths[agent_name] = os.path.join(runs_dir, f"{agent_name}.xlsx")
+        agent_runs[RUNS_COLUMNS].to_excel(paths[agent_name], index=False)
+    logger.info(f"Saved detailed run results to individual Excel files in {runs_dir}/")
+    return paths
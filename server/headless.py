@@ -0,0 +1,179 @@
+"""
+Headless games for offline evaluation
+
+run_headless_game() plays a whole game in the calling thread, drawing from the
+seeded random generator in the same order as a Room. The random module, which
+the agents draw from, is seeded with the game too, so that a seed always gives
+the same scores. Unlike a Room, it starts no waiting room or game thread,
+opens no socket, never sleeps, and it calls the agents' get_move() directly
+instead of in a thread per move. It is used by the grading workers, and by
+tests and benchmarks:
+
+    result = run_headless_game(config, [("alpha", "alpha.py", "common.agents")], seed=42, nb_players=3)
+    result.best_scores  # {"alpha": 12, "Bot1": 7, "Bot2": 9}
+"""
+
+import logging
+import random
+import time
+
+from common.constants import REFERENCE_TICK_RATE
+from common.messages import StateMessage
+
+from server.ai_client import AIClient
+from server.game import Game, choose_bot_agents
+from server.replay import ReplayRecorder
+
+logger = logging.getLogger("server.headless")
+
+
+class _HeadlessRoom:
+    """The part of a Room that AIClient uses"""
+
+    def __init__(self, config, game):
+        self.config = config
+        self.game = game
+
+
+class HeadlessResult:
+    def __init__(self, best_scores, ticks, status, elapsed, trace):
+        self.best_scores = best_scores  # {train name: best score}
+        self.ticks = ticks
+        self.status = status  # "ok", or "timeout" if the game was stopped before its end
+        self.elapsed = elapsed
+        self.trace = trace  # State hash after the update of each tick, if requested
+
+    @property
+    def ticks_per_second(self):
+        return self.ticks / self.elapsed if self.elapsed else 0.0
+
+
+def run_headless_game(config, agents, seed, nb_players=None, room_id="headless", timeout=None, trace=False, on_tick=None):
+    """
+    Play a game as fast as possible in the calling thread.
+
+    Args:
+        config: ServerConfig of the game. Missing players are bots picked from config.agents.
+        agents: (nickname, agent file name, agent module directory) of the trains added first,
+            e.g. ("alpha", "alpha.py", "common.agents.agents_to_evaluate").
+        seed: Seed of the game.
+        nb_players: Number of trains, len(agents) by default.
+        room_id: Name of the game in the logs and in its replay file, if config.replay_dir is set.
+        timeout: Wall-clock limit in seconds, checked between two ticks. The game stops with
+            status "timeout" when it is exceeded.
+        trace: Keep the state hash of every tick in the result.
+        on_tick: Called with (tick, game) after the update of each tick, before the agents play.
+    """
+    start = time.perf_counter()
+    deadline = start + timeout if timeout is not None else None
+    nb_players = len(agents) if nb_players is None else nb_players
+
+    rng = random.Random(seed)
+    # The agents draw from the random module, seeded too so that the game is the same on every run
+    random.seed(seed)
+    game = Game(config, lambda nickname, cooldown, death_reason: None, nb_players, room_id, seed, rng)
+    game.recorder = ReplayRecorder.for_game(config, room_id, seed, nb_players)
+    room = _HeadlessRoom(config, game)
+    ai_clients = {}
+
+    def add_ai(nickname, agent_file_name, agent_dir):
+        if not game.spawn_train(nickname):
+            logger.error(f"Failed to add new AI train {nickname} to game")
+            return
+        ai_clients[nickname] = AIClient(
+            room, nickname, ai_agent_file_name=agent_file_name, agent_dir=agent_dir, synchronous=True
+        )
+        game.register_ai_client(nickname, ai_clients[nickname])
+
+    for nickname, agent_file_name, agent_dir in agents:
+        add_ai(nickname, agent_file_name, agent_dir)
+
+    # Fill the game with bots like Room.fill_with_bots
+    nb_bots_needed = nb_players - len(ai_clients)
+    if nb_bots_needed > 0:
+        if not config.agents:
+            logger.error(f"No agents defined in config, cannot add bots to game {room_id}")
+        else:
+            bots = choose_bot_agents(rng, config.agents, nb_bots_needed)
+            game.record("b", len(config.agents), nb_bots_needed)
+            for agent in bots:
+                nickname = agent.nickname
+                suffix = 1
+                while nickname in ai_clients:
+                    suffix += 1
+                    nickname = f"{agent.nickname}-{suffix}"
+                add_ai(nickname, agent.agent_file_name, "common.agents")
+
+    # Same loop as Room.run_game, down to how the game time is accumulated,
+    # since it decides on which ticks the remaining time is sent to the agents
+    game.game_started = True
+    total_updates = int(config.game_duration_seconds * REFERENCE_TICK_RATE)
+    game_seconds_per_tick = 1.0 / REFERENCE_TICK_RATE
+    game_time_elapsed = 0.0
+    hashes = [] if trace else None
+    status = "ok"
+    ticks = 0
+    for tick in range(1, total_updates + 1):
+        if deadline is not None and time.perf_counter() > deadline:
+            status = "timeout"
+            break
+        game_time_elapsed += game_seconds_per_tick
+        game.update(tick)
+        ticks = tick
+        if hashes is not None:
+            hashes.append(game.state_hash())
+        if on_tick is not None:
+            on_tick(tick, game)
+
+        remaining_game_time = config.game_duration_seconds - game_time_elapsed
+        state = game.get_dirty_state()
+        if game.last_remaining_time is None or round(remaining_game_time) != round(game.last_remaining_time):
+            state["remaining_time"] = round(remaining_game_time)
+            game.last_remaining_time = remaining_game_time
+
+        if state:
+            state_message = StateMessage(data=state)
+            for ai_client in ai_clients.values():
+                ai_client.update_state(state_message.model_dump())
+
+    if game.recorder is not None:
+        game.recorder.close(game)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Game {room_id} ended after {ticks} ticks in {elapsed:.2f}s ({status}), final scores: {game.best_scores}")
+    return HeadlessResult(dict(game.best_scores), ticks, status, elapsed, hashes)
+
+
+def grade_run(best_scores, nickname, nb_players, run_index):
+    """
+    Return the points earned by an agent in a grading run, and the detail of
+    the run as stored in the Excel file of the agent. The points are
+    nb_players for the 1st place, half of it for the 2nd, a quarter for the
+    3rd and 0 after, or None if the agent has no score.
+    """
+    sorted_scores = sorted(best_scores.items(), key=lambda x: x[1], reverse=True)
+    position = next((i for i, (name, _) in enumerate(sorted_scores) if name == nickname), None)
+
+    points = None
+    if position == 0:
+        points = nb_players
+    elif position == 1:
+        points = nb_players / 2
+    elif position == 2:
+        points = nb_players / 4
+    elif position is not None:
+        points = 0
+
+    run_data = {
+        "run": run_index + 1,
+        "nb players": nb_players,
+        "student": nickname,
+        "student score": best_scores.get(nickname, 0),
+    }
+    bot_index = 1
+    for name, score in sorted_scores:
+        if name != nickname and bot_index <= 3:
+            run_data[f"bot{bot_index}"] = name
+            run_data[f"score bot {bot_index}"] = score
+            bot_index += 1
+    return points, run_data
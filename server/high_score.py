@@ -1,7 +1,10 @@
-import copy
+import atexit
+import bisect
 import json
 import logging
+import os
 import threading
+import time
 
 logger = logging.getLogger("server.highscore")
 
@@ -10,9 +13,19 @@ class HighScore:
     """
     Load and save each player's high score. This class is a singleton its methods
     are thread-safe.
+
+    update() only changes the scores in memory. A background thread appends the
+    new high scores to a log file (FILE_PATH + LOG_SUFFIX) every FLUSH_INTERVAL_SECONDS,
+    and once the log has COMPACT_AFTER_ENTRIES entries, rewrites FILE_PATH with all
+    the scores and empties the log. load() reads FILE_PATH, then replays the log.
+    The TOP_K best scores are kept sorted for dump() and top().
     """
 
     FILE_PATH = "player_scores.json"
+    LOG_SUFFIX = ".log"
+    FLUSH_INTERVAL_SECONDS = 1.0
+    COMPACT_AFTER_ENTRIES = 1000
+    TOP_K = 100
     _instance = None
 
     def __new__(cls):
@@ -21,65 +34,161 @@ class HighScore:
         return HighScore._instance
 
     def __init__(self):
+        if hasattr(self, "lock"):
+            return  # The singleton is already initialized
         self.lock = threading.Lock()
         self.scores = dict()
+        self.top_scores = []  # [(-score, nickname)] of the TOP_K best scores, sorted
+        self.loaded = False
+
+        self.pending = []  # [(nickname, score)] not written to the log yet
+        self.log_entries = 0
+        self.io_lock = threading.Lock()  # Serializes the writes to the files
+        self.writer = None
+
+    @property
+    def log_path(self):
+        return HighScore.FILE_PATH + HighScore.LOG_SUFFIX
+
+    def _set_score(self, nickname, score):
+        """Set a score and update the top scores. Called with self.lock held."""
+        old_score = self.scores.get(nickname)
+        self.scores[nickname] = score
+        if old_score is not None:
+            index = bisect.bisect_left(self.top_scores, (-old_score, nickname))
+            if index < len(self.top_scores) and self.top_scores[index] == (-old_score, nickname):
+                del self.top_scores[index]
+        # Scores only increase, so a score that left the top never has to come back
+        bisect.insort(self.top_scores, (-score, nickname))
+        del self.top_scores[HighScore.TOP_K:]
 
     def update(self, nickname, score):
         """
-        Updates the nickname's high score.
+        Updates the nickname's high score, without waiting for it to be written.
         Returns True if the score is a new high score.
         """
         with self.lock:
-            if nickname in self.scores:
-                if score > self.scores[nickname]:
-                    self.scores[nickname] = score
-                    return True
-            else:
-                self.scores[nickname] = score
-                return True
-            return False
+            if nickname in self.scores and score <= self.scores[nickname]:
+                return False
+            self._set_score(nickname, score)
+            self.pending.append((nickname, score))
+        if self.writer is None:
+            self.load()  # So that the file is never compacted without the scores it already has
+            self._start_writer()
+        return True
 
     def get(self):
         with self.lock:
-            return copy.copy(self.scores)
+            return dict(self.scores)
 
     def get_from_nickname(self, nickname):
         with self.lock:
             return self.scores.get(nickname, 0)
 
+    def top(self, limit=10):
+        """The limit best (nickname, score), best first"""
+        with self.lock:
+            if limit > len(self.top_scores) and len(self.scores) > len(self.top_scores):
+                ranked = sorted(self.scores.items(), key=lambda x: x[1], reverse=True)
+                return ranked[:limit]
+            return [(nickname, -score) for score, nickname in self.top_scores[:limit]]
+
     def dump(self, limit=10):
         """
         Dumps the top limit high scores to the logger.
         """
+        logger.info("===== HIGH SCORES =====")
+        for i, (player, score) in enumerate(self.top(limit), 1):
+            logger.info(f"{i}. {player}: {score}")
+        logger.info("======================")
+
+    def _start_writer(self):
+        with self.io_lock:
+            if self.writer is not None:
+                return
+            self.writer = threading.Thread(target=self._run_writer, name="high-score-writer", daemon=True)
+            self.writer.start()
+            atexit.register(self.save)
+
+    def _run_writer(self):
+        while True:
+            time.sleep(HighScore.FLUSH_INTERVAL_SECONDS)
+            self.flush()
 
+    def flush(self):
+        """Append the pending high scores to the log, and compact it if it is long"""
+        with self.io_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if pending:
+                try:
+                    with open(self.log_path, "a") as f:
+                        f.writelines(json.dumps([nickname, score]) + "\n" for nickname, score in pending)
+                    self.log_entries += len(pending)
+                except OSError as e:
+                    logger.error(f"Error appending high scores to {self.log_path}: {e}")
+                    with self.lock:
+                        self.pending = pending + self.pending
+                    return
+            if self.log_entries >= HighScore.COMPACT_AFTER_ENTRIES:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the scores file with all the scores and empty the log. Called with self.io_lock held."""
         with self.lock:
-            # Sort scores in descending order
-            sorted_scores = sorted(
-                self.scores.items(), key=lambda x: x[1], reverse=True
-            )
-            logger.info("===== HIGH SCORES =====")
-            for i, (player, score) in enumerate(sorted_scores[:limit], 1):
-                logger.info(f"{i}. {player}: {score}")
-            logger.info("======================")
+            scores = dict(self.scores)
+        # The snapshot contains the logged scores and maybe some pending ones, which are logged again later
+        tmp_path = HighScore.FILE_PATH + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(scores, f, indent=4)
+            os.replace(tmp_path, HighScore.FILE_PATH)
+            open(self.log_path, "w").close()
+            self.log_entries = 0
+            logger.debug(f"Compacted high scores into {HighScore.FILE_PATH}")
+        except OSError as e:
+            logger.error(f"Error saving high scores to file: {e}")
 
     def save(self):
         """
-        Save high scores to file.
+        Save all the high scores to file now.
         """
-        with self.lock:
-            try:
-                with open(HighScore.FILE_PATH, "w") as f:
-                    json.dump(self.scores, f, indent=4)
-            except Exception as e:
-                # TODO(Alok): exception shouldn't be swallowed here.
-                logger.error(f"Error saving high scores to file: {e}")
+        self.flush()
+        with self.io_lock:
+            self._compact()
 
     def load(self):
-        with self.lock:
+        """Load the scores file and replay the log, once"""
+        with self.io_lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            scores = {}
             try:
                 with open(HighScore.FILE_PATH, "r") as f:
-                    self.scores = json.load(f)
+                    scores = json.load(f)
+            except FileNotFoundError:
+                pass
             except Exception as e:
                 logger.error(
                     f"Error loading high score file. Will create a new one on save. {e}"
                 )
+            try:
+                with open(self.log_path, "r") as f:
+                    for line in f:
+                        try:
+                            nickname, score = json.loads(line)
+                        except ValueError:
+                            continue  # Line cut by a crash
+                        if score > scores.get(nickname, score - 1):
+                            scores[nickname] = score
+                        self.log_entries += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error reading high score log {self.log_path}: {e}")
+
+            with self.lock:
+                for nickname, score in scores.items():
+                    if score > self.scores.get(nickname, score - 1):
+                        self._set_score(nickname, score)
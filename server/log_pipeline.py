@@ -0,0 +1,101 @@
+"""
+Queued logging for the server
+
+With config.queued_logging, the game, AI and receive threads only put their
+log records in a queue: a QueueListener thread formats them and writes them
+to the console. The hot paths (Game, Train, AIClient, Room.run_game and the
+message handlers of Server) log with %-style arguments, so that records
+filtered out by their level are never formatted.
+
+With config.log_rate_limit_seconds, a RateLimitFilter on each server module
+logger drops the warnings that repeat: once a message (by logger and format
+string, e.g. "Invalid wagon found in to_dict for train %s: %s, skipping") has
+been logged, it is dropped for that long, and the next one says how many were
+dropped. The warnings and errors of these loggers use %-style arguments too,
+so that a message is one key whatever its arguments. benchmarks/bench_logging.py measures the time per tick at each level.
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+logger = logging.getLogger("server.log_pipeline")
+
+
+class RateLimitFilter(logging.Filter):
+    """Let each repeated warning (or error) through at most once per interval"""
+
+    def __init__(self, interval, level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.last_emitted = {}  # {(logger name, format string): time}
+        self.suppressed = {}  # {(logger name, format string): records dropped since}
+        self.next_eviction = 0.0
+        self.lock = threading.Lock()
+
+    def evict(self, now):
+        """
+        Forget the messages last emitted more than interval ago. Called with the lock held.
+        Those with dropped records are kept, so that their next record still counts them.
+        """
+        for key, last in list(self.last_emitted.items()):
+            if now - last >= self.interval and key not in self.suppressed:
+                del self.last_emitted[key]
+        self.next_eviction = now + self.interval
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            if now >= self.next_eviction:
+                self.evict(now)
+            last = self.last_emitted.get(key)
+            if last is not None and now - last < self.interval:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return False
+            self.last_emitted[key] = now
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for a listener in the same process: the arguments are merged
+    into the message, so that the record does not change if they do, but the
+    record is formatted by the listener thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class QueuedLogging:
+    """Moves the handlers of the root logger behind a queue and a listener thread"""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        self.handlers = root.handlers[:]
+        self.queue_handler = _LocalQueueHandler(self.queue)
+        for handler in self.handlers:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Write the queued records and give the handlers back to the root logger"""
+        self.listener.stop()
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            root.addHandler(handler)
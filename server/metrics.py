@@ -0,0 +1,217 @@
+"""
+Server metrics in the Prometheus text format
+
+The server socket, rooms, games and AI clients update the counters and histograms below as
+they run: an update is a dictionary increment under a lock. When
+config.metrics_port is set, MetricsServer serves them at
+http://<metrics_host>:<metrics_port>/metrics from a side thread, with gauges
+read from the server when scraped. Rates, such as ticks or bytes per second,
+are derived from the counters by the scraper:
+
+    rate(trains_ticks_total[1m])
+    sum by (type) (rate(trains_datagrams_sent_bytes_total[1m]))
+    histogram_quantile(0.99, rate(trains_tick_lateness_seconds_bucket[5m]))
+"""
+
+import bisect
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.messages import ClientActionType, ClientMessageType, ServerMessageType
+
+logger = logging.getLogger("server.metrics")
+
+
+def _format_labels(labelnames, labels):
+    if not labelnames:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.values = {}  # {labels: value}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read when the metrics are scraped: callback() returns {labels: value}"""
+
+    def __init__(self, name, help_text, callback, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.labelnames = labelnames
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"Error reading gauge {self.name}: {e}")
+            return lines
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+TICKS = Counter("trains_ticks_total", "Game ticks simulated by the rooms")
+TICK_LATENESS = Histogram(
+    "trains_tick_lateness_seconds",
+    "Delay of each tick of a real-time game behind its schedule",
+    [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+)
+AGENT_MOVE_SECONDS = Histogram(
+    "trains_agent_move_seconds",
+    "Duration of the update of an AI agent, including its get_move() call",
+    [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1],
+)
+DEATHS = Counter("trains_deaths_total", "Train deaths")
+DELIVERIES = Counter("trains_deliveries_total", "Wagons delivered")
+DATAGRAMS_RECEIVED = Counter("trains_datagrams_received_total", "UDP datagrams received, by message type", ("type",))
+BYTES_RECEIVED = Counter("trains_datagrams_received_bytes_total", "UDP bytes received, by message type", ("type",))
+DATAGRAMS_SENT = Counter("trains_datagrams_sent_total", "UDP datagrams sent, by message type", ("type",))
+BYTES_SENT = Counter("trains_datagrams_sent_bytes_total", "UDP bytes sent, by message type", ("type",))
+
+_METRICS = [
+    TICKS,
+    TICK_LATENESS,
+    AGENT_MOVE_SECONDS,
+    DEATHS,
+    DELIVERIES,
+    DATAGRAMS_RECEIVED,
+    BYTES_RECEIVED,
+    DATAGRAMS_SENT,
+    BYTES_SENT,
+]
+
+
+# Labels of the datagram counters: the datagrams come from anyone, so any other type is counted as "other"
+DATAGRAM_TYPES = frozenset(
+    member.value for enum in (ServerMessageType, ClientMessageType, ClientActionType) for member in enum
+)
+
+# Type (or action) at the start of a JSON message, with or without spaces around the colon
+_DATAGRAM_TYPE = re.compile(rb'\{\s*"(?:type|action)"\s*:\s*"([a-z_]{1,32})"')
+
+
+def datagram_type(data):
+    """Type (or action) of the first JSON message of a datagram, read without decoding it"""
+    match = _DATAGRAM_TYPE.match(data)
+    if match is None:
+        return "other"
+    kind = match.group(1).decode()
+    return kind if kind in DATAGRAM_TYPES else "other"
+
+
+class MeteredSocket:
+    """UDP socket counting the datagrams and bytes it sends and receives. Other calls go to the socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def sendto(self, data, addr):
+        sent = self.sock.sendto(data, addr)
+        kind = (datagram_type(data),)
+        DATAGRAMS_SENT.inc(labels=kind)
+        BYTES_SENT.inc(len(data), labels=kind)
+        return sent
+
+    def recvfrom(self, bufsize):
+        data, addr = self.sock.recvfrom(bufsize)
+        kind = (datagram_type(data),)
+        DATAGRAMS_RECEIVED.inc(labels=kind)
+        BYTES_RECEIVED.inc(len(data), labels=kind)
+        return data, addr
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def render(gauges=()):
+    lines = []
+    for metric in list(gauges) + _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics over HTTP on a daemon thread"""
+
+    def __init__(self, host, port, gauges=()):
+        gauges = list(gauges)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = render(gauges).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} {format % args}")
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
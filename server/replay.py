@@ -0,0 +1,381 @@
+"""
+Deterministic replay for the game "I Like Trains"
+
+The game only draws from the room's seeded random.Random, so a game is fully
+determined by its seed, its config and the inputs applied between two ticks.
+ReplayRecorder writes these to an append-only, gzip-compressed JSON lines file:
+
+    {"version": 1, "room_id": ..., "seed": ..., "nb_players": ..., "config": {...}}
+    [tick, kind, ...]
+
+where kind is one of:
+    "n" name            declares a train name, referred to by its index afterwards
+    "b" nb_agents nb    bots were picked from the config (consumes random draws)
+    "s" train           the train was spawned
+    "a" train is_dead   an AI client was registered for the train
+    "r" train new_name  the train was renamed (player replaced by an AI)
+    "d" train move      the train's next direction changed (index in DIRECTIONS)
+    "w" train           the train dropped a wagon
+    "h" hash            state hash after the update of this tick
+    "e" hash            end of the game, with the hash of the final state
+
+Inputs logged at tick t were applied after the update of tick t and before the
+update of tick t + 1. replay_game() re-simulates a log headlessly and checks
+the recorded state hashes. export_keyframes() turns a log into a seekable
+keyframe replay (see common/replay_file.py) that can be watched with
+python -m client.replay_viewer. From the command line:
+
+    python -m server.replay replays/<room>_<seed>.replay.gz [--hashes] [--keyframes out.trains]
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import time
+
+from common.constants import REFERENCE_TICK_RATE
+from common.move import Move
+from common.replay_file import KeyframeReplayWriter
+from common.server_config import ServerConfig
+
+from server.game import Game, choose_bot_agents
+
+logger = logging.getLogger("server.replay")
+
+REPLAY_VERSION = 1
+
+DIRECTIONS = [move.value for move in (Move.UP, Move.DOWN, Move.LEFT, Move.RIGHT)]
+DIRECTION_INDEX = {direction: index for index, direction in enumerate(DIRECTIONS)}
+
+_SEPARATORS = (",", ":")
+
+DEFAULT_KEYFRAME_INTERVAL = 5 * REFERENCE_TICK_RATE
+
+
+class ReplayRecorder:
+    """Append-only log of the seed, config and inputs of one game"""
+
+    def __init__(self, path, room_id, seed, nb_players, config: ServerConfig):
+        self.path = path
+        self.hash_interval = config.replay_hash_interval_ticks
+        self.names = {}  # {train name: index in the log}
+        self.closed = False
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.write(
+            {
+                "version": REPLAY_VERSION,
+                "room_id": room_id,
+                "seed": seed,
+                "nb_players": nb_players,
+                "config": config.model_dump(mode="json"),
+            }
+        )
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, separators=_SEPARATORS) + "\n")
+
+    def train(self, tick, name):
+        """Return the index of a train name, declaring it on first use"""
+        index = self.names.get(name)
+        if index is None:
+            index = self.names[name] = len(self.names)
+            self.write([tick, "n", name])
+        return index
+
+    def record(self, tick, kind, *args):
+        """Record an input. Called with the game lock held."""
+        if self.closed:
+            return
+        if kind in ("s", "a", "r", "d", "w"):
+            args = (self.train(tick, args[0]),) + args[1:]
+        if kind == "d":
+            args = (args[0], DIRECTION_INDEX[args[1]])
+        self.write([tick, kind, *args])
+
+    def record_tick(self, game):
+        """Record the state hash every hash_interval ticks. Called with the game lock held."""
+        if self.closed or not self.hash_interval:
+            return
+        if game.current_tick % self.hash_interval == 0:
+            self.write([game.current_tick, "h", game.state_hash()])
+            # Hashes are rare enough to flush on each of them, so that the log
+            # of a crashed server can be replayed up to the last hash
+            self.file.flush()
+
+    def close(self, game):
+        if self.closed:
+            return
+        with game.lock:
+            self.write([game.current_tick, "e", game.state_hash()])
+            self.closed = True
+            self.file.close()
+        logger.info(f"Replay of room {game.room_id} saved to {self.path}")
+
+    def discard(self):
+        """Close and delete the log of a game that never started"""
+        if self.closed:
+            return
+        self.closed = True
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning(f"Cannot delete replay {self.path}: {e}")
+
+    @classmethod
+    def for_game(cls, config, room_id, seed, nb_players):
+        """Create the recorder of a game, or return None if recording is disabled"""
+        if not config.replay_dir:
+            return None
+        path = os.path.join(config.replay_dir, f"{room_id}_{seed}.replay.gz")
+        try:
+            return cls(path, room_id, seed, nb_players, config)
+        except OSError as e:
+            logger.error(f"Cannot record replay to {path}: {e}")
+            return None
+
+    @classmethod
+    def for_room(cls, room):
+        """Create the recorder of a room, or return None if recording is disabled"""
+        return cls.for_game(room.config, room.id, room.bot_seed, room.nb_players_max)
+
+
+class ReplayAIClient:
+    """Stands in for an AIClient: the game only reads and writes its respawn flags"""
+
+    def __init__(self, is_dead):
+        self.is_dead = is_dead
+        self.waiting_for_respawn = is_dead
+        self.death_tick = 0
+        self.respawn_cooldown = 0
+
+
+class ReplayResult:
+    def __init__(self, ticks, hashes_checked, mismatch_tick, final_hash, best_scores, elapsed):
+        self.ticks = ticks
+        self.hashes_checked = hashes_checked
+        self.mismatch_tick = mismatch_tick  # First tick whose hash differs, or None
+        self.final_hash = final_hash
+        self.best_scores = best_scores
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.mismatch_tick is None
+
+
+def load_replay(path):
+    """Return the header, the inputs grouped by tick, the hashes by tick and the end entry"""
+    inputs = {}  # {tick: [entry]}
+    hashes = {}  # {tick: hash}
+    end = None  # [tick, "e", hash] if the game ended normally
+    last_tick = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != REPLAY_VERSION:
+            raise ValueError(f"Unsupported replay version: {header.get('version')}")
+        for line in _complete_lines(f):
+            entry = json.loads(line)
+            tick, kind = entry[0], entry[1]
+            last_tick = max(last_tick, tick)
+            if kind == "h":
+                hashes[tick] = entry[2]
+            elif kind == "e":
+                end = entry
+            else:
+                inputs.setdefault(tick, []).append(entry)
+    return header, inputs, hashes, end or [last_tick, "e", None]
+
+
+def _complete_lines(f):
+    """Yield the complete lines of a log, which is truncated if the server crashed"""
+    try:
+        for line in f:
+            if line.endswith("\n"):
+                yield line
+    except EOFError:
+        logger.warning("Replay log is truncated, replaying up to its last complete line")
+
+
+def create_game(header):
+    """Create the game as Room does, before any input is applied"""
+    config = ServerConfig.model_validate(header["config"])
+    seed = header["seed"]
+    return Game(
+        config,
+        lambda nickname, cooldown, death_reason: None,
+        header["nb_players"],
+        header["room_id"],
+        seed,
+        random.Random(seed),
+    )
+
+
+def apply_input(game, names, entry):
+    """Apply one logged input to the game"""
+    kind, args = entry[1], entry[2:]
+    if kind == "n":
+        names.append(args[0])
+    elif kind == "b":
+        choose_bot_agents(game.random, list(range(args[0])), args[1])
+    elif kind == "s":
+        game.spawn_train(names[args[0]])
+    elif kind == "a":
+        game.register_ai_client(names[args[0]], ReplayAIClient(args[1]))
+    elif kind == "r":
+        game.rename_train(names[args[0]], args[1])
+    elif kind == "d":
+        game.change_direction(names[args[0]], DIRECTIONS[args[1]])
+    elif kind == "w":
+        game.drop_wagon(names[args[0]])
+    else:
+        raise ValueError(f"Unknown replay entry: {entry}")
+
+
+def replay_game(path, verify=True, on_tick=None, on_input=None):
+    """
+    Re-simulate a recorded game as fast as possible.
+
+    Args:
+        verify: Stop at the first tick whose state hash differs from the log.
+        on_tick: Called with (tick, game) after the inputs of tick 0, then after each update.
+        on_input: Called with (tick, game, entry, train names) before each input is applied.
+    """
+    header, inputs, hashes, end = load_replay(path)
+    last_tick, end_hash = end[0], end[2]
+    game = create_game(header)
+    names = []
+    hashes_checked = 0
+    mismatch_tick = None
+    start = time.perf_counter()
+
+    game.game_started = True
+    for entry in inputs.get(0, []):
+        if on_input is not None:
+            on_input(0, game, entry, names)
+        apply_input(game, names, entry)
+    if on_tick is not None:
+        on_tick(0, game)
+
+    ticks = 0
+    for tick in range(1, last_tick + 1):
+        game.update(tick)
+        ticks = tick
+
+        if on_tick is not None:
+            on_tick(tick, game)
+
+        expected = hashes.get(tick)
+        if expected is not None:
+            hashes_checked += 1
+            if game.state_hash() != expected and mismatch_tick is None:
+                mismatch_tick = tick
+                if verify:
+                    break
+
+        for entry in inputs.get(tick, []):
+            if on_input is not None:
+                on_input(tick, game, entry, names)
+            apply_input(game, names, entry)
+
+    # The final hash is taken after the inputs of the last tick
+    if ticks == last_tick and end_hash is not None:
+        hashes_checked += 1
+        if game.state_hash() != end_hash and mismatch_tick is None:
+            mismatch_tick = last_tick
+
+    return ReplayResult(
+        ticks,
+        hashes_checked,
+        mismatch_tick,
+        game.state_hash(),
+        dict(game.best_scores),
+        time.perf_counter() - start,
+    )
+
+
+def export_keyframes(path, out_path, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL):
+    """
+    Re-simulate a recorded game and save the states its clients received as a
+    keyframe replay. Returns the ReplayResult of the re-simulation.
+    """
+    header, _, _, _ = load_replay(path)
+    config = ServerConfig.model_validate(header["config"])
+    meta = {key: header[key] for key in ("room_id", "seed", "nb_players")}
+    meta["game_duration_seconds"] = config.game_duration_seconds
+    renames = []  # Renames applied since the last tick, sent before its state like Room does
+    last_remaining_time = None
+
+    def remaining_time(tick):
+        return round(config.game_duration_seconds - tick / REFERENCE_TICK_RATE)
+
+    with KeyframeReplayWriter(out_path, meta, keyframe_interval) as writer:
+
+        def on_tick(tick, game):
+            nonlocal last_remaining_time
+            nonlocal renames
+            states, renames = renames, []
+
+            if tick == 0:
+                # Consume the dirty flags, the keyframe has everything
+                game.get_dirty_state()
+            else:
+                # Same content as the state messages sent by Room.run_game
+                state = game.get_dirty_state()
+                if remaining_time(tick) != last_remaining_time:
+                    state["remaining_time"] = remaining_time(tick)
+                if state:
+                    states.append(state)
+                writer.add_delta(tick, states)
+
+            if tick % keyframe_interval == 0:
+                last_remaining_time = remaining_time(tick)
+                writer.add_keyframe(tick, dict(game.get_state(), remaining_time=last_remaining_time))
+
+        def on_input(tick, game, entry, names):
+            if entry[1] == "r":
+                renames.append({"rename_train": [names[entry[2]], entry[3]]})
+
+        result = replay_game(path, on_tick=on_tick, on_input=on_input)
+
+    if not result.ok:
+        logger.warning(f"State hash differs at tick {result.mismatch_tick}, keyframes stop there")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded game and verify its state hashes")
+    parser.add_argument("path")
+    parser.add_argument("--hashes", action="store_true", help="print the state hash of every tick")
+    parser.add_argument("--keyframes", metavar="OUT", help="also save a seekable keyframe replay to OUT")
+    parser.add_argument("--keyframe-interval", type=int, default=DEFAULT_KEYFRAME_INTERVAL, help="ticks between two keyframes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.keyframes:
+        result = export_keyframes(args.path, args.keyframes, args.keyframe_interval)
+        print(f"Keyframe replay saved to {args.keyframes}")
+    else:
+        on_tick = None
+        if args.hashes:
+            def on_tick(tick, game):
+                print(tick, game.state_hash())
+
+        result = replay_game(args.path, on_tick=on_tick)
+    print(f"Replayed {result.ticks} ticks in {result.elapsed:.2f}s ({result.ticks / max(result.elapsed, 1e-9):,.0f} ticks/s)")
+    print(f"Final scores: {result.best_scores}")
+    if result.ok:
+        print(f"OK: {result.hashes_checked} state hashes match")
+    else:
+        print(f"MISMATCH: state hash differs at tick {result.mismatch_tick}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Content-addressed cache of grading results
+
+A grading run is fully determined by the source of the evaluated agent, the
+bots it plays against, the seed, the number of players, the config and the
+game engine. The result of a run is stored under a hash of all of these, so
+that grading again after one agent changed only simulates the runs of that
+agent.
+
+The engine is identified by ENGINE_VERSION and by a hash of ENGINE_SOURCES,
+so editing the game code invalidates the cache by itself. Bump ENGINE_VERSION
+for changes the hash cannot see, e.g. a new version of a dependency. To
+inspect or clear a cache:
+
+    python -m server.result_cache <cache dir> [--clear]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+logger = logging.getLogger("server.result_cache")
+
+ENGINE_VERSION = 1
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sources that decide the outcome of a game, relative to the repository root
+ENGINE_SOURCES = [
+    "common/base_agent.py",
+    "common/constants.py",
+    "common/messages.py",  # Builds the states the agents see
+    "common/move.py",
+    "server/ai_client.py",
+    "server/delivery_zone.py",
+    "server/game.py",
+    "server/headless.py",  # Plays the grading runs
+    "server/passenger.py",
+    "server/train.py",
+]
+
+# Config fields that do not change the outcome of a grading run
+IGNORED_CONFIG_FIELDS = {
+    "host",
+    "port",
+    "seed",  # Each run has its own seed, part of the key
+    "nb_players_per_room",  # Each run has its own number of players, part of the key
+    "allow_multiple_connections",
+    "client_timeout_seconds",
+    "client_timeout_max_seconds",
+    "rtt_probe_interval_seconds",
+    "replay_dir",
+    "replay_hash_interval_ticks",
+    "metrics_port",
+    "metrics_host",
+    "trace_dir",
+    "profile_dir",
+    "profile_interval_seconds",
+    "queued_logging",
+    "log_rate_limit_seconds",
+    "grading_mode_args",
+}
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def engine_hash():
+    digest = hashlib.sha256(f"engine {ENGINE_VERSION}".encode())
+    for source in ENGINE_SOURCES:
+        digest.update(source.encode())
+        digest.update(file_hash(os.path.join(ROOT_DIR, source)).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Results of grading runs stored as JSON files named after the hash of their inputs"""
+
+    def __init__(self, cache_dir, config):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+        bots = [
+            [agent.nickname, file_hash(os.path.join(ROOT_DIR, "common", "agents", agent.agent_file_name))]
+            for agent in config.agents
+        ]
+        # Everything the runs of a session share
+        self.session_inputs = {
+            "engine": engine_hash(),
+            "config": config.model_dump(mode="json", exclude=IGNORED_CONFIG_FIELDS | {"agents"}),
+            "bots": bots,
+        }
+        self.agent_hashes = {}  # {agent path: hash of its source}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, agent_path, nb_players, seed):
+        """Return the key of a run of an agent"""
+        if agent_path not in self.agent_hashes:
+            self.agent_hashes[agent_path] = file_hash(agent_path)
+        inputs = dict(
+            self.session_inputs,
+            # The name is the nickname of the agent's train
+            agent=[os.path.basename(agent_path), self.agent_hashes[agent_path]],
+            nb_players=nb_players,
+            seed=seed,
+        )
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the stored result of a run, or None"""
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so that an interrupted write never leaves a partial entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear a grading result cache")
+    parser.add_argument("cache_dir")
+    parser.add_argument("--clear", action="store_true", help="delete every cached result")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.cache_dir):
+        print(f"{args.cache_dir} does not exist")
+        return
+    if args.clear:
+        shutil.rmtree(args.cache_dir)
+        print(f"Cleared {args.cache_dir}")
+        return
+
+    entries = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(args.cache_dir):
+        for filename in filenames:
+            if filename.endswith(".json"):
+                entries += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+    print(f"{entries} cached results ({size / 1024:.0f} KiB), engine {engine_hash()[:12]}")
+
+
+if __name__ == "__main__":
+    main()
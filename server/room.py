@@ -4,13 +4,12 @@ import logging
 import random
 import threading
 import time
-from tqdm import tqdm
 
 from common.server_config import ServerConfig
 from common import stats_manager
 from common.constants import REFERENCE_TICK_RATE
 from common.messages import (
-    GameStartedSuccessMessage,
+    GAME_STARTED_SUCCESS_BYTES,
     StateMessage,
     GameOverMessage,
     GameOverData,
@@ -23,8 +22,10 @@ from common.messages import (
     RespawnFailedMessage,
 )
 
-from server.game import Game
+from server.game import Game, choose_bot_agents
 from server.ai_client import AIClient
+from server.replay import ReplayRecorder
+from server import metrics, sampling_profiler, tracing
 
 # Configure logger
 logger = logging.getLogger("server.room")
@@ -66,13 +67,8 @@ class Room:
         server_socket,
         send_cooldown_notification,
         remove_room,
-        addr_to_sciper,
+        sessions,
         record_disconnection,
-        tqdm_message=None,
-        grading_scores=None,
-        run_results=None,
-        current_run_index=None,
-        current_nb_players=None,
         bot_seed=None,
     ):
         self.config = config
@@ -82,13 +78,8 @@ class Room:
         self.server_socket = server_socket
         self.send_cooldown_notification = send_cooldown_notification
         self.remove_room = remove_room
-        self.addr_to_sciper = addr_to_sciper
+        self.sessions = sessions  # Server's SessionRegistry, to look up client scipers
         self.record_disconnection = record_disconnection
-        self.tqdm_message = tqdm_message
-        self.grading_scores = grading_scores
-        self.run_results = run_results
-        self.current_run_index = current_run_index
-        self.current_nb_players = current_nb_players
 
         # Initialize random seed if provided directly or in config, otherwise generate one
         if bot_seed is not None:
@@ -103,16 +94,15 @@ class Room:
 
         self.clients = {}  # {addr: nickname}
         self.client_game_modes = {}  # {addr: game_mode}
+        self.player_scipers = {}  # {nickname: sciper} of the players who joined, kept after they leave
+        self.replaced_players = []  # Nicknames of the players whose train was given to an AI mid-game
         self.game_thread = None
 
         self.game_over = False  # Track if the game is over
         self.room_creation_time = time.time()  # Track when the room was created
         self.first_client_join_time = None  # Track when the first client joins
         self.stop_waiting_room = False  # Flag to stop the waiting room thread - Initialized BEFORE thread start
-
-        self.waiting_room_thread = threading.Thread(target=self.broadcast_waiting_room)
-        self.waiting_room_thread.daemon = True
-        self.waiting_room_thread.start()
+        self.waiting_room_changed = threading.Event()  # Set when players join or leave the waiting room
 
         self.tick_counter = 0  # Track the number of ticks since game start
 
@@ -129,6 +119,13 @@ class Room:
             self.bot_seed,
             self.random,
         )
+        self.game.recorder = ReplayRecorder.for_room(self)
+        self.start_lock = threading.Lock()
+
+        # The waiting room thread starts the game, so it must only run once the room is fully initialized
+        self.waiting_room_thread = threading.Thread(target=self.broadcast_waiting_room)
+        self.waiting_room_thread.daemon = True
+        self.waiting_room_thread.start()
 
         logger.debug(f"Room {room_id} created with number of clients {nb_players_max}")
 
@@ -139,21 +136,21 @@ class Room:
         self.stop_waiting_room = True
         # self.waiting_room_thread.join() # Cannot join from the same thread
 
-        if self.game_thread:
-            return
+        # The waiting room thread and the server may both try to start the game
+        with self.start_lock:
+            if self.game.game_started:
+                return
+            self.game.game_started = True
 
         # Reset tick counter            
         self.game.start_time = time.time()  # Start at tick 0
-        self.game.game_started = True
         self.game.start_time_ticks = 0
         self.game.current_tick = 0
 
         logger.debug(f"Game started in room {self.id} at tick {self.tick_counter}")
         logger.debug(f"Clients in room {self.id}: {self.clients}")
 
-        # Send game_started_success message - Moved before the grading mode check
-        response = GameStartedSuccessMessage()
-        # Send response to all clients
+        # Send game_started_success message to all clients
         for client_addr in list(self.clients.keys()):
             try:
                 # Skip AI clients - they don't need network messages
@@ -163,11 +160,9 @@ class Room:
                     and client_addr[0] == "AI"
                 ):
                     continue
-                self.server_socket.sendto(
-                    response.to_json().encode(), client_addr
-                )
+                self.server_socket.sendto(GAME_STARTED_SUCCESS_BYTES, client_addr)
             except Exception as e:
-                logger.error(f"Error sending start success to client: {e}")
+                logger.error("Error sending start success to client: %s", e)
         
         self.add_all_trains()
         
@@ -183,11 +178,10 @@ class Room:
             if ai_name in self.game.trains:
                 logger.debug(f"Train {ai_name} initialized at position {self.game.trains[ai_name].position}")
             else:
-                logger.warning(f"Failed to add train for AI client {ai_name}")
+                logger.warning("Failed to add train for AI client %s", ai_name)
         
-        # In grading mode, we run the simulation directly in this thread
         # Create and start game thread
-        self.game_thread = threading.Thread(target=self.run_game)
+        self.game_thread = threading.Thread(target=self.run_game, name=f"room-{self.id}")
         self.game_thread.daemon = True
         self.game_thread.start()
 
@@ -196,7 +190,9 @@ class Room:
         )
             
     def run_game(self):
-        """Run the game in grading mode - directly in the room thread without using broadcast_game_state"""
+        """Run the game loop in the game thread, sending the state to the clients after each tick"""
+        sampling_profiler.register_current_thread(f"room_{self.id}")
+
         # Define the standard tick rate (for reference)
         reference_tickrate = REFERENCE_TICK_RATE
         
@@ -218,10 +214,10 @@ class Room:
         else:
             speed_description = f"{reference_tickrate/self.config.tick_rate:.1f}x slower than normal"
             
-        logger.debug(f"Game running at {speed_description} (tickrate: {self.config.tick_rate}).")
-        logger.debug(f"Acceleration in comparison to reference tickrate: {self.config.tick_rate / reference_tickrate:.2f}")
-        logger.debug(f"Game seconds per tick: {game_seconds_per_tick:.4f}s")
-        logger.debug(f"Real seconds per tick: {real_seconds_per_tick*1000:.2f}ms")
+        logger.debug("Game running at %s (tickrate: %s).", speed_description, self.config.tick_rate)
+        logger.debug("Acceleration in comparison to reference tickrate: %.2f", self.config.tick_rate / reference_tickrate)
+        logger.debug("Game seconds per tick: %.4fs", game_seconds_per_tick)
+        logger.debug("Real seconds per tick: %.2fms", real_seconds_per_tick*1000)
         
         # Initialize game time to zero
         game_time_elapsed = 0.0
@@ -230,26 +226,20 @@ class Room:
         game_start_time = time.time()
         
         # Run the simulation for the calculated number of ticks
-        # Use tqdm progress bar only in grading mode
-        if self.config.grading_mode:
-            iteration_range = tqdm(range(total_updates), desc=self.tqdm_message, unit="ticks")
-        else:
-            iteration_range = range(total_updates)
-            
-        for update_count in iteration_range:
+        for update_count in range(total_updates):
             if not self.running or self.game_over:
                 break
                 
             # Synchronize update_count and tick_counter
             self.tick_counter = update_count + 1
-            self.game.current_tick = self.tick_counter
             
             # Update game time - this is completely independent of real time
             # Each tick represents a fixed amount of game time
             game_time_elapsed += game_seconds_per_tick
 
             # Update game state
-            self.game.update()
+            self.game.update(self.tick_counter)
+            metrics.TICKS.inc()
             
             # Calculate remaining game time
             remaining_game_time = self.config.game_duration_seconds - game_time_elapsed
@@ -268,54 +258,57 @@ class Room:
             if state:  # If data has been modified
                 # Update all AI clients
                 for ai_client in self.ai_clients.values():
-                    ai_client.update_state(state_message.model_dump())
+                    with tracing.span("serialize", format="dict"):
+                        state_data = state_message.model_dump()
+                    ai_client.update_state(state_data)
                 
                 # Send the state to all clients
-                state_json = state_message.to_json()
-                for client_addr in list(self.clients.keys()):
-                    try:
-                        # Skip AI clients - they don't need network messages
-                        if (
-                            isinstance(client_addr, tuple)
-                            and len(client_addr) == 2
-                            and client_addr[0] == "AI"
-                        ):
-                            continue
-
-                        self.server_socket.sendto(
-                            state_json.encode(), client_addr
-                        )
-                    except Exception as e:
-                        logger.error(f"Error sending state to client: {e}")
+                with tracing.span("serialize", format="json"):
+                    state_json = state_message.to_json()
+                with tracing.span("send_state", clients=len(self.clients)):
+                    for client_addr in list(self.clients.keys()):
+                        try:
+                            # Skip AI clients - they don't need network messages
+                            if (
+                                isinstance(client_addr, tuple)
+                                and len(client_addr) == 2
+                                and client_addr[0] == "AI"
+                            ):
+                                continue
+
+                            self.server_socket.sendto(
+                                state_json.encode(), client_addr
+                            )
+                        except Exception as e:
+                            logger.error("Error sending state to client: %s", e)
             
             # Sleep if necessary to maintain the desired tick rate in real time
-            # Skip sleep in grading mode to run as fast as possible
-            if not self.config.grading_mode:
-                if real_seconds_per_tick > 0:
-                    # Calculate elapsed real time since game start
-                    elapsed_real_time = time.time() - game_start_time
-                    # Calculate target real time based on current update count and target tick rate
-                    target_real_time = (update_count + 1) * real_seconds_per_tick
-                    # Calculate time to sleep to catch up with the target time
-                    time_to_sleep = max(0, target_real_time - elapsed_real_time)
-                    
-                    if time_to_sleep > 0:
-                        time.sleep(time_to_sleep)
-                else:
-                    # log that the loop is late
-                    logger.warning(f"Game loop is late by {-time_to_sleep:.2f} seconds")
+            if real_seconds_per_tick > 0:
+                # Calculate elapsed real time since game start
+                elapsed_real_time = time.time() - game_start_time
+                # Calculate target real time based on current update count and target tick rate
+                target_real_time = (update_count + 1) * real_seconds_per_tick
+                # Calculate time to sleep to catch up with the target time
+                time_to_sleep = max(0, target_real_time - elapsed_real_time)
+                metrics.TICK_LATENESS.observe(max(0, elapsed_real_time - target_real_time))
+                
+                if time_to_sleep > 0:
+                    time.sleep(time_to_sleep)
+            else:
+                # log that the loop is late
+                logger.warning("Game loop is late by %.2f seconds", -time_to_sleep)
 
         # Game has finished
         end_time = time.time()
         total_real_time = end_time - game_start_time
-        logger.info(f"Game completed in {total_real_time:.2f} real seconds")
-        logger.info(f"Game time elapsed: {game_time_elapsed:.2f} seconds")
-        logger.info(f"Time ratio: {game_time_elapsed/total_real_time:.2f}x")
-        logger.info(f"Actual ticks completed: {self.tick_counter}")
-        logger.info(f"Ticks per second: {self.tick_counter/total_real_time:.1f}")
-        logger.info(f"Final scores: {self.game.best_scores}")
-
-        logger.info(f"Game in room {self.id} ending after {self.tick_counter} ticks, game time: {game_time_elapsed:.2f}s, real time: {total_real_time:.2f}s")
+        logger.info("Game completed in %.2f real seconds", total_real_time)
+        logger.info("Game time elapsed: %.2f seconds", game_time_elapsed)
+        logger.info("Time ratio: %.2fx", game_time_elapsed/total_real_time)
+        logger.info("Actual ticks completed: %s", self.tick_counter)
+        logger.info("Ticks per second: %.1f", self.tick_counter/total_real_time)
+        logger.info("Final scores: %s", self.game.best_scores)
+
+        logger.info("Game in room %s ending after %s ticks, game time: %.2fs, real time: %.2fs", self.id, self.tick_counter, game_time_elapsed, total_real_time)
         self.end_game()
 
     def end_game(self):
@@ -325,6 +318,14 @@ class Room:
 
         self.game_over = True
 
+        if self.game.recorder is not None:
+            self.game.recorder.close(self.game)
+
+        if self.config.trace_dir is not None:
+            # end_game runs on the game thread, whose events are the room's
+            tracing.dump_to_dir(self.config.trace_dir, f"room_{self.id}", current_thread_only=True)
+            tracing.release_current_thread()
+
         # Collect final scores
         final_scores = []
 
@@ -345,10 +346,9 @@ class Room:
 
             final_scores.append({"name": nickname, "best_score": best_score})
 
-            # Update best score in the scores file
-            # if self.game.high_score_all_time.update(nickname, best_score):
-            #     scores_updated = True
-            #     logger.info(f"Updated best score for {nickname}: {best_score}")
+            # Update the all-time best score, written to the scores file in the background
+            if not self.config.grading_mode and self.game.high_score_all_time.update(nickname, best_score):
+                logger.info(f"Updated best score for {nickname}: {best_score}")
 
             participant_id = None
             is_human = False
@@ -356,7 +356,7 @@ class Room:
             found_human = False
             for addr, name in self.clients.items():
                 if name == nickname:
-                    sciper = self.addr_to_sciper.get(addr)
+                    sciper = self.sessions.get_sciper(addr)
                     if sciper:
                         participant_id = sciper
                         is_human = True
@@ -381,87 +381,29 @@ class Room:
                     logger.debug(f"  Recording: Human {human_id} ({human_score}) vs Bot {bot_id} ({bot_score})")
                     stats_manager.record_bot_vs_human_score(human_id, bot_id, human_score, bot_score)
 
-        # --- Update Excel scores for grading mode ---
-        if self.config.grading_mode and hasattr(self, 'student_nickname'):
-            # Get the sorted scores to determine rankings
-            sorted_scores = sorted([(nickname, score) for nickname, score in self.game.best_scores.items()], key=lambda x: x[1], reverse=True)
-            
-            # Find the student agent's position
-            student_position = None
-            for i, (nickname, score) in enumerate(sorted_scores):
-                if nickname == self.student_nickname:
-                    student_position = i
-                    break
-            
-            if student_position is not None:
-                # Calculate points based on position
-                nb_players = self.nb_players_max
-                points = 0
-                
-                if student_position == 0:  # First place
-                    points = nb_players
-                    logger.info(f"Agent {self.student_nickname} came in 1st place, earning {points} points")
-                elif student_position == 1:  # Second place
-                    points = nb_players / 2
-                    logger.info(f"Agent {self.student_nickname} came in 2nd place, earning {points} points")
-                elif student_position == 2:  # Third place
-                    points = nb_players / 4
-                    logger.info(f"Agent {self.student_nickname} came in 3rd place, earning {points} points")
-                else:
-                    logger.info(f"Agent {self.student_nickname} came in {student_position+1}th place, earning 0 points")
-                
-                # Extract agent name from student_nickname (remove 'Student_' prefix)
-                agent_name = self.student_nickname.replace('Student_', '')
-                
-                # Use grading_scores dictionary passed during room creation
-                if self.grading_scores is not None and agent_name in self.grading_scores:
-                    # Use current_nb_players passed during room creation or fallback to nb_players_max
-                    current_nb_players = self.current_nb_players if self.current_nb_players is not None else self.nb_players_max
-                    
-                    if current_nb_players in self.grading_scores[agent_name]:
-                        self.grading_scores[agent_name][current_nb_players] += points
-                        logger.info(f"Updated scores for {agent_name} with {current_nb_players} players: {self.grading_scores[agent_name][current_nb_players]}")
-                    else:
-                        logger.warning(f"Unable to update scores: {current_nb_players} not found in score dictionary for {agent_name}")
-            else:
-                logger.warning("Student position is None")
-                # Set student score to 0
-                
-            # --- Store run results for Excel file ---
-            if self.run_results is not None:
-                # Get student score
-                student_score = 0
-                for nickname, score in sorted_scores:
-                    if nickname == self.student_nickname:
-                        student_score = score
-                        break
-                
-                # Create a dictionary to store the run results
-                run_result = {
-                    "run": self.current_run_index+1,
-                    "nb players": self.nb_players_max,
-                    "student": self.student_nickname,
-                    "student score": student_score
-                }
-                
-                # Add bot scores
-                bot_index = 1
-                for nickname, score in sorted_scores:
-                    if nickname != self.student_nickname and bot_index <= 3:
-                        run_result[f"bot{bot_index}"] = nickname
-                        run_result[f"score bot {bot_index}"] = score
-                        bot_index += 1
-                
-                # Add the run result to the list
-                self.run_results.append(run_result)
-                logger.info(f"Stored run results for {self.student_nickname}: {run_result}")
-            else:
-                logger.warning("No run_results list found in the room object")
-
-        elif hasattr(self, 'student_nickname'):
-            logger.info(f"Not in grading mode, skipping score update for {self.student_nickname}")
-        else:
-            logger.debug("No student agent in this room, skipping score update")
+        # --- Record the match history ---
+        if not self.config.grading_mode:
+            nicknames = list(self.game.trains)
+            nicknames += [n for n in self.game.best_scores if n not in nicknames]
+            # Players who left mid-game still played it, even without a score
+            nicknames += [n for n in self.replaced_players if n not in nicknames]
+            stats_manager.record_match(
+                self.id,
+                self.bot_seed,
+                self.nb_players_max,
+                self.tick_counter,
+                self.tick_counter / REFERENCE_TICK_RATE,
+                [
+                    (
+                        nickname,
+                        None if nickname in self.ai_clients else self.player_scipers.get(nickname),
+                        self.game.best_scores.get(nickname, 0),
+                        self.game.deaths.get(nickname, 0),
+                        self.game.deliveries.get(nickname, 0),
+                    )
+                    for nickname in nicknames
+                ],
+            )
 
         # # --- Stats: Record Game Results ---
         # if final_scores and not self.config.grading_mode:
@@ -489,7 +431,7 @@ class Room:
         #             continue
 
         #         # Get sciper from the server instance using the address
-        #         player_sciper = self.addr_to_sciper.get(addr)
+        #         player_sciper = self.sessions.get_sciper(addr)
         #         logger.debug(
         #             f"Stats: Found sciper {player_sciper} for human player {nickname} ({addr})"
         #         )
@@ -572,10 +514,6 @@ class Room:
         #                 )
                     # No call for human-human or bot-bot pairs as last_match_scores was removed
 
-        # Save scores if any were updated
-        # if scores_updated:
-        #     self.game.high_score_all_time.save()
-
         # Create game over message
         game_over_message = GameOverMessage(
             data=GameOverData(
@@ -600,7 +538,7 @@ class Room:
 
                 self.server_socket.sendto(state_json.encode(), client_addr)
             except Exception as e:
-                logger.error(f"Error sending game over data to client: {e}")
+                logger.error("Error sending game over data to client: %s", e)
 
         self.game.running = False
 
@@ -614,9 +552,9 @@ class Room:
             # Call handle_client_disconnection for human clients
             try:
                 logger.info(f"Recording end-of-game stats for client at {addr}")
-                self.record_disconnection(self.addr_to_sciper[addr], "game_over")
+                self.record_disconnection(self.sessions.get_sciper(addr), "game_over")
             except Exception as e:
-                logger.error(f"Error recording end-of-game stats for {addr}: {e}")
+                logger.error("Error recording end-of-game stats for %s: %s", addr, e)
 
         # Close the room after a short delay to ensure all clients receive the game over message
         def close_room_after_delay():
@@ -660,58 +598,65 @@ class Room:
             [mode for mode in self.client_game_modes.values() if mode == "observer"]
         )
 
+    def notify_waiting_room(self):
+        """Wake up the waiting room thread after a client joined or left"""
+        self.waiting_room_changed.set()
+
+    def get_waiting_time(self, current_time):
+        """Seconds left before bots are added and the game starts"""
+        if not self.clients:
+            return 0
+        # Use the time the first client joined if available, otherwise creation time
+        start_time = (
+            self.first_client_join_time
+            if self.first_client_join_time is not None
+            else self.room_creation_time
+        )
+        return max(
+            0, self.config.waiting_time_before_bots_seconds - (current_time - start_time)
+        )
+
     def broadcast_waiting_room(self):
-        """Broadcast waiting room data to all clients"""
-        last_update = time.time()
+        """
+        Send waiting room data to all clients when it changes: when a player
+        joins or leaves, and once per second of countdown. Between updates the
+        thread sleeps until the next countdown second or membership change.
+        """
+        last_sent = None  # (players, waiting_time) of the last message sent
         while self.running and not self.stop_waiting_room:
-            if (self.clients or self.config.grading_mode) and not self.game_thread:
+            self.waiting_room_changed.clear()
+            # Wake up at least once per second to notice that the room was closed
+            timeout = 1.0
+
+            if self.clients and not self.game_thread:
                 if self.is_full():
                     logger.info("Room is full")
                     self.start_game()
                     continue
 
-                current_time = time.time()
-                if (
-                    current_time - last_update >= 1.0 / REFERENCE_TICK_RATE
-                ):  # Limit to TICK_RATE Hz
-                    # Calculate remaining time before adding bots
-                    remaining_time = 0
-                    if self.clients:
-                        # Use the time the first client joined if available, otherwise creation time
-                        start_time = (
-                            self.first_client_join_time
-                            if self.first_client_join_time is not None
-                            else self.room_creation_time
-                        )
-                        elapsed_time = current_time - start_time
-                        remaining_time = max(
-                            0,
-                            self.config.waiting_time_before_bots_seconds
-                            - elapsed_time,
-                        )
+                remaining_time = self.get_waiting_time(time.time())
 
-                    # If time is up and room is not full, add bots and start the game
-                    if (remaining_time == 0) and not self.game_thread:
-                        logger.info(
-                            f"Waiting time expired for room {self.id}, adding bots and starting game"
-                        )
-                        self.start_game()
+                # If time is up and room is not full, add bots and start the game
+                if (remaining_time == 0) and not self.game_thread:
+                    logger.info(
+                        f"Waiting time expired for room {self.id}, adding bots and starting game"
+                    )
+                    self.start_game()
 
-                    if self.config.grading_mode:
-                        last_update = current_time
-                        continue
-                    
+                players = list(self.get_players())
+                waiting_time = int(remaining_time)
+                if (players, waiting_time) != last_sent:
                     waiting_room_message = WaitingRoomMessage(
                         data=WaitingRoomData(
                             room_id=self.id,
-                            players=list(self.get_players()),
+                            players=players,
                             nb_players=self.nb_players_max,
                             game_started=self.game_thread is not None,
-                            waiting_time=int(remaining_time),
+                            waiting_time=waiting_time,
                         )
                     )
 
-                    state_json = waiting_room_message.to_json()
+                    state_bytes = waiting_room_message.to_json().encode()
                     for client_addr in list(self.clients.keys()):
                         try:
                             # Skip AI clients - they don't need network messages
@@ -722,19 +667,17 @@ class Room:
                             ):
                                 continue
 
-                            self.server_socket.sendto(state_json.encode(), client_addr)
+                            self.server_socket.sendto(state_bytes, client_addr)
                         except Exception as e:
                             logger.error(
-                                f"Error sending waiting room data to client: {e}"
+                                "Error sending waiting room data to client: %s", e
                             )
+                    last_sent = (players, waiting_time)
 
-                    last_update = current_time
+                # Sleep until the displayed countdown changes
+                timeout = (remaining_time - waiting_time) or 1.0
 
-            # Sleep for half the period
-            time.sleep(1.0 / (REFERENCE_TICK_RATE * 2))
-            # except Exception as e:
-            #     logger.error(f"Error in broadcast_waiting_room: {e}")
-            #     time.sleep(1.0 / self.config.tick_rate)
+            self.waiting_room_changed.wait(timeout + 0.001)
 
     def broadcast_game_state(self):
         """Thread that periodically sends the game state to clients"""
@@ -759,7 +702,7 @@ class Room:
                     continue
                 self.server_socket.sendto(initial_state_json.encode(), client_addr)
             except Exception as e:
-                logger.error(f"Error sending initial state to client: {e}")
+                logger.error("Error sending initial state to client: %s", e)
 
         last_update = time.time()
         while self.running:
@@ -800,14 +743,14 @@ class Room:
                                     state_json.encode(), client_addr
                                 )
                             except Exception as e:
-                                logger.error(f"Error sending state to client: {e}")
+                                logger.error("Error sending state to client: %s", e)
 
                     last_update = current_time
 
                 # Wait a bit to avoid overloading the CPU
                 time.sleep(1.0 / (REFERENCE_TICK_RATE * 2))
             except Exception as e:
-                logger.error(f"Error in broadcast_game_state: {e}")
+                logger.error("Error in broadcast_game_state: %s", e)
                 time.sleep(1.0 / REFERENCE_TICK_RATE)
 
     def fill_with_bots(self, nb_bots_needed):
@@ -819,20 +762,13 @@ class Room:
 
         # Check if agents list exists and is not empty
         if not hasattr(self.config, 'agents') or not self.config.agents:
-            logger.error(f"No agents defined in config, cannot add bots to room {self.id}")
+            logger.error("No agents defined in config, cannot add bots to room %s", self.id)
             return
             
-        # If we need less bots or an equal number to the available list, we pick the bots
-        # randomly (without repetition).
-        # If we need more, we pick each one at least once.
-        agents = self.config.agents[:]
-        
         # Use the room's seeded random generator instead of the global one
         # for deterministic bot selection
-        self.random.shuffle(agents)
-        while len(agents) < nb_bots_needed:
-            agents.append(self.random.choice(self.config.agents))
-        agents = agents[:nb_bots_needed]
+        agents = choose_bot_agents(self.random, self.config.agents, nb_bots_needed)
+        self.game.record("b", len(self.config.agents), nb_bots_needed)
 
         for agent in agents:
             ai_nickname = self.get_available_ai_name(agent)
@@ -863,10 +799,6 @@ class Room:
 
         return ai_nickname
 
-    def add_student_ai(self, ai_nickname=None, ai_agent_file_name=None, agent_dir="common.agents_to_evaluate"):
-        self.student_nickname = ai_nickname
-        self.add_ai(ai_nickname, ai_agent_file_name, agent_dir)
-
     def add_ai(self, ai_nickname=None, ai_agent_file_name=None, agent_dir="common.agents"):
         """Create an AI client to control a train"""
 
@@ -874,7 +806,7 @@ class Room:
         logger.debug(f"Creating new AI train with name {ai_nickname}")
 
         # Add the train to the game
-        if self.game.add_train(ai_nickname):
+        if self.game.spawn_train(ai_nickname):
             # Import the AI agent from the config path
             logger.debug(
                 f"Creating AI client {ai_nickname} using agent from {ai_agent_file_name}"
@@ -885,18 +817,18 @@ class Room:
             )
 
             # Add the ai_client to the game
-            self.game.ai_clients[ai_nickname] = self.ai_clients[ai_nickname]
+            self.game.register_ai_client(ai_nickname, self.ai_clients[ai_nickname])
 
             logger.debug(f"Added new AI train {ai_nickname} to room {self.id}")
             return ai_nickname
         else:
-            logger.error(f"Failed to add new AI train {ai_nickname} to game")
+            logger.error("Failed to add new AI train %s to game", ai_nickname)
             return None
 
     def replace_player_by_ai(self, train_nickname_to_replace):
         # Check if there's already an AI controlling this train
         if train_nickname_to_replace in self.ai_clients:
-            logger.warning(f"AI already exists for train {train_nickname_to_replace}")
+            logger.warning("AI already exists for train %s", train_nickname_to_replace)
             return
 
         logger.debug(f"Creating AI client for train {train_nickname_to_replace}")
@@ -909,21 +841,9 @@ class Room:
             ai_agent_file_name = agent.agent_file_name
             is_dead = not self.game.trains[train_nickname_to_replace].alive
 
-            # Save the train's color
-            if train_nickname_to_replace in self.game.train_colors:
-                train_color = self.game.train_colors[train_nickname_to_replace]
-                self.game.train_colors[ai_nickname] = train_color
-                del self.game.train_colors[train_nickname_to_replace]
-
-            # Get the train object
-            train = self.game.trains[train_nickname_to_replace]
-
-            # Update the train's name
-            train.nickname = ai_nickname
-
-            # Move the train to the new key in the dictionary
-            self.game.trains[ai_nickname] = train
-            del self.game.trains[train_nickname_to_replace]
+            # Move the train and its color to the new name
+            self.game.rename_train(train_nickname_to_replace, ai_nickname)
+            self.replaced_players.append(train_nickname_to_replace)
             logger.debug(
                 f"Moved train {train_nickname_to_replace} to {ai_nickname} in game"
             )
@@ -948,7 +868,7 @@ class Room:
                     except Exception as e:
                         # Log error but continue trying other clients
                         logger.error(
-                            f"Error sending train rename notification to client {client_addr}: {e}"
+                            "Error sending train rename notification to client %s: %s", client_addr, e
                         )
             # link to common/agents/
             agent_dir = "common.agents"
@@ -959,7 +879,7 @@ class Room:
             )
 
             # Add the AI client to the game
-            self.game.ai_clients[ai_nickname] = self.ai_clients[ai_nickname]
+            self.game.register_ai_client(ai_nickname, self.ai_clients[ai_nickname])
 
             # Prepare the game state to send to clients
             state = self.game.get_state()
@@ -971,7 +891,7 @@ class Room:
 
         else:
             logger.warning(
-                f"Train {train_nickname_to_replace} not found in game, cannot create AI client"
+                "Train %s not found in game, cannot create AI client", train_nickname_to_replace
             )
 
     def add_all_trains(self):
@@ -985,16 +905,16 @@ class Room:
                     break
 
             if client_addr is None:
-                logger.warning(f"Could not find address for player {nickname}")
+                logger.warning("Could not find address for player %s", nickname)
                 continue
 
-            if self.game.add_train(nickname):
+            if self.game.spawn_train(nickname):
                 response = SpawnSuccessMessage(nickname=nickname)
                 self.server_socket.sendto(
                     response.to_json().encode(), client_addr
                 )
             else:
-                logger.warning(f"Failed to spawn train {nickname}")
+                logger.warning("Failed to spawn train %s", nickname)
                 # Inform the client of the failure
                 response = RespawnFailedMessage(message="Failed to spawn train")
                 self.server_socket.sendto(
@@ -0,0 +1,123 @@
+"""
+Sampling profiler of the game threads
+
+When config.profile_dir is set, a side thread captures the stack of each
+registered thread (the game thread of each room) every
+profile_interval_seconds with sys._current_frames(), and counts the samples
+of each stack per room. The profiled threads are never paused or traced, so
+unlike cProfile the game runs at full speed. At shutdown, the stacks of each
+room are written to <profile_dir>/<room>.folded in the folded format of
+flamegraph.pl and speedscope:
+
+    run_game (room.py);update (game.py);update_trains (game.py) 412
+
+    flamegraph.pl profiles/room_1a2b3c4d.folded > room.svg
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger("server.sampling_profiler")
+
+_active = None  # The running SamplingProfiler, if any
+
+
+class SamplingProfiler:
+    def __init__(self, output_dir, interval=0.01):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.threads = {}  # {thread id: label}
+        self.samples = collections.defaultdict(collections.Counter)  # {label: {folded stack: samples}}
+        self.frame_names = {}  # {code object: "function (file)"}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def register(self, thread_id, label):
+        with self.lock:
+            self.threads[thread_id] = label
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+        logger.info(f"Sampling the game threads every {self.interval * 1000:g} ms")
+
+    def stop(self):
+        """Stop sampling and write the stacks"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        self.write()
+
+    def frame_name(self, code):
+        name = self.frame_names.get(code)
+        if name is None:
+            name = self.frame_names[code] = f"{code.co_name} ({os.path.basename(code.co_filename)})"
+        return name
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            with self.lock:
+                threads = dict(self.threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for thread_id, label in threads.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    # The thread has ended
+                    with self.lock:
+                        self.threads.pop(thread_id, None)
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.samples[label][";".join(reversed(stack))] += 1
+            del frames
+
+    def write(self):
+        if not self.samples:
+            return
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Error creating profile directory {self.output_dir}: {e}")
+            return
+        for label, stacks in list(self.samples.items()):
+            path = os.path.join(self.output_dir, f"{label}.folded")
+            try:
+                with open(path, "w") as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+            except OSError as e:
+                logger.error(f"Error writing profile to {path}: {e}")
+                continue
+            logger.info(f"Wrote {sum(stacks.values())} samples of {label} to {path}")
+
+
+def start(output_dir, interval):
+    """Start the profiler that register_current_thread() registers threads with"""
+    global _active
+    _active = SamplingProfiler(output_dir, interval)
+    _active.start()
+    return _active
+
+
+def stop():
+    global _active
+    if _active is not None:
+        _active.stop()
+        _active = None
+
+
+def register_current_thread(label):
+    """Sample the calling thread under label, if the profiler is running"""
+    if _active is not None:
+        _active.register(threading.get_ident(), label)
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 import os
 import socket
-import json
 import threading
 import time
 import logging
@@ -15,8 +14,8 @@ from common import stats_manager
 from common.config import Config
 from common.version import EXPECTED_CLIENT_VERSION
 from common.messages import (
-    PongMessage,
-    PingMessage,
+    ClientActionType,
+    ClientMessageType,
     DisconnectMessage,
     NameCheckMessage,
     SciperCheckMessage,
@@ -24,173 +23,46 @@ from common.messages import (
     WaitingRoomMessage,
     WaitingRoomData,
     RespawnFailedMessage,
-    DeathMessage,
     SpawnSuccessMessage,
-    DropWagonSuccessMessage,
-    DropWagonFailedMessage,
+    decode_datagram,
+    decode_direction,
+    encode_death,
+    encode_ping,
+    encode_pong,
+    encode_drop_wagon_failed,
+    encode_drop_wagon_success,
+    message_kind,
+    parse_client_message,
 )
-from server.passenger import Passenger
-from server.room import Room
+from server.grading import (
+    RESULTS_FILE,
+    GradingResultsWriter,
+    GradingScheduler,
+    TaskCostModel,
+    completed_tasks,
+    latest_runs_dir,
+    load_results,
+    load_session,
+    save_session,
+    write_agent_runs,
+    write_summary,
+)
+from server.distributed import GradingCoordinator
+from server.early_stopping import EarlyStopping
+from server.log_pipeline import QueuedLogging, RateLimitFilter
+from server.metrics import Gauge, MeteredSocket, MetricsServer
+from server import sampling_profiler, tracing
+from server.result_cache import ResultCache
+from server.room import Room, AI_NAMES
+from server.session import ClientSession, SessionRegistry
 from server.train import BOOST_COOLDOWN_DURATION
 
-import pandas as pd
 import datetime
 
 
-# Cette fonction doit être définie au niveau du module pour pouvoir être sérialisée par multiprocessing
-def evaluate_agent_task(task):
-    """Fonction d'évaluation d'un agent pour multiprocessing"""    
-    # Get parameters from the task dictionary
-    agent_file = task['agent_file']
-    nb_players = task['nb_players']
-    run_index = task['run_index']
-    current_seed = task['current_seed']
-    nb_runs_per_session = task['nb_runs_per_session']
-    agents_dir = task['agents_dir']
-    
-    # Import necessary modules at the beginning of the function
-    import sys
-    import os
-    import uuid
-    import socket
-    import logging
-    
-    agent_name = os.path.splitext(agent_file)[0]
-    tqdm_message = f"Run {run_index + 1}/{nb_runs_per_session} for {agent_name} with {nb_players} players (seed: {current_seed})"
-    
-    # Import the config module
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    parent_dir = os.path.dirname(current_dir)
-    sys.path.append(parent_dir)
-    
-    from server.room import Room
-    
-    # Setup a logger for this process
-    logger = logging.getLogger(f"server.worker.{agent_name}.{nb_players}.{run_index}")
-    logger.setLevel(logging.INFO)
-    
-    # Configuration des logs pour ce processus d'évaluation
-    # Reset all logging
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-    
-    # Create a console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.DEBUG)
-    
-    # Create a formatter
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    console_handler.setFormatter(formatter)
-    
-    # Configure the root logger
-    logging.root.setLevel(logging.DEBUG)
-    logging.root.addHandler(console_handler)
-    
-    # Configure les loggers de serveur pour les mettre en CRITICAL (grading mode)
-    modules = [
-        "server.room", "server.game", "server.train", "server.passenger",
-        "server.delivery_zone", "server.ai_client", "server.ai_agent"
-    ]
-    
-    # Configure chaque logger de module avec le niveau CRITICAL
-    for module in modules:
-        module_logger = logging.getLogger(module)
-        module_logger.setLevel(logging.CRITICAL)
-    
-    # Use the configuration transmise depuis le processus principal
-    try:
-        # Get the config from task
-        config = task['config']
-        
-        # Check if it's a ServerConfig or a complete Config
-        if hasattr(config, 'server'):
-            # If it's a complete Config, take the server attribute
-            server_config = config.server
-        else:
-            # If it's already a ServerConfig, use it directly
-            server_config = config
-        
-        # Ensure that the evaluation-specific parameters are correctly defined
-        server_config.grading_mode = True
-        server_config.waiting_time_before_bots_seconds = 0
-        server_config.tick_rate = 1000
-        
-        # Verify if agents list exists and is not empty
-        if not hasattr(server_config, 'agents') or not server_config.agents:
-            logger.warning(f"No agents found in config, this will cause errors in Room.fill_with_bots")
-    except Exception as e:
-        logger.error(f"Error loading configuration: {e}")
-        raise
-    
-    # Create a unique room ID
-    room_id = str(uuid.uuid4())[:8]
-    
-    # Setup a dummy server socket (won't be used for actual networking in worker process)
-    dummy_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    
-    # Create room callbacks (dummies for worker process)
-    def dummy_send_cooldown_notification(nickname, cooldown, death_reason):
-        pass
-        
-    def dummy_remove_room(room_id):
-        pass
-        
-    def dummy_record_disconnection(sciper, reason):
-        pass
-    
-    # Create a room with the specified number of players
-    room = Room(
-        server_config,
-        room_id,
-        nb_players,
-        True,  # running
-        dummy_socket,
-        dummy_send_cooldown_notification,
-        dummy_remove_room,
-        {},  # addr_to_sciper
-        dummy_record_disconnection,
-        tqdm_message,
-        grading_scores=task.get('grading_scores', {}),  # Pass the scores dictionary from the task
-        run_results=task.get('run_results', []),  # Pass the run results list from the task
-        current_run_index=run_index,
-        current_nb_players=nb_players,
-        bot_seed=current_seed,
-    )
-    
-    agent_file_path = agent_file  # Use the full file name with the .py extension
-    
-    # Prefix with "common.agents." to have the correct module format
-    module_path = f"common.agents.{agents_dir}"
-    room.add_student_ai(ai_nickname=agent_name, ai_agent_file_name=agent_file_path, agent_dir=module_path)
-    
-    # Start the game
-    room.start_game()
-    
-    # Wait for this room to finish
-    if room and room.game_thread and room.game_thread.is_alive():
-        room.game_thread.join()
-    
-    # Extract results from the room
-    # Get the run_data from the last entry in room.run_results if it exists
-    run_data = None
-    if hasattr(room, 'run_results') and room.run_results:
-        run_data = room.run_results[-1]  # Get the most recent run result
-    
-    result = {
-        'agent_name': agent_name,
-        'nb_players': nb_players,
-        'run_index': run_index,
-        'score': room.student_score if hasattr(room, 'student_score') else 0,
-        'run_data': run_data
-    }
-    
-    return result
-
 # Configuration simplifiée sans classe de filtrage
 
-def setup_server_logger(is_grading_mode):
+def setup_server_logger(is_grading_mode, rate_limit_seconds=0.0):
     # Reset all logging
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
@@ -228,6 +100,11 @@ def setup_server_logger(is_grading_mode):
     for module, level in modules.items():
         logger = logging.getLogger(module)
         logger.setLevel(level)
+
+    # Drop the warnings repeated within rate_limit_seconds, per module
+    if rate_limit_seconds > 0:
+        for module in ["server", *modules]:
+            logging.getLogger(module).addFilter(RateLimitFilter(rate_limit_seconds))
     
     # Only log the logger configuration in non-grading mode
     if not is_grading_mode:
@@ -251,10 +128,14 @@ def setup_server_logger(is_grading_mode):
 
 
 class Server:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, grading_resume=None):
         self.config = config.server
+        # Runs directory of the grading session to resume, "latest" for the most recent one, or None
+        self.grading_resume = grading_resume
 
-        self.logger = setup_server_logger(self.config.grading_mode)
+        self.logger = setup_server_logger(self.config.grading_mode, self.config.log_rate_limit_seconds)
+        # Log records are written by a listener thread instead of the threads that log them
+        self.queued_logging = QueuedLogging() if self.config.queued_logging else None
 
         # log self.config
         self.logger.debug(f"Config: {self.config}")
@@ -264,6 +145,11 @@ class Server:
             self.config.waiting_time_before_bots_seconds = 0
             self.config.tick_rate = 1000
 
+        if self.config.trace_dir is not None:
+            tracing.enable()
+        if self.config.profile_dir is not None and not self.config.grading_mode:
+            sampling_profiler.start(self.config.profile_dir, self.config.profile_interval_seconds)
+
         # Verify that all agent files exist before proceeding
         self.verify_agent_files(self.config)
         
@@ -279,35 +165,46 @@ class Server:
             self.server_socket.bind((host, self.config.port))
             self.logger.info(f"UDP socket created and bound to {host}:{self.config.port}")
         except Exception as e:
-            self.logger.error(f"Error creating UDP socket: {e}")
+            self.logger.error("Error creating UDP socket: %s", e)
             raise
 
         self.running = True
 
-        self.addr_to_name = {}  # Maps client addresses to agent names
-        self.addr_to_sciper = {}  # Maps client addresses to scipers
-        self.addr_to_game_mode = {}  # Maps client addresses to game modes
-        self.sciper_to_addr = {}  # Maps scipers to client addresses
-        self.client_last_activity = {}  # Maps client addresses to last activity timestamp
+        self.sessions = SessionRegistry()  # Connected clients by address, sciper and nickname
         self.disconnected_clients = (
             set()
         )  # Track disconnected clients by full address tuple (IP, port)
         self.threads = []  # Initialize threads attribute
-        
-        # Initialize grading attributes to avoid errors
-        self.grading_scores = {}
-        self.run_results = []
+
+        # Dispatch tables for incoming messages, keyed by message type or action
+        self.message_handlers = {
+            ClientMessageType.AGENT_IDS.value: self.handle_agent_ids,
+            ClientMessageType.PONG.value: self.handle_pong,
+            ClientMessageType.PING.value: self.handle_ping,
+        }
+        self.check_handlers = {
+            ClientActionType.CHECK_NAME.value: self.handle_name_check,
+            ClientActionType.CHECK_SCIPER.value: self.handle_sciper_check,
+        }
+        self.action_handlers = {
+            ClientActionType.RESPAWN.value: self.handle_respawn,
+            ClientActionType.DIRECTION.value: self.handle_direction,
+            ClientActionType.DROP_WAGON.value: self.handle_drop_wagon,
+        }
+
 
         if self.config.grading_mode:
             self.run_grading_mode()
             return
         else:
+            self.metrics_server = self.start_metrics_server()
             # In normal mode, just create the first room
             self.create_room(True, self.config.nb_players_per_room)
 
-        # Ping tracking for active connection checking
+        # Idle clients are pinged after ping_interval without any message,
+        # and timeouts are checked every ping_check_interval
         self.ping_interval = self.config.client_timeout_seconds / 2
-        self.ping_responses = {}  # Track which clients have responded to pings
+        self.ping_check_interval = self.config.client_timeout_seconds / 8
 
         # Start the ping thread (handles all client timeouts)
         self.ping_thread = threading.Thread(target=self.ping_clients)
@@ -325,6 +222,40 @@ class Server:
         else:
             self.logger.info(f"Server started on {self.config.host}:{self.config.port} (Could not determine public IP)")
 
+    def start_metrics_server(self):
+        """Count the UDP traffic and serve the metrics over HTTP, if config.metrics_port is set"""
+        if self.config.metrics_port is None:
+            return None
+        self.server_socket = MeteredSocket(self.server_socket)
+
+        def room_clients():
+            with self.lock:
+                rooms = list(self.rooms.values())
+            return {(room.id,): len(room.clients) for room in rooms}
+
+        def client_links(field):
+            # Clients without an RTT sample yet are left out
+            def values():
+                links = self.sessions.link_metrics()
+                return {(link["nickname"] or link["addr"],): link[field] / 1000 for link in links if link["rtt_ms"] is not None}
+            return values
+
+        gauges = [
+            Gauge("trains_rooms", "Rooms live", lambda: {(): len(self.rooms)}),
+            Gauge("trains_room_clients", "Human and AI clients in each room", room_clients, ("room",)),
+            Gauge("trains_sessions", "Connected clients", lambda: {(): len(self.sessions.addresses())}),
+            Gauge("trains_client_rtt_seconds", "Smoothed round-trip time of each client", client_links("rtt_ms"), ("client",)),
+            Gauge("trains_client_rtt_jitter_seconds", "Round-trip time jitter of each client", client_links("jitter_ms"), ("client",)),
+            Gauge("trains_stats_queue_events", "Stats events waiting to be written", lambda: {(): stats_manager.pending_events()}),
+        ]
+        try:
+            metrics_server = MetricsServer(self.config.metrics_host, self.config.metrics_port, gauges)
+        except OSError as e:
+            self.logger.error("Could not serve metrics on %s:%s: %s", self.config.metrics_host, self.config.metrics_port, e)
+            return None
+        metrics_server.start()
+        return metrics_server
+
     def get_public_ip(self):
         """
         Get the public IP address of this server using an external service
@@ -334,7 +265,7 @@ class Server:
                 ip = response.read().decode('utf-8')
                 return ip
         except Exception as e:
-            self.logger.warning(f"Could not determine public IP address: {e}")
+            self.logger.warning("Could not determine public IP address: %s", e)
             return None
             
     def verify_agent_files(self, config):
@@ -359,7 +290,7 @@ class Server:
 
         self.logger.info("All agent files verified successfully")
 
-    def create_room(self, running, nb_players_per_room, tqdm_message=None, current_run_index=None, bot_seed=None):
+    def create_room(self, running, nb_players_per_room, bot_seed=None):
         """
         Create a new room with specified number of clients
         """
@@ -370,10 +301,6 @@ class Server:
             self.logger.info(f"Randomly selected {nb_players_per_room} clients per room.")
         else:
             nb_players_per_room = int(nb_players_per_room)
-            
-        # Store current number of players for scoring in grading mode
-        if self.config.grading_mode:
-            self.current_nb_players = nb_players_per_room
 
         new_room = Room(
             self.config,
@@ -383,13 +310,8 @@ class Server:
             self.server_socket,
             self.send_cooldown_notification,
             self.remove_room,
-            self.addr_to_sciper,
+            self.sessions,
             self.record_disconnection,
-            tqdm_message,
-            grading_scores=self.grading_scores if hasattr(self, 'grading_scores') else None,  # Pass just the scores dictionary
-            run_results=self.run_results if hasattr(self, 'run_results') else None,  # Pass just the run results list
-            current_run_index=current_run_index,  # Pass current run index
-            current_nb_players=nb_players_per_room,  # Pass current number of players
             bot_seed=bot_seed,
         )
 
@@ -426,19 +348,9 @@ class Server:
                 if not data:
                     continue
 
-                data_str = data.decode()
-
-                # Process the incoming message
-                if data_str:
-                    # Handle multiple messages in one packet
-                    messages = data_str.split("\n")
-                    for message_str in messages:
-                        if not message_str:
-                            continue
-
-                        message = json.loads(message_str)
-                        # Process the message
-                        self.process_message(message, addr)
+                # Handle multiple messages in one packet
+                for message in decode_datagram(data):
+                    self.process_message(message, addr)
             except socket.error as e:
                 # For UDP, we don't know which client caused the error
                 # So we only log the error and don't mark any client as disconnected
@@ -447,84 +359,84 @@ class Server:
                     # We'll just log it at a lower level or not at all
                     pass  # Don't log connection reset errors at all
                 else:
-                    self.logger.error(f"Socket error: {e}")
+                    self.logger.error("Socket error: %s", e)
                 # Add a small delay to avoid high CPU usage on error
                 time.sleep(0.1)
             except Exception as e:
-                self.logger.error(f"Error in accept_clients: {e}")
+                self.logger.error("Error in accept_clients: %s", e)
                 # Add a small delay to avoid high CPU usage on error
                 time.sleep(0.1)
 
-    def find_client_room(self, agent_sciper):
-        for room in self.rooms.values():
-            for addr in room.clients:
-                if (
-                    addr in self.addr_to_sciper
-                    and self.addr_to_sciper[addr] == agent_sciper
-                ):
-                    return room
-        return None
-
     def process_message(self, message, addr):
         """Process incoming messages from clients"""
         if addr in self.disconnected_clients:
             # Remove the client from the disconnected clients list
             self.disconnected_clients.remove(addr)
 
-        # # Check if client's game-mode is observer
-        if (
-            "type" in message
-            and message["type"] == "agent_ids"
-            and "nickname" in message
-            and "agent_sciper" in message
-            and "game_mode" in message
-            and addr not in self.addr_to_name
-        ):
-            if message["game_mode"] != "observer":
-                # use handle_name_check and handle_sciper_check to check if the name and sciper are available
-                self.logger.debug(
-                    f"Checking name and sciper availability for {message['nickname']} ({message['agent_sciper']})"
-                )
-                if self.handle_name_check(message, addr) and self.handle_sciper_check(
-                    message, addr
-                ):
-                    self.handle_new_client(message, addr)
-            else:
-                self.client_last_activity[addr] = time.time()
-                self.handle_new_client(message, addr)
-                return
+        # Any message from a client proves it is alive
+        session = self.sessions.get(addr)
+        if session:
+            session.last_activity = time.time()
 
-        # Handle ping responses for everyone
-        if "type" in message and message["type"] == "pong":
-            self.client_last_activity[addr] = time.time()
-            # Client has responded to a ping, update the ping responses dictionary
-            if addr in self.ping_responses:
-                del self.ping_responses[addr]  # Remove from pending responses
+        handler = self.message_handlers.get(message_kind(message))
+        if handler is not None:
+            handler(message, addr)
             return
 
-        # Handle ping messages from unknown clients (for connection verification)
-        if "type" in message and message["type"] == "ping":
-            # Send a pong response even to unknown clients for connection verification
-            pong_message = PongMessage()
-            try:
-                self.server_socket.sendto(
-                    (pong_message.to_json() + "\n").encode(), addr
-                )
-                return
-            except Exception as e:
-                self.logger.error(f"Error sending pong to {addr}: {e}")
-                return
+        self.route_client_message(message, addr)
 
-        agent_sciper = self.addr_to_sciper.get(addr)
+    def route_client_message(self, message, addr):
+        """Forward a message to the room of the client that sent it"""
+        session = self.sessions.get(addr)
 
-        if agent_sciper:
-            # Find which room this client belongs to
-            client_room = self.find_client_room(agent_sciper)
-            if client_room:
-                self.handle_client_message(addr, message, client_room)
+        if session:
+            # Messages from clients whose room was closed are dropped
+            if session.room:
+                self.handle_client_message(addr, message, session.room)
         else:
             self.handle_client_message(addr, message, None)
 
+    def handle_agent_ids(self, message, addr):
+        """Handle the agent_ids handshake, the only message validated with Pydantic"""
+        if addr not in self.sessions:
+            try:
+                parse_client_message(message)
+            except Exception as e:
+                self.logger.debug(f"Invalid agent_ids message from {addr}: {e}")
+            else:
+                if message["game_mode"] != "observer":
+                    # use handle_name_check and handle_sciper_check to check if the name and sciper are available
+                    self.logger.debug(
+                        f"Checking name and sciper availability for {message['nickname']} ({message['agent_sciper']})"
+                    )
+                    if self.handle_name_check(message, addr) and self.handle_sciper_check(
+                        message, addr
+                    ):
+                        self.handle_new_client(message, addr)
+                else:
+                    self.handle_new_client(message, addr)
+                    return
+
+        self.route_client_message(message, addr)
+
+    def handle_pong(self, message, addr):
+        """Measure the round-trip time from the timestamp echoed in the pong"""
+        session = self.sessions.get(addr)
+        sent_time = message.get("t")
+        if session is None or not isinstance(sent_time, (int, float)):
+            return
+        rtt = time.monotonic() - sent_time
+        # Ignore timestamps that cannot come from one of our pings
+        if 0 <= rtt <= self.config.client_timeout_max_seconds:
+            session.record_rtt(rtt)
+
+    def handle_ping(self, message, addr):
+        """Send a pong response even to unknown clients for connection verification"""
+        try:
+            self.server_socket.sendto(encode_pong(message.get("t")), addr)
+        except Exception as e:
+            self.logger.error("Error sending pong to %s: %s", addr, e)
+
     def send_disconnect(self, addr: tuple[str, int], message: str = "Unknown client or invalid message format") -> None:
         """Disconnect a client from the server"""
         self.logger.debug(f"Sending disconnect request to unknown client {addr}")
@@ -536,7 +448,7 @@ class Server:
             )
             self.logger.info(f"Sent disconnect request to unknown client {addr}")
         except Exception as e:
-            self.logger.error(f"Error sending disconnect request to {addr}: {e}")
+            self.logger.error("Error sending disconnect request to %s: %s", addr, e)
 
     # def handle_high_scores_request(self, addr):
     #     """Handle a request for high scores"""
@@ -575,34 +487,31 @@ class Server:
                         response.to_json().encode(), addr
                     )
                 except Exception as e:
-                    self.logger.error(f"Error sending name check response: {e}")
+                    self.logger.error("Error sending name check response: %s", e)
                 return False
 
-        # Check if the name exists in any room
+        # Check if the name is used by a client in a room
         name_available = True
-        room = None  # Initialize room to None to avoid reference error
-
-        for room_id, current_room in self.rooms.items():
-            room = current_room  # Keep a reference to the last room
-            for client_addr, nickname in current_room.clients.items():
-                if nickname == name_to_check:
-                    # Check if the client with this name is in disconnected_clients
-                    if client_addr in self.disconnected_clients:
-                        # Client is disconnected, name can be reused
-                        self.logger.debug(
-                            f"Name '{name_to_check}' found in room {room_id} but client is disconnected, considering it available"
-                        )
-                        continue
-                    # Client is connected, name is not available
-                    name_available = False
-                    self.logger.debug(f"Name '{name_to_check}' found in room {room_id}")
-                    break
-            if not name_available:
-                break
-
-        # Check if name not in the ai names (only if we have at least one room)
-        if room and name_available and name_to_check in room.AI_NAMES:
+        reason = None
+
+        session = self.sessions.get_by_nickname(name_to_check)
+        if session and session.room:
+            # Check if the client with this name is in disconnected_clients
+            if session.addr in self.disconnected_clients:
+                # Client is disconnected, name can be reused
+                self.logger.debug(
+                    f"Name '{name_to_check}' found in room {session.room.id} but client is disconnected, considering it available"
+                )
+            else:
+                # Client is connected, name is not available
+                name_available = False
+                reason = "name already in use"
+                self.logger.debug(f"Name '{name_to_check}' found in room {session.room.id}")
+
+        # Check if name not in the ai names
+        if name_available and name_to_check in AI_NAMES:
             name_available = False
+            reason = "name reserved for bots"
 
         # Check if name starts with "Bot " (invalid)
         if name_available and name_to_check.startswith("staff"):
@@ -616,7 +525,7 @@ class Server:
             try:
                 self.server_socket.sendto(response.to_json().encode(), addr)
             except Exception as e:
-                self.logger.error(f"Error sending name check response: {e}")
+                self.logger.error("Error sending name check response: %s", e)
 
         return name_available
 
@@ -642,7 +551,7 @@ class Server:
                         response.to_json().encode(), addr
                     )
                 except Exception as e:
-                    self.logger.error(f"Error sending sciper check response: {e}")
+                    self.logger.error("Error sending sciper check response: %s", e)
                 return False
             else:
                 return False
@@ -654,7 +563,7 @@ class Server:
                 self.server_socket.sendto(response.to_json().encode(), addr)
                 self.logger.info(f"Sciper check for '{sciper_to_check}': available")
             except Exception as e:
-                self.logger.error(f"Error sending sciper check response: {e}")
+                self.logger.error("Error sending sciper check response: %s", e)
 
         return True
 
@@ -669,17 +578,14 @@ class Server:
 
         if game_mode == "observer":
             self.logger.info(f"New client connected in OBSERVER mode: {addr}")
-            self.client_last_activity[addr] = time.time()
 
             # generate a random name and sciper
             nickname = f"Observer_{random.randint(1000, 9999)}"
             agent_sciper = str(random.randint(100000, 999999))
 
         # Associate address with name and sciper
-        self.addr_to_name[addr] = nickname
-        self.addr_to_sciper[addr] = agent_sciper
-        self.addr_to_game_mode[addr] = game_mode
-        self.sciper_to_addr[agent_sciper] = addr
+        session = ClientSession(addr, nickname, agent_sciper, game_mode, time.time())
+        self.sessions.add(session)
 
         # else:
         if not nickname:
@@ -697,31 +603,6 @@ class Server:
         # --- Record Connection Stats ---
         stats_manager.record_connection(agent_sciper, nickname)
 
-        # Initialize client activity tracking
-        self.client_last_activity[addr] = time.time()
-
-        # Check if this sciper was previously connected and clean up any old references
-        if agent_sciper in self.sciper_to_addr:
-            old_addr = self.sciper_to_addr[agent_sciper]
-            if old_addr != addr:  # Only if it's a different address
-                self.logger.info(
-                    f"Cleaning up previous connection for sciper {agent_sciper} at {old_addr}"
-                )
-                # Remove from disconnected_clients if present
-                if old_addr in self.disconnected_clients:
-                    self.disconnected_clients.remove(old_addr)
-                # Clean up other mappings
-                if old_addr in self.addr_to_name:
-                    del self.addr_to_name[old_addr]
-                if old_addr in self.addr_to_sciper:
-                    del self.addr_to_sciper[old_addr]
-                if old_addr in self.addr_to_game_mode:
-                    del self.addr_to_game_mode[old_addr]
-                if old_addr in self.client_last_activity:
-                    del self.client_last_activity[old_addr]
-                if old_addr in self.ping_responses:
-                    del self.ping_responses[old_addr]
-
         # Remove from disconnected_clients if present (just in case)
         if addr in self.disconnected_clients:
             self.disconnected_clients.remove(addr)
@@ -730,6 +611,9 @@ class Server:
         selected_room = self.get_available_room()
         selected_room.clients[addr] = nickname
         selected_room.client_game_modes[addr] = game_mode
+        if game_mode != "observer":
+            selected_room.player_scipers[nickname] = agent_sciper
+        session.room = selected_room
 
         # Mark the room as having at least one human player
         selected_room.has_clients = True
@@ -737,6 +621,7 @@ class Server:
         # Record the time the first client joined this room
         if selected_room.first_client_join_time is None:
             selected_room.first_client_join_time = time.time()
+        selected_room.notify_waiting_room()
 
         self.logger.info(
             f"Agent {nickname} (sciper: {agent_sciper}) joined room {selected_room.id}"
@@ -768,201 +653,156 @@ class Server:
     def handle_client_message(self, addr, message, room=None):
         """Handles messages received from the client"""
         try:
-            # Update client activity timestamp
-
-            if room is None:
-                # If room is None, we can't handle most messages
-                if message.get("action") == "check_name":
-                    self.handle_name_check(message, addr)
-                    return
+            action = message.get("action")
 
-                if message.get("action") == "check_sciper":
-                    self.handle_sciper_check(message, addr)
-                    return
+            # Name and sciper checks don't need a room
+            check_handler = self.check_handlers.get(action)
+            if check_handler is not None:
+                check_handler(message, addr)
+                return
 
+            if room is None:
                 # For other message types, we need a valid room
                 self.logger.debug(
-                    f"Ignoring message from client {addr} as they are not in any room: {message}. Sending disconnect message"
+                    "Ignoring message from client %s as they are not in any room: %s. Sending disconnect message", addr, message
                 )
                 self.handle_client_disconnection(addr, "Unknown client")
                 return
 
-            nickname = room.clients.get(addr)
-            if message.get("action") == "check_name":
-                self.handle_name_check(message, addr)
-                return
-
-            if message.get("action") == "check_sciper":
-                self.handle_sciper_check(message, addr)
-                return
-
-            self.client_last_activity[addr] = time.time()
+            action_handler = self.action_handlers.get(action)
+            if action_handler is not None:
+                action_handler(addr, message, room, room.clients.get(addr))
 
-            if message.get("action") == "respawn":
-                # Check if the game is over
-                if room.game_over:
-                    self.logger.info(
-                        f"Ignoring respawn request from {nickname} as the game is over"
-                    )
-                    response = RespawnFailedMessage(message="Game is over")
-                    self.server_socket.sendto(
-                        response.to_json().encode(), addr
-                    )
-                    return
-
-                cooldown = room.game.get_train_respawn_cooldown(nickname)
+        except Exception as e:
+            self.logger.error("Error handling client message: %s", e)
+
+    def handle_respawn(self, addr, message, room, nickname):
+        """Handle a respawn request"""
+        # Check if the game is over
+        if room.game_over:
+            self.logger.info(
+                "Ignoring respawn request from %s as the game is over", nickname
+            )
+            response = RespawnFailedMessage(message="Game is over")
+            self.server_socket.sendto(
+                response.to_json().encode(), addr
+            )
+            return
 
-                if cooldown > 0:
-                    # Inform the client of the remaining cooldown
-                    response = DeathMessage(remaining=cooldown)
-                    self.server_socket.sendto(
-                        response.to_json().encode(), addr
-                    )
-                    return
+        cooldown = room.game.get_train_respawn_cooldown(nickname)
 
-                # Add the train to the game
-                if room.game.add_train(nickname):
-                    response = SpawnSuccessMessage(nickname=nickname)
-                    self.server_socket.sendto(
-                        response.to_json().encode(), addr
-                    )
-                else:
-                    self.logger.warning(f"Failed to spawn train {nickname}")
-                    # Inform the client of the failure
-                    response = RespawnFailedMessage(message="Failed to spawn train")
-                    self.server_socket.sendto(
-                        response.to_json().encode(), addr
-                    )
+        if cooldown > 0:
+            # Inform the client of the remaining cooldown
+            self.server_socket.sendto(encode_death(cooldown), addr)
+            return
 
-            elif message.get("action") == "direction":
-                if nickname in room.game.trains and room.game.contains_train(nickname):
-                    room.game.trains[nickname].change_direction(message["direction"])
-
-            elif message.get("action") == "drop_wagon":
-                if nickname in room.game.trains and room.game.contains_train(nickname):
-                    last_wagon_position = room.game.trains[nickname].drop_wagon()
-                    if last_wagon_position:
-                        # Create a new passenger at the position of the dropped wagon
-                        new_passenger = Passenger(room.game)
-                        new_passenger.position = last_wagon_position
-                        new_passenger.value = 1
-                        room.game.passengers.append(new_passenger)
-                        room.game._dirty["passengers"] = True
-
-                        # Notify the client of the success with the cooldown
-                        response = DropWagonSuccessMessage(cooldown=BOOST_COOLDOWN_DURATION)
-                        self.server_socket.sendto(
-                            response.to_json().encode(), addr
-                        )
-                    else:
-                        # Calculate remaining cooldown time if the cooldown is active
-                        error_msg = "Cannot drop wagon (no wagons available)"
-                        remaining_cooldown = 0
-                        
-                        if room.game.trains[nickname].boost_cooldown_active:
-                            # Use tick-based cooldown calculation
-                            remaining_cooldown = room.game.trains[nickname].get_boost_cooldown_time()
-                            error_msg = f"Cannot drop wagon (cooldown active for {remaining_cooldown:.1f} ticks)"
-                        
-                        # Notify the client that the drop_wagon action failed
-                        response = DropWagonFailedMessage(message=error_msg)
-                        self.server_socket.sendto(
-                            response.to_json().encode(), addr
-                        )
+        # Add the train to the game
+        if room.game.spawn_train(nickname):
+            response = SpawnSuccessMessage(nickname=nickname)
+            self.server_socket.sendto(
+                response.to_json().encode(), addr
+            )
+        else:
+            self.logger.warning("Failed to spawn train %s", nickname)
+            # Inform the client of the failure
+            response = RespawnFailedMessage(message="Failed to spawn train")
+            self.server_socket.sendto(
+                response.to_json().encode(), addr
+            )
 
-        except Exception as e:
-            self.logger.error(f"Error handling client message: {e}")
+    def handle_direction(self, addr, message, room, nickname):
+        """Handle a direction change (hot path, no model validation)"""
+        direction = decode_direction(message)
+        if direction is None:
+            self.logger.debug("Ignoring invalid direction from %s: %s", addr, message)
+            return
+        room.game.change_direction(nickname, direction)
+
+    def handle_drop_wagon(self, addr, message, room, nickname):
+        """Handle a drop wagon request (hot path, no model validation)"""
+        if nickname in room.game.trains and room.game.contains_train(nickname):
+            last_wagon_position = room.game.drop_wagon(nickname)
+            if last_wagon_position:
+                # Notify the client of the success with the cooldown
+                self.server_socket.sendto(
+                    encode_drop_wagon_success(BOOST_COOLDOWN_DURATION), addr
+                )
+            else:
+                # Calculate remaining cooldown time if the cooldown is active
+                error_msg = "Cannot drop wagon (no wagons available)"
+                remaining_cooldown = 0
+                
+                if room.game.trains[nickname].boost_cooldown_active:
+                    # Use tick-based cooldown calculation
+                    remaining_cooldown = room.game.trains[nickname].get_boost_cooldown_time()
+                    error_msg = f"Cannot drop wagon (cooldown active for {remaining_cooldown:.1f} ticks)"
+                
+                # Notify the client that the drop_wagon action failed
+                self.server_socket.sendto(encode_drop_wagon_failed(error_msg), addr)
 
     def send_cooldown_notification(self, nickname, cooldown, death_reason):
         """Send a cooldown notification to a specific client"""
-        for room in self.rooms.values():
-            for addr, name in room.clients.items():
-                if name == nickname:
-                    try:
-                        # Skip AI clients - they don't need network messages
-                        if (
-                            isinstance(addr, tuple)
-                            and len(addr) == 2
-                            and addr[0] == "AI"
-                        ):
-                            return
-
-                        response = DeathMessage(remaining=cooldown, reason=death_reason)
-                        self.server_socket.sendto(
-                            response.to_json().encode(), addr
-                        )
-                        return
-                    except Exception as e:
-                        self.logger.error(
-                            f"Error sending cooldown notification to {nickname}: {e}"
-                        )
-                        return
+        # AI clients have no session - they don't need network messages
+        session = self.sessions.get_by_nickname(nickname)
+        if session is None or session.room is None:
+            return
+
+        try:
+            self.server_socket.sendto(
+                encode_death(cooldown, death_reason), session.addr
+            )
+        except Exception as e:
+            self.logger.error(
+                "Error sending cooldown notification to %s: %s", nickname, e
+            )
 
     def ping_clients(self):
-        """Thread that sends ping messages to all clients and checks for timeouts"""
-        while self.running:
-            
-            current_time = time.time()
+        """
+        Thread that checks for client timeouts and pings idle clients.
 
-            # PART 1: Check all clients for timeouts
-            for addr, last_activity in list(self.client_last_activity.items()):
-                # Skip clients that are already marked as disconnected
-                if addr in self.disconnected_clients:
+        Liveness comes from any inbound message, so clients that are sending
+        actions are not pinged, except every rtt_probe_interval_seconds to
+        keep their RTT up to date. Pings carry a timestamp that the client
+        echoes back, see handle_pong.
+        """
+        while self.running:
+            now = time.time()
+            for session in self.sessions:
+                # Skip clients already marked as disconnected
+                if session.addr in self.disconnected_clients:
                     continue
 
-                # Check if client has timed out
-                if current_time - last_activity > self.config.client_timeout_seconds:
-                    # Client has timed out, handle disconnection
-                    self.handle_client_disconnection(addr, "timeout")
-
-            # PART 2: Send pings to clients in rooms
-            clients_to_ping = set()
-            for room in self.rooms.values():
-                for addr in room.clients.keys():
-                    clients_to_ping.add(addr)
-
-            # Send pings to all active clients in rooms
-            for addr in clients_to_ping:
-                # Skip clients that are already marked as disconnected
-                if addr in self.disconnected_clients:
+                idle_time = now - session.last_activity
+                timeout = session.timeout(
+                    self.config.client_timeout_seconds,
+                    self.config.client_timeout_max_seconds,
+                )
+                if idle_time > timeout:
+                    self.logger.debug(
+                        f"Client {session.nickname} silent for {idle_time:.2f}s (timeout {timeout:.2f}s, {session.link_metrics()})"
+                    )
+                    self.handle_client_disconnection(session.addr, "timeout")
                     continue
 
-                # Skip AI clients - they don't need network messages
-                if isinstance(addr, tuple) and len(addr) == 2 and addr[0] == "AI":
+                # Clients whose room ended are only timed out, not pinged
+                if session.room is None:
                     continue
 
-                # Send a ping message to the client
-                ping_message = PingMessage()
-                try:
-                    self.server_socket.sendto(
-                        ping_message.to_json().encode(), addr
-                    )
-                    # Add the client to the ping responses dictionary with the current time
-                    self.ping_responses[addr] = current_time
-                except Exception as e:
-                    self.logger.debug(f"Error sending ping to client {addr}: {e}")
-
-            # Wait for responses (half the ping interval)
-            time.sleep(self.ping_interval / 2)
-
-            # PART 3: Check for clients that haven't responded to pings
-            for addr, ping_time in list(self.ping_responses.items()):
-                # If the ping was sent more than ping_interval ago and no response was received
-                if current_time - ping_time > self.ping_interval:
-                    # Skip clients that are already marked as disconnected
-                    if addr in self.disconnected_clients:
-                        del self.ping_responses[addr]
-                        continue
-
-                    # Client hasn't responded to ping, mark as disconnected
-                    self.handle_client_disconnection(addr, "ping timeout")
+                since_last_ping = (
+                    now - session.ping_sent_time
+                    if session.ping_sent_time is not None
+                    else float("inf")
+                )
+                if (
+                    idle_time >= self.ping_interval and since_last_ping >= self.ping_interval
+                ) or since_last_ping >= self.config.rtt_probe_interval_seconds:
+                    try:
+                        self.server_socket.sendto(encode_ping(time.monotonic()), session.addr)
+                        session.ping_sent_time = now
+                    except Exception as e:
+                        self.logger.debug(f"Error sending ping to client {session.addr}: {e}")
 
-            # Sleep for the remaining time of the ping interval
-            time.sleep(self.ping_interval / 2)
-            # except Exception as e:
-            #     self.logger.error(f"Error in ping_clients: {e}")
-            #     # Sleep on error to avoid high CPU usage
-            #     time.sleep(self.ping_interval)
+            time.sleep(self.ping_check_interval)
 
     def handle_client_disconnection(self, addr, reason="unknown"):
         """Handle client disconnection - centralized method to avoid code duplication"""
@@ -975,50 +815,49 @@ class Server:
         # Mark client as disconnected
         self.disconnected_clients.add(addr)
 
-        nickname = self.addr_to_name.get(addr, "Unknown client")
-        sciper = self.addr_to_sciper.get(addr) # Get sciper BEFORE deleting it
+        session = self.sessions.get(addr)
+        sciper = session.sciper if session else None
 
         # Only log at INFO level if this is a known client
-        if nickname != "Unknown client":
-            self.logger.info(f"Client {nickname} disconnected due to {reason}: {addr}")
+        if session:
+            self.logger.info(f"Client {session.nickname} disconnected due to {reason}: {addr}")
 
             # Find the room this client is in and create an AI to control their train
-            for room in self.rooms.values():
-                if addr in room.clients:
-                    # Store the name before removing the client
-                    original_nickname = room.clients[addr]
-                    self.logger.info(f"Removing {original_nickname} from room {room.id}")
-
-                    # Remove the client from the room's client list first
-                    del room.clients[addr]
-
-                    # Now, check if any human clients remain
-                    human_clients_count = 0
-                    for client_addr_check in room.clients.keys():
-                        # Count only human clients (not AI clients)
-                        if not (
-                            isinstance(client_addr_check, tuple)
-                            and len(client_addr_check) == 2
-                            and client_addr_check[0] == "AI"
-                        ):
-                            human_clients_count += 1
-
-                    if human_clients_count == 0:
-                        # Last human left, close the room. No need to create AI.
-                        self.logger.info(
-                            f"Last human client {original_nickname} left room {room.id}, closing room"
-                        )
-                        # remove_room handles setting flags, stopping threads, and cleanup
-                        self.remove_room(room.id)
-                    else:
-                        if room.game.trains:
-                            # Other human players remain. Create an AI for the disconnecting player's train if it exists.
-                            if original_nickname in room.game.trains:
-                                room.replace_player_by_ai(
-                                    train_nickname_to_replace=original_nickname
-                                )
-
-                    break  # Exit the room loop as we found and processed the client
+            room = session.room
+            if room and addr in room.clients:
+                # Store the name before removing the client
+                original_nickname = room.clients[addr]
+                self.logger.info(f"Removing {original_nickname} from room {room.id}")
+
+                # Remove the client from the room's client list first
+                del room.clients[addr]
+                room.notify_waiting_room()
+
+                # Now, check if any human clients remain
+                human_clients_count = 0
+                for client_addr_check in room.clients.keys():
+                    # Count only human clients (not AI clients)
+                    if not (
+                        isinstance(client_addr_check, tuple)
+                        and len(client_addr_check) == 2
+                        and client_addr_check[0] == "AI"
+                    ):
+                        human_clients_count += 1
+
+                if human_clients_count == 0:
+                    # Last human left, close the room. No need to create AI.
+                    self.logger.info(
+                        f"Last human client {original_nickname} left room {room.id}, closing room"
+                    )
+                    # remove_room handles setting flags, stopping threads, and cleanup
+                    self.remove_room(room.id)
+                else:
+                    if room.game.trains:
+                        # Other human players remain. Create an AI for the disconnecting player's train if it exists.
+                        if original_nickname in room.game.trains:
+                            room.replace_player_by_ai(
+                                train_nickname_to_replace=original_nickname
+                            )
 
         else:
             # Log at debug level for unknown clients to reduce spam
@@ -1026,22 +865,8 @@ class Server:
 
         self.record_disconnection(sciper, reason)
 
-        # Clean up sciper information
-        if addr in self.addr_to_sciper:
-            # sciper = self.addr_to_sciper[addr] # Moved up
-            if sciper and sciper in self.sciper_to_addr:
-                del self.sciper_to_addr[sciper]
-            del self.addr_to_sciper[addr]
-
-        # Clean up game mode information
-        if addr in self.addr_to_game_mode:
-            del self.addr_to_game_mode[addr]
-
-        if addr in self.client_last_activity:
-            del self.client_last_activity[addr]
-
-        if addr in self.ping_responses:
-            del self.ping_responses[addr]
+        # Clean up the client's session
+        self.sessions.remove(addr)
 
     def record_disconnection(self, sciper, reason):
         # Record disconnection stats *after* getting sciper and *before* potential errors/returns
@@ -1051,7 +876,7 @@ class Server:
             try:
                 stats_manager.record_disconnection(sciper, premature=premature)
             except Exception as e:
-                self.logger.error(f"Error calling stats_manager.record_disconnection for {sciper}: {e}")
+                self.logger.error("Error calling stats_manager.record_disconnection for %s: %s", sciper, e)
 
     def run_grading_mode(self):
         """Run evaluation for all agents in the agents folder using multiprocessing"""
@@ -1079,55 +904,54 @@ class Server:
         
         self.logger.info(f"Found {len(agent_files)} agent(s) to evaluate: {agent_files}")
 
-        # Generate seeds for each run_index before starting evaluation
-        # So for the same run_index, we'll always have the same seed, regardless of agent or nb_players
-        run_seeds = {}
-        for run_index in range(nb_runs_per_session):
-            run_seeds[run_index] = random.randint(1, 1000000)
-            self.logger.debug(f"Generated seed for run_index {run_index}: {run_seeds[run_index]}")
-        
         # Create stats directory if it doesn't exist
         stats_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stats")
         os.makedirs(stats_dir, exist_ok=True)
-        
-        # Create timestamp for results
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        
-        # Create directory for this run
-        runs_dir = os.path.join(stats_dir, f"runs_{timestamp}")
-        os.makedirs(runs_dir, exist_ok=True)
+
+        if self.grading_resume:
+            # Continue an interrupted session with its own agents and seeds
+            runs_dir = latest_runs_dir(stats_dir) if self.grading_resume == "latest" else self.grading_resume
+            if runs_dir is None:
+                self.logger.error("No grading session to resume in %s", stats_dir)
+                return
+            session = load_session(runs_dir)
+            timestamp = session["timestamp"]
+            agent_files = session["agent_files"]
+            nb_players_per_session_list = session["nb_players_per_session"]
+            nb_runs_per_session = session["nb_runs_per_session"]
+            run_seeds = session["run_seeds"]
+            self.logger.info(f"Resuming grading session {runs_dir}")
+        else:
+            # Generate seeds for each run_index before starting evaluation
+            # So for the same run_index, we'll always have the same seed, regardless of agent or nb_players
+            # If the config has a seed, the run seeds are the same from one session to the next
+            seed_random = random.Random(self.config.seed) if self.config.seed is not None else random
+            run_seeds = {}
+            for run_index in range(nb_runs_per_session):
+                run_seeds[run_index] = seed_random.randint(1, 1000000)
+                self.logger.debug(f"Generated seed for run_index {run_index}: {run_seeds[run_index]}")
+            
+            # Create timestamp for results
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            
+            # Create directory for this run
+            runs_dir = os.path.join(stats_dir, f"runs_{timestamp}")
+            os.makedirs(runs_dir, exist_ok=True)
+            save_session(runs_dir, {
+                "timestamp": timestamp,
+                "agent_files": agent_files,
+                "nb_players_per_session": nb_players_per_session_list,
+                "nb_runs_per_session": nb_runs_per_session,
+                "run_seeds": run_seeds,
+            })
         
         # Create Excel file for storing scores with timestamp
         grades_excel_path = os.path.join(stats_dir, f"grading_results_{timestamp}.xlsx")
-        
-        # Dictionary to store CSV files for each agent
-        self.agent_csv_files = {}
-        
-        # Initialize DataFrame with agent names as index
+
+        # Completed runs are streamed to this file, the Excel files are generated from it at the end
+        results_path = os.path.join(runs_dir, RESULTS_FILE)
+
         agent_names = [os.path.splitext(file)[0] for file in agent_files]
-        df = pd.DataFrame(index=agent_names)
-        
-        # Initialize scores dictionary to store points for each agent and player count
-        scores = {agent_name: {nb_players: 0 for nb_players in nb_players_per_session_list} for agent_name in agent_names}
-        
-        # Store reference to the scores in self for access from Room.end_game
-        self.grading_scores = scores
-        
-        # Initialize run_results to store detailed results of each run
-        self.run_results = []
-        
-        # Define the columns for the CSV files
-        self.runs_columns = ["run", "nb players", "student", "student score", "bot1", "score bot 1", "bot2", "score bot 2", "bot3", "score bot 3"]
-        
-        # Create an Excel file for each agent
-        for agent_name in agent_names:
-            excel_path = os.path.join(runs_dir, f"{agent_name}.xlsx")
-            # Create an empty DataFrame with the correct columns
-            empty_df = pd.DataFrame(columns=self.runs_columns)
-            # Write header to Excel file
-            empty_df.to_excel(excel_path, index=False)
-            # Store the path for later use
-            self.agent_csv_files[agent_name] = excel_path
 
         # Start timing the evaluation process
         start_time = datetime.datetime.now()
@@ -1136,26 +960,83 @@ class Server:
         # Pas besoin de chercher un chemin de config, on utilise directement la config existante
         self.logger.info("Using current configuration for evaluation")
             
-        # Create tasks for all evaluations
-        tasks = []
-        for agent_file in agent_files:
-            for nb_players in nb_players_per_session_list:
-                for run_index in range(nb_runs_per_session):
-                    current_seed = run_seeds[run_index]
-                    # Créer un dictionnaire au lieu d'un tuple pour passer plus facilement les références
-                    task = {
-                        'agent_file': agent_file,
-                        'nb_players': nb_players,
-                        'run_index': run_index,
-                        'current_seed': current_seed,
-                        'nb_runs_per_session': nb_runs_per_session,
-                        'agents_dir': self.config.grading_mode_args.agents_dir,
-                        'config': self.config,
-                        'grading_scores': self.grading_scores,
-                        'run_results': self.run_results
-                    }
-                    tasks.append(task)
+        # Create tasks for all evaluations. Everything they share is sent once to each worker by init_worker.
+        # Runs already in the results file of a resumed session are skipped.
+        done = completed_tasks(results_path)
+        tasks = [
+            (agent_file, nb_players, run_index, run_seeds[run_index])
+            for agent_file in agent_files
+            for nb_players in nb_players_per_session_list
+            for run_index in range(nb_runs_per_session)
+            if (os.path.splitext(agent_file)[0], nb_players, run_index) not in done
+        ]
+        if done:
+            self.logger.info(f"{len(done)} runs already completed, {len(tasks)} left")
         
+        with GradingResultsWriter(results_path) as results_writer:
+            # Reuse the results of the runs whose inputs did not change since they were cached
+            cache = None
+            task_keys = {}
+            if self.config.grading_mode_args.cache_dir:
+                if self.config.seed is None:
+                    self.logger.warning("No seed in the config: run seeds change every session, cached results cannot be reused")
+                cache = ResultCache(self.config.grading_mode_args.cache_dir, self.config)
+                remaining_tasks = []
+                for task in tasks:
+                    agent_file, nb_players, run_index, seed = task
+                    key = cache.key(os.path.join(agents_dir, agent_file), nb_players, seed)
+                    result = cache.get(key)
+                    if result is None:
+                        task_keys[(os.path.splitext(agent_file)[0], nb_players, run_index)] = key
+                        remaining_tasks.append(task)
+                        continue
+                    # The same seed may have been cached for another run index
+                    result['run_index'] = run_index
+                    if result['run_data']:
+                        result['run_data']['run'] = run_index + 1
+                    results_writer.append(result, seed)
+                self.logger.info(f"Result cache: {cache.hits} runs reused, {cache.misses} to simulate")
+                tasks = remaining_tasks
+
+            # Stop scheduling the runs of the agents whose rank is settled, starting from the runs already played
+            early_stopping = None
+            if self.config.grading_mode_args.early_stopping is not None:
+                early_stopping = EarlyStopping(self.config.grading_mode_args.early_stopping)
+                for row in load_results(results_path).itertuples():
+                    if row.status == "ok":
+                        early_stopping.record(row.agent, row.nb_players, row.points)
+                tasks = [task for task in tasks if not early_stopping.is_settled(os.path.splitext(task[0])[0], task[1])]
+
+            if tasks:
+                self.run_grading_pool(tasks, agents_dir, agent_files, nb_runs_per_session, run_seeds, results_writer, cache, task_keys, early_stopping)
+
+        # Generate the Excel files in one pass over all the results
+        results = load_results(results_path)
+        if early_stopping is not None:
+            nb_runs_total = len(agent_files) * len(nb_players_per_session_list) * nb_runs_per_session
+            self.logger.info(
+                f"Early stopping: {len(results)} of {nb_runs_total} runs played, "
+                f"the points of the agents stopped early are extrapolated from their runs"
+            )
+        write_summary(
+            results, grades_excel_path, agent_names, nb_players_per_session_list, nb_runs_per_session,
+            extrapolate=early_stopping is not None,
+        )
+        self.agent_csv_files = write_agent_runs(results, runs_dir, agent_names)
+
+        # Calculate and log the total execution time
+        end_time = datetime.datetime.now()
+        execution_time = end_time - start_time
+        self.logger.info(f"Total execution time: {execution_time}")
+        
+        self.logger.info("Completed all evaluation runs")
+        
+        # Set running to False to stop the server since grading is complete
+        self.logger.info("Grading mode complete - shutting down server")
+        self.running = False
+
+    def run_grading_pool(self, tasks, agents_dir, agent_files, nb_runs_per_session, run_seeds, results_writer, cache, task_keys, early_stopping):
+        """Run grading tasks in a pool of worker processes, or on remote workers, and write their results as they complete"""
         # Configure multiprocessing to use spawn method
         import multiprocessing
         try:
@@ -1166,92 +1047,67 @@ class Server:
         # Import tqdm here to ensure it's available in the main process
         from tqdm import tqdm
         
-        # Use a Pool to run evaluations in parallel
-        worker_count = min(multiprocessing.cpu_count(), len(tasks))
-        self.logger.info(f"Starting multiprocessing pool with {worker_count} workers")
-        
-        # Process all tasks and collect results
-        results = []
-        with multiprocessing.Pool(processes=worker_count) as pool:
-            # Run all evaluations and collect results
-            for result in tqdm(pool.imap_unordered(evaluate_agent_task, tasks), total=len(tasks), desc="Evaluating agents"):
-                # Process each result as it completes
-                agent_name = result['agent_name']
-                nb_players = result['nb_players']
-                
-                # Update scores
-                if result['score'] > 0:
-                    scores[agent_name][nb_players] += result['score']
-                
-                # Update run_results and agent's CSV file if run_data is available
-                if result['run_data']:
-                    run_data = result['run_data']
-                    self.run_results.append(run_data)
-                    
-                    # Write the run data to the agent's Excel file
-                    excel_path = self.agent_csv_files.get(agent_name)
-                    if excel_path:
-                        # Create a DataFrame with the run data
-                        run_df = pd.DataFrame([run_data])
-                        
-                        # Read existing Excel
-                        try:
-                            existing_df = pd.read_excel(excel_path)
-                            # Append the new data
-                            updated_df = pd.concat([existing_df, run_df], ignore_index=True)
-                        except Exception as e:
-                            self.logger.warning(f"Error reading Excel file: {e}")
-                            # If there's an error, just use the new data
-                            updated_df = run_df
-                        
-                        # Make sure all required columns are present
-                        for col in self.runs_columns:
-                            if col not in updated_df.columns:
-                                updated_df[col] = ''
-                        
-                        # Reorder columns to match the original order
-                        updated_df = updated_df[self.runs_columns]
-                        
-                        # Write back to Excel without index
-                        updated_df.to_excel(excel_path, index=False)
-                
-                # Add to results list
-                results.append(result)
-        
-        # Convert scores to DataFrame and add a Total column
-        for agent_name in agent_names:
-            for nb_players in nb_players_per_session_list:
-                df.loc[agent_name, str(nb_players)] = scores[agent_name][nb_players]
-        
-        # Calculate total scores for each agent
-        df['Total'] = df.sum(axis=1)
-        
-        # Calculate ceiling (maximum possible points)
-        ceiling_total = sum(nb_players * nb_runs_per_session for nb_players in nb_players_per_session_list)
-        df['Ceiling'] = ceiling_total
-        
-        # Save DataFrame to Excel
-        df.to_excel(grades_excel_path)
-        self.logger.info(f"Saved grading results to {grades_excel_path}")
-        
-        # Log summary of Excel files created
-        if self.agent_csv_files:
-            self.logger.info(f"Saved detailed run results to individual Excel files in {os.path.dirname(next(iter(self.agent_csv_files.values())))}/")
-            for agent_name, excel_path in self.agent_csv_files.items():
-                self.logger.info(f"  - {agent_name}: {os.path.basename(excel_path)}")
+        game_timeout = self.config.grading_mode_args.game_timeout_seconds
+        cost_model = TaskCostModel(self.config.game_duration_seconds)
+        if self.config.grading_mode_args.coordinator_port is not None:
+            # Serve the tasks to remote workers, longest first
+            scheduler = GradingCoordinator(
+                tasks,
+                self.config,
+                agents_dir,
+                nb_runs_per_session,
+                game_timeout,
+                cost_model,
+                self.config.grading_mode_args.coordinator_host,
+                self.config.grading_mode_args.coordinator_port,
+                self.config.grading_mode_args.coordinator_token,
+            )
         else:
-            self.logger.warning("No run results collected to save to Excel files")
-        
-        # Calculate and log the total execution time
-        end_time = datetime.datetime.now()
-        execution_time = end_time - start_time
-        self.logger.info(f"Total execution time: {execution_time}")
-        
-        self.logger.info("Completed all evaluation runs")
+            # Use a Pool to run evaluations in parallel, longest tasks first
+            worker_count = min(multiprocessing.cpu_count(), len(tasks))
+            self.logger.info(f"Starting multiprocessing pool with {worker_count} workers")
+            scheduler = GradingScheduler(
+                tasks,
+                worker_count,
+                (self.config, self.config.grading_mode_args.agents_dir, nb_runs_per_session, agent_files, game_timeout),
+                game_timeout,
+                cost_model,
+            )
         
-        # Set running to False to stop the server since grading is complete
-        self.logger.info("Grading mode complete - shutting down server")
-        self.running = False
+        # Process all tasks and stream their results to the results file
+        pool_start = time.perf_counter()
+        busy_time = 0.0  # Time spent by the workers in the tasks themselves
+        completed = 0
+        incomplete = 0
+        progress = tqdm(scheduler.results(), total=len(tasks), desc="Evaluating agents")
+        for result in progress:
+            results_writer.append(result, run_seeds[result['run_index']])
+            completed += 1
+            busy_time += result['elapsed']
+            if result['status'] != 'ok':
+                incomplete += 1
+            elif cache is not None:
+                cache.put(task_keys[(result['agent_name'], result['nb_players'], result['run_index'])], result)
+            # A run that timed out or failed says nothing about the rank of its agent
+            if (
+                early_stopping is not None
+                and result['status'] == 'ok'
+                and early_stopping.record(result['agent_name'], result['nb_players'], result['score'])
+            ):
+                progress.total -= scheduler.cancel_cell(result['agent_name'], result['nb_players'])
+                progress.refresh()
+        pool_end = time.perf_counter()
+        pool_time = pool_end - pool_start
+
+        # Whatever the workers did not spend in tasks went to starting them, dispatching tasks and waiting for the last ones
+        overhead = (pool_time * scheduler.worker_count - busy_time) / completed
+        self.logger.info(
+            f"Pool ran {completed} tasks in {pool_time:.1f}s, {busy_time / completed * 1000:.1f}ms per task, "
+            f"dispatch and idle overhead {overhead * 1000:.1f}ms per task, "
+            f"tail {pool_end - scheduler.last_dispatch_time:.1f}s after the last task was sent"
+        )
+        if incomplete:
+            self.logger.warning("%s runs timed out or failed and earned no points, see the status column of the results", incomplete)
 
     def remove_room(self, room_id):
         """Remove a room from the server"""
@@ -1269,6 +1125,7 @@ class Server:
                 if room.running:
                     self.logger.debug(f"Signaling room {room_id} threads to stop.")
                     room.running = False
+                    room.notify_waiting_room()
 
                 # 3. Wait for the game thread to finish if it's running
                 if room.game_thread and room.game_thread.is_alive():
@@ -1278,9 +1135,17 @@ class Server:
                     room.game_thread.join(timeout=2.0)  # Wait a bit
                     if room.game_thread.is_alive():
                         self.logger.warning(
-                            f"Game thread for room {room_id} did not terminate gracefully."
+                            "Game thread for room %s did not terminate gracefully.", room_id
                         )
 
+                # The replay of a game that ended is closed by the room, the one of a game that never started is empty
+                recorder = room.game.recorder
+                if recorder is not None and not recorder.closed:
+                    if room.game.game_started:
+                        recorder.close(room.game)
+                    else:
+                        recorder.discard()
+
                 # 4. Stop and clean up AI clients associated with this room
                 ai_to_remove = []
                 # Use list() to avoid modification during iteration if necessary, although it might not be strictly needed here
@@ -1297,13 +1162,14 @@ class Server:
                         # Use discard to avoid KeyError if name somehow already removed
                         self.rooms[room_id].used_ai_names.discard(ai_name)
 
-                # 5. Now remove the room itself
+                # 5. Now remove the room itself and clear its clients' back-pointers
+                self.sessions.detach_room(room)
                 del self.rooms[room_id]
                 self.logger.debug(f"Room {room_id} removed successfully")
             else:
-                self.logger.warning(f"Attempted to remove non-existent room {room_id}")
+                self.logger.warning("Attempted to remove non-existent room %s", room_id)
         except Exception as e:
-            self.logger.error(f"Error removing room {room_id}: {e}")
+            self.logger.error("Error removing room %s: %s", room_id, e)
 
     def run(self):
         """Main server loop"""
@@ -1317,6 +1183,8 @@ class Server:
         # Register signal handler for graceful shutdown
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
+        if self.config.trace_dir is not None and hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda sig, frame: tracing.dump_to_dir(self.config.trace_dir, "server"))
 
         if not self.config.grading_mode:
             self.logger.info("Server running. Press Ctrl+C to stop.")
@@ -1335,7 +1203,7 @@ class Server:
         self.logger.info("Shutting down server...")
 
         # 1. Disconnect clients (must happen before closing the socket)
-        client_addresses = list(self.addr_to_name.keys())  # Copy keys
+        client_addresses = self.sessions.addresses()
         if client_addresses:
             self.logger.info(f"Disconnecting {len(client_addresses)} clients...")
             for addr in client_addresses:
@@ -1346,7 +1214,7 @@ class Server:
                     # Optional small delay to increase chance of message delivery
                     time.sleep(0.01)
                 except Exception as e:
-                    self.logger.error(f"Error sending disconnect to {addr}: {e}")
+                    self.logger.error("Error sending disconnect to %s: %s", addr, e)
         else:
             self.logger.info("No clients connected to disconnect.")
 
@@ -1370,12 +1238,23 @@ class Server:
                     thread.join(timeout=1.0)  # Use timeout
                     if thread.is_alive():
                         self.logger.warning(
-                            f"Thread {thread.name} did not finish within timeout."
+                            "Thread %s did not finish within timeout.", thread.name
                         )
                 except Exception as e:
-                    self.logger.error(f"Error joining thread {thread.name}: {e}")
+                    self.logger.error("Error joining thread %s: %s", thread.name, e)
         else:
             self.logger.info("No active threads found to join.")
 
+        # Write the stats still queued
+        stats_manager.shutdown()
+
+        if getattr(self, "metrics_server", None) is not None:
+            self.metrics_server.stop()
+
+        # Write the sampled stacks, if profiling
+        sampling_profiler.stop()
+
         self.logger.info("Server shutdown complete")
+        if self.queued_logging is not None:
+            self.queued_logging.stop()
         # No sys.exit(0) here, allow the function to return naturally
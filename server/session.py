@@ -0,0 +1,163 @@
+"""
+Client sessions for the game "I Like Trains"
+
+A ClientSession holds everything the server knows about one connected client.
+The SessionRegistry indexes sessions by address, sciper and nickname, so that
+routing a message or notifying a player does not depend on the number of rooms.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from server.room import Room
+
+
+# Gains of the smoothed RTT and jitter estimators, as in TCP (RFC 6298)
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+
+# Number of retransmission timeouts (RTT + 4 * jitter) added to the base timeout
+TIMEOUT_RTO_FACTOR = 4
+
+
+class ClientSession:
+    """State of a single connected client"""
+
+    __slots__ = (
+        "addr",
+        "nickname",
+        "sciper",
+        "game_mode",
+        "room",
+        "last_activity",
+        "ping_sent_time",
+        "rtt",
+        "rtt_jitter",
+        "rtt_samples",
+    )
+
+    def __init__(
+        self,
+        addr: tuple[str, int],
+        nickname: str,
+        sciper: str,
+        game_mode: str,
+        last_activity: float = 0.0,
+    ) -> None:
+        self.addr = addr
+        self.nickname = nickname
+        self.sciper = sciper
+        self.game_mode = game_mode
+        self.room: Room | None = None  # Room the client plays or watches in
+        self.last_activity = last_activity  # Time of the last message received
+        self.ping_sent_time: float | None = None  # Time of the last ping sent
+        self.rtt: float | None = None  # Smoothed round-trip time, in seconds
+        self.rtt_jitter: float = 0.0  # Mean deviation of the round-trip time, in seconds
+        self.rtt_samples: int = 0
+
+    def record_rtt(self, sample: float) -> None:
+        """Update the smoothed RTT and jitter with a new sample (RFC 6298 estimator)"""
+        if self.rtt is None:
+            self.rtt = sample
+            self.rtt_jitter = sample / 2
+        else:
+            self.rtt_jitter += RTT_BETA * (abs(self.rtt - sample) - self.rtt_jitter)
+            self.rtt += RTT_ALPHA * (sample - self.rtt)
+        self.rtt_samples += 1
+
+    def timeout(self, base: float, maximum: float) -> float:
+        """
+        Time without traffic after which the client is considered disconnected:
+        the base timeout plus a few retransmission timeouts of the client's
+        link, capped at maximum.
+        """
+        if self.rtt is None:
+            return base
+        rto = self.rtt + 4 * self.rtt_jitter
+        return min(maximum, base + TIMEOUT_RTO_FACTOR * rto)
+
+    def link_metrics(self) -> dict:
+        """RTT, jitter and idle time of the client, for logs and metrics"""
+        return {
+            "nickname": self.nickname,
+            "addr": f"{self.addr[0]}:{self.addr[1]}",
+            "room": self.room.id if self.room is not None else None,
+            "rtt_ms": round(self.rtt * 1000, 3) if self.rtt is not None else None,
+            "jitter_ms": round(self.rtt_jitter * 1000, 3),
+            "rtt_samples": self.rtt_samples,
+        }
+
+    def __repr__(self) -> str:
+        room_id = self.room.id if self.room is not None else None
+        return f"ClientSession({self.nickname!r}, sciper={self.sciper!r}, addr={self.addr}, room={room_id})"
+
+
+class SessionRegistry:
+    """
+    Sessions of all connected clients, indexed by address, sciper and nickname.
+    All lookups are O(1).
+    """
+
+    def __init__(self) -> None:
+        self.by_addr: dict[tuple[str, int], ClientSession] = {}
+        self.by_sciper: dict[str, ClientSession] = {}  # Most recent session for each sciper
+        self.by_nickname: dict[str, ClientSession] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_addr)
+
+    def __contains__(self, addr) -> bool:
+        return addr in self.by_addr
+
+    def __iter__(self) -> Iterator[ClientSession]:
+        # Iterate over a copy, sessions are added and removed from other threads
+        return iter(list(self.by_addr.values()))
+
+    def add(self, session: ClientSession) -> None:
+        """Register a session, replacing any previous session at the same address"""
+        self.remove(session.addr)
+        self.by_addr[session.addr] = session
+        self.by_sciper[session.sciper] = session
+        self.by_nickname[session.nickname] = session
+
+    def remove(self, addr) -> ClientSession | None:
+        """Unregister the session at addr and return it, if any"""
+        session = self.by_addr.pop(addr, None)
+        if session is None:
+            return None
+        # Only drop index entries that still point to this session
+        if self.by_sciper.get(session.sciper) is session:
+            del self.by_sciper[session.sciper]
+        if self.by_nickname.get(session.nickname) is session:
+            del self.by_nickname[session.nickname]
+        return session
+
+    def get(self, addr) -> ClientSession | None:
+        return self.by_addr.get(addr)
+
+    def get_by_sciper(self, sciper: str) -> ClientSession | None:
+        return self.by_sciper.get(sciper)
+
+    def get_by_nickname(self, nickname: str) -> ClientSession | None:
+        return self.by_nickname.get(nickname)
+
+    def get_sciper(self, addr) -> str | None:
+        """Return the sciper of the client at addr, or None if unknown"""
+        session = self.by_addr.get(addr)
+        return session.sciper if session is not None else None
+
+    def addresses(self) -> list[tuple[str, int]]:
+        return list(self.by_addr)
+
+    def link_metrics(self) -> list[dict]:
+        """Link metrics of every connected client"""
+        return [session.link_metrics() for session in self]
+
+    def detach_room(self, room: Room) -> None:
+        """Clear the room back-pointer of every client of a room being removed"""
+        for addr in list(room.clients):
+            session = self.by_addr.get(addr)
+            if session is not None and session.room is room:
+                session.room = None
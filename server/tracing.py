@@ -0,0 +1,165 @@
+"""
+Timeline tracing in the Chrome trace format
+
+When tracing is enabled (config.trace_dir, or enable()), the phases of each tick
+(Game.update, check_collisions, get_dirty_state, serialization, socket sends)
+and the agent calls are recorded as complete events in a ring buffer per
+thread, keeping the last RING_SIZE events of each thread. dump() writes them
+as Chrome trace JSON, which can be opened in https://ui.perfetto.dev or
+chrome://tracing. Rooms dump the events of their game thread at the end of
+each game and then drop its buffer, and the server dumps the events of all
+the running threads on SIGUSR1. The buffers of the threads that ended are
+dropped when a new thread records its first event.
+
+When tracing is disabled, a traced function costs one extra call and a flag
+check, and a span one call returning a shared no-op context manager.
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("server.tracing")
+
+RING_SIZE = 100_000
+
+_enabled = False
+_local = threading.local()
+_buffers = []  # [(thread, ring buffer)] of the threads that recorded an event
+_buffers_lock = threading.Lock()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def _buffer():
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = _local.buffer = collections.deque(maxlen=RING_SIZE)
+        thread = threading.current_thread()
+        with _buffers_lock:
+            _buffers[:] = [entry for entry in _buffers if entry[0].is_alive()]
+            _buffers.append((thread, buffer))
+    return buffer
+
+
+def release_current_thread():
+    """Drop the events of the calling thread, e.g. once they are dumped"""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        return
+    _local.buffer = None
+    with _buffers_lock:
+        _buffers[:] = [entry for entry in _buffers if entry[1] is not buffer]
+
+
+def _record(name, start_ns, args):
+    # Appending to a deque is atomic, the dump can read it from another thread
+    _buffer().append((name, start_ns, time.perf_counter_ns() - start_ns, args))
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.start, self.args)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Context manager recording the block as an event, if tracing is enabled"""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, args or None)
+
+
+def traced(name):
+    """Decorator recording each call of a function as an event, if tracing is enabled"""
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, start, None)
+
+        return wrapper
+
+    return decorate
+
+
+def dump(path, current_thread_only=False):
+    """
+    Write the events of all the threads, or of the calling thread only, to a
+    Chrome trace JSON file. Returns the number of events.
+    """
+    with _buffers_lock:
+        buffers = list(_buffers)
+    if current_thread_only:
+        buffers = [entry for entry in buffers if entry[0] is threading.current_thread()]
+    pid = os.getpid()
+    events = []
+    for thread, buffer in buffers:
+        tid = thread.ident
+        events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": thread.name}})
+        for name, start_ns, duration_ns, args in list(buffer):
+            event = {"ph": "X", "name": name, "pid": pid, "tid": tid, "ts": start_ns / 1000, "dur": duration_ns / 1000}
+            if args:
+                event["args"] = args
+            events.append(event)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    count = len(events) - len(buffers)
+    logger.info(f"Wrote {count} trace events to {path}")
+    return count
+
+
+def dump_to_dir(trace_dir, name, current_thread_only=False):
+    """Dump the trace to <trace_dir>/<name>_<timestamp>.json"""
+    path = os.path.join(trace_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    try:
+        return dump(path, current_thread_only)
+    except OSError as e:
+        logger.error(f"Error writing trace to {path}: {e}")
+        return 0
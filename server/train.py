@@ -27,7 +27,7 @@ BOOST_INTENSITY = 3  # Intensity of speed boost
 
 class Train:
     def __init__(self, x, y, nickname, color, handle_train_death, tick_rate, reference_tick_rate):
-        server_logger.debug(f"Creating train {nickname} at position {x}, {y}")
+        server_logger.debug("Creating train %s at position %s, %s", nickname, x, y)
         self.position = (x, y)
         self.wagons = []
         self.new_direction = Move.RIGHT.value
@@ -103,7 +103,7 @@ class Train:
             required_ticks = int((BOOST_COOLDOWN_DURATION + BOOST_DURATION) * self.reference_tick_rate)
             
             if ticks_elapsed >= required_ticks:
-                server_logger.debug(f"Resetting cooldown for train {self.nickname}")
+                server_logger.debug("Resetting cooldown for train %s", self.nickname)
                 # Reset cooldown
                 self.boost_cooldown_active = False
                 self._dirty["boost_cooldown_active"] = True
@@ -152,7 +152,7 @@ class Train:
             and not self.speed_boost_active
             and len(self.wagons) > 0
         ):
-            server_logger.debug(f"Applying speed boost to train {self.nickname}")
+            server_logger.debug("Applying speed boost to train %s", self.nickname)
             # Get the last wagon position
             last_wagon_pos = self.wagons[-1]
 
@@ -167,7 +167,7 @@ class Train:
             self.speed_boost_timer = BOOST_DURATION  # 1 second boost
 
             # Start cooldown
-            server_logger.debug(f"Starting cooldown for train {self.nickname}")
+            server_logger.debug("Starting cooldown for train %s", self.nickname)
             self.boost_cooldown_active = True
             self.start_boost_cooldown_tick = self.current_tick
             self._dirty["boost_cooldown_active"] = True
@@ -181,7 +181,7 @@ class Train:
             ticks_elapsed = self.current_tick - self.start_boost_cooldown_tick
             return max(0, self.get_boost_cooldown_ticks() - ticks_elapsed)
         else:
-            server_logger.warning(f"Train {self.nickname} not found in train_boost_cooldown_ticks")
+            server_logger.warning("Train %s not found in train_boost_cooldown_ticks", self.nickname)
             return 0
 
     def get_boost_cooldown_ticks(self):
@@ -201,7 +201,7 @@ class Train:
             self.last_position = self.position
         else:
             server_logger.warning(
-                f"Invalid position for train {self.nickname} before move: {self.position}"
+                "Invalid position for train %s before move: %s", self.nickname, self.position
             )
             self.last_position = (0, 0)
 
@@ -249,7 +249,7 @@ class Train:
                     valid_wagons.append(wagon)
                 else:
                     server_logger.warning(
-                        f"Invalid wagon found in to_dict for train {self.nickname}: {wagon}, skipping"
+                        "Invalid wagon found in to_dict for train %s: %s, skipping", self.nickname, wagon
                     )
             data["wagons"] = valid_wagons
             self._dirty["wagons"] = False
@@ -300,10 +300,7 @@ class Train:
     def check_collisions_with_trains(self, new_position, all_trains):
         for wagon_pos in self.wagons:
             if new_position == wagon_pos:
-                collision_msg = (
-                    f"Train {self.nickname} collided with its own wagon at {wagon_pos}"
-                )
-                server_logger.info(collision_msg)
+                server_logger.info("Train %s collided with its own wagon at %s", self.nickname, wagon_pos)
                 death_reason = "self_collision"
                 self.handle_death([self.nickname], death_reason)
                 return True
@@ -314,10 +311,7 @@ class Train:
                 continue
 
             if new_position == train.position:
-                collision_msg = (
-                    f"Train {self.nickname} collided with train {train.nickname}"
-                )
-                server_logger.info(collision_msg)
+                server_logger.info("Train %s collided with train %s", self.nickname, train.nickname)
                 death_reason = "collision_with_train"
                 self.handle_death([self.nickname, train.nickname], death_reason)
                 return True
@@ -325,8 +319,7 @@ class Train:
             # Check collision with wagons
             for wagon_pos in train.wagons:
                 if self.position == wagon_pos:
-                    collision_msg = f"Train {self.nickname} collided with wagon of train {train.nickname}"
-                    server_logger.info(collision_msg)
+                    server_logger.info("Train %s collided with wagon of train %s", self.nickname, train.nickname)
                     death_reason = "collision_with_wagon"
                     self.handle_death([self.nickname], death_reason)
                     return True
@@ -339,7 +332,7 @@ class Train:
         if x < 0 or x >= screen_width or y < 0 or y >= screen_height:
             self.handle_death([self.nickname], "out_of_bounds")
             server_logger.debug(
-                f"Train {self.nickname} is dead: out of the screen. Coordinates: {new_position}"
+                "Train %s is dead: out of the screen. Coordinates: %s", self.nickname, new_position
             )
             return True
         return False